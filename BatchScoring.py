@@ -0,0 +1,88 @@
+"""
+BatchScoring predicts the prices of a whole listing feed without the user interface.
+
+The csv feed is streamed in chunks, every chunk is scored in a single call to the forest spread over all the
+cores, and the predictions are written to an output csv file or saved to saved_price_predictions. Houses with a
+missing feature or a feature outside the range of its column type are left out and reported.
+
+Run it from the command line with:
+    python BatchScoring.py listings.csv --output scored_listings.csv
+    python BatchScoring.py listings.csv --to-database
+"""
+import argparse
+import time
+import pandas as pd
+import DatabaseConnection as dc
+from DataIngestion import CSV_DTYPES, MAX_REPORTED_ROWS, find_bad_rows
+from HousingSchema import FEATURE_COLUMNS, RAW_DTYPES, apply_schema
+from RegressionPrediction import PredictionTrainer
+
+# The column the predictions are written to in the output csv file
+PREDICTION_COLUMN = 'predicted_price'
+
+
+def score_csv(input_path, trainer=None, output_path=None, to_database=False, chunksize=10000, n_jobs=-1) -> dict:
+    """
+    Predicts the price of every house in a csv file.
+    :param input_path: a csv file with at least the feature columns of the model
+    :param trainer: the PredictionTrainer to score with, the cached model is loaded when None
+    :param output_path: a csv file to write the input rows to with a predicted_price column added
+    :param to_database: save the features and predicted prices to saved_price_predictions
+    :param chunksize: the number of houses read and scored at a time
+    :param n_jobs: the number of cores the trees are evaluated on, -1 for all of them
+    :return: a dict with the number of houses scored, the line numbers of the houses rejected, the seconds taken
+             and the rows per second
+    """
+    trainer = PredictionTrainer() if trainer is None else trainer
+    # Read wide nullable types so a bad value rejects its house, the types are only narrowed once checked
+    read_dtypes = {column: CSV_DTYPES[column] for column in FEATURE_COLUMNS}
+    feature_schema = {column: RAW_DTYPES[column] for column in FEATURE_COLUMNS}
+
+    rows_scored = 0
+    rejected_lines = []
+    start_time = time.perf_counter()
+    for chunk in pd.read_csv(input_path, dtype=read_dtypes, chunksize=chunksize):
+        bad_rows = find_bad_rows(chunk, FEATURE_COLUMNS)
+        if bad_rows.any():
+            # The index counts the data rows from 0, the header is line 1
+            rejected_lines.extend((chunk.index[bad_rows] + 2).tolist())
+            chunk = chunk[~bad_rows]
+        if not len(chunk):
+            continue
+        chunk = apply_schema(chunk, feature_schema)
+        predictions = trainer.predict_prices(chunk, n_jobs=n_jobs)
+
+        if output_path is not None:
+            chunk[PREDICTION_COLUMN] = predictions
+            chunk.to_csv(output_path, mode='a' if rows_scored else 'w', header=not rows_scored, index=False)
+        if to_database:
+            with dc.connection() as conn:
+                dc.insert_predictions_into_saved(chunk[FEATURE_COLUMNS].assign(price=predictions), conn)
+
+        rows_scored += len(chunk)
+        elapsed = time.perf_counter() - start_time
+        print(f"{rows_scored:,} houses scored ({rows_scored / elapsed:,.0f} rows/s)")
+    seconds = time.perf_counter() - start_time
+    if rejected_lines:
+        print(f"{len(rejected_lines):,} houses rejected for missing or out of range features, lines "
+              f"{', '.join(map(str, rejected_lines[:MAX_REPORTED_ROWS]))}"
+              f"{' ...' if len(rejected_lines) > MAX_REPORTED_ROWS else ''}")
+
+    return {'rows': rows_scored, 'rejected_lines': rejected_lines, 'seconds': seconds,
+            'rows_per_second': rows_scored / seconds if seconds else 0.0}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Predict the prices of every house in a csv listing feed.')
+    parser.add_argument('input_path', help='the csv feed to score')
+    parser.add_argument('--output', dest='output_path', help='the csv file to write the scored feed to')
+    parser.add_argument('--to-database', action='store_true', help='save the predictions to saved_price_predictions')
+    parser.add_argument('--chunksize', type=int, default=10000, help='houses read and scored at a time')
+    parser.add_argument('--jobs', type=int, default=-1, help='cores to score on, -1 for all of them')
+    args = parser.parse_args()
+
+    if args.output_path is None and not args.to_database:
+        parser.error('choose where the predictions go with --output and/or --to-database')
+    result = score_csv(args.input_path, output_path=args.output_path, to_database=args.to_database,
+                       chunksize=args.chunksize, n_jobs=args.jobs)
+    print(f"Scored {result['rows']:,} houses in {result['seconds']:.2f}s ({result['rows_per_second']:,.0f} rows/s)")
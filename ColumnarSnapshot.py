@@ -0,0 +1,112 @@
+"""
+ColumnarSnapshot keeps a copy of the house_data_processed table on disk as one .npy file per column.
+
+The files are opened with memory mapping, so loading only touches the pages that are read and several processes
+reading the same snapshot share those pages. The snapshot records the data version of the table it was made
+from and is written again from the database whenever the table has moved on to a newer version or the column
+types of HousingSchema change.
+"""
+import json
+import os
+import shutil
+import numpy as np
+import pandas as pd
+import DatabaseConnection as dc
+import HousingSchema
+
+# The folder that holds the snapshot, next to the database
+snapshot_directory = os.path.join(os.path.dirname(dc.database_location), "house_data_processed.snapshot")
+# The file that names the snapshot currently in use
+current_file = 'current.json'
+
+
+def read_metadata(directory=snapshot_directory):
+    """
+    Reads the description of the snapshot currently in use.
+    :param directory: the folder that holds the snapshot
+    :return: a dict with the version, folder, index name and columns of the snapshot, or None when there is none
+    """
+    try:
+        with open(os.path.join(directory, current_file)) as metadata_file:
+            return json.load(metadata_file)
+    except (OSError, ValueError):
+        return None
+
+
+def write_snapshot(dataframe, version, directory=snapshot_directory):
+    """
+    Writes a DataFrame to disk as one .npy file per column. The new files go into a folder of their own and
+    only replace the current snapshot once they are complete, readers of the old snapshot are not disturbed.
+    :param dataframe: the DataFrame to store, its index is stored as well
+    :param version: the data version of the table the DataFrame came from
+    :param directory: the folder that holds the snapshot
+    :return: the metadata of the new snapshot
+    """
+    version_folder = f"v{version}-{os.getpid()}"
+    version_directory = os.path.join(directory, version_folder)
+    os.makedirs(version_directory, exist_ok=True)
+
+    index_name = dataframe.index.name or 'index'
+    np.save(os.path.join(version_directory, f"{index_name}.npy"), dataframe.index.to_numpy())
+    for column in dataframe.columns:
+        np.save(os.path.join(version_directory, f"{column}.npy"), dataframe[column].to_numpy())
+
+    metadata = {'version': version, 'schema': HousingSchema.SCHEMA_VERSION, 'folder': version_folder,
+                'index': index_name, 'columns': list(dataframe.columns), 'rows': len(dataframe)}
+    temp_file = os.path.join(directory, f"{current_file}.{os.getpid()}.tmp")
+    with open(temp_file, 'w') as metadata_file:
+        json.dump(metadata, metadata_file)
+    os.replace(temp_file, os.path.join(directory, current_file))
+
+    # Remove older snapshots, a folder that is still mapped by another process is left for a later run
+    for folder in os.listdir(directory):
+        if folder != version_folder and os.path.isdir(os.path.join(directory, folder)):
+            shutil.rmtree(os.path.join(directory, folder), ignore_errors=True)
+    return metadata
+
+
+def ensure_snapshot(directory=snapshot_directory):
+    """
+    Makes sure the snapshot matches the current data version of house_data_processed and the column types of
+    HousingSchema, writing it again if not.
+    :param directory: the folder that holds the snapshot
+    :return: the metadata of the current snapshot
+    """
+    with dc.connection() as conn:
+        version = dc.get_data_version(conn)
+        metadata = read_metadata(directory)
+        if metadata is not None and metadata['version'] == version and \
+                metadata.get('schema') == HousingSchema.SCHEMA_VERSION and \
+                os.path.isdir(os.path.join(directory, metadata['folder'])):
+            return metadata
+        housing_data = dc.download_housing_data(conn)
+
+    return write_snapshot(housing_data, version, directory)
+
+
+def load_columns(columns=None, directory=snapshot_directory, mmap_mode='r') -> dict:
+    """
+    Opens columns of the snapshot as memory mapped arrays without reading them into memory.
+    :param columns: the columns to open, every column when None
+    :param directory: the folder that holds the snapshot
+    :param mmap_mode: the numpy memory map mode, 'r' is read only and 'c' is copy on write
+    :return: a dict of numpy memmaps by column name, the index is included under its own name
+    """
+    metadata = ensure_snapshot(directory)
+    version_directory = os.path.join(directory, metadata['folder'])
+    names = [metadata['index']] + (metadata['columns'] if columns is None else list(columns))
+    return {name: np.load(os.path.join(version_directory, f"{name}.npy"), mmap_mode=mmap_mode) for name in names}
+
+
+def load_housing_data(columns=None, directory=snapshot_directory) -> pd.DataFrame:
+    """
+    Loads the processed house data from the snapshot. The arrays are mapped copy on write, so changing the
+    DataFrame never changes the files.
+    :param columns: the columns to load, every column when None
+    :param directory: the folder that holds the snapshot
+    :return: pandas DataFrame containing the processed house data indexed by id
+    """
+    arrays = load_columns(columns, directory, mmap_mode='c')
+    index_name = next(iter(arrays))
+    index = pd.Index(arrays.pop(index_name), name=index_name)
+    return pd.DataFrame(arrays, index=index, copy=False)
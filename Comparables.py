@@ -0,0 +1,118 @@
+"""
+Comparables finds the sold houses closest to a house whose price is predicted.
+
+A BallTree is built over the latitude and longitude of the processed houses with the haversine distance, and
+optionally a second one over the standardized features, so the k nearest comparable sales are found without
+scanning the table. Each index is built once per data version, shared through DataStore and stored in
+ResultCache so the next run loads it instead of building it again.
+"""
+import numpy as np
+import pandas as pd
+from sklearn.neighbors import BallTree
+from sklearn.preprocessing import StandardScaler
+import DataStore
+import ResultCache
+from HousingSchema import FEATURE_COLUMNS
+
+# The number of comparables returned when no number is given
+DEFAULT_COMPARABLES = 5
+# The mean radius of the earth, the haversine distances are in radians on a unit sphere
+EARTH_RADIUS_KM = 6371.0
+
+
+class ComparablesIndex:
+    """
+    The sold houses and a BallTree over either their location or their standardized features.
+    """
+    def __init__(self, housing_data, use_features=False):
+        """
+        :param housing_data: the processed house data including the price, indexed by id
+        :param use_features: index the standardized features instead of the location
+        """
+        self.houses = housing_data[['price'] + FEATURE_COLUMNS]
+        self.use_features = use_features
+        self.scaler = None
+        if use_features:
+            self.scaler = StandardScaler().fit(housing_data[FEATURE_COLUMNS])
+            self.tree = BallTree(self.scaler.transform(housing_data[FEATURE_COLUMNS]))
+        else:
+            self.tree = BallTree(np.radians(housing_data[['lat', 'long']].to_numpy(dtype=np.float64)),
+                                 metric='haversine')
+
+    def _points(self, houses) -> np.ndarray:
+        """
+        Converts the target houses to points in the space of the tree.
+        :param houses: a DataFrame with the feature columns, or an array with a row of features per house
+        """
+        if not isinstance(houses, pd.DataFrame):
+            houses = pd.DataFrame(np.asarray(houses, dtype=np.float64).reshape(-1, len(FEATURE_COLUMNS)),
+                                  columns=FEATURE_COLUMNS)
+        if self.use_features:
+            return self.scaler.transform(houses[FEATURE_COLUMNS])
+        return np.radians(houses[['lat', 'long']].to_numpy(dtype=np.float64))
+
+    def query(self, houses, k=DEFAULT_COMPARABLES) -> pd.DataFrame:
+        """
+        Finds the k nearest sold houses of every target house in one call.
+        :param houses: a DataFrame with the feature columns, or an array with a row of features per house
+        :param k: the number of comparables per target house
+        :return: a DataFrame with one row per comparable, holding the position of its target house, its rank,
+                 its distance (km for the location index, standard deviations for the feature index), its id,
+                 its price and its features
+        """
+        points = self._points(houses)
+        k = min(k, len(self.houses))
+        distances, positions = self.tree.query(points, k=k)
+        if not self.use_features:
+            distances = distances * EARTH_RADIUS_KM
+
+        comparables = self.houses.iloc[positions.ravel()].reset_index()
+        comparables.insert(0, 'target', np.repeat(np.arange(len(points)), k))
+        comparables.insert(1, 'rank', np.tile(np.arange(1, k + 1), len(points)))
+        comparables.insert(2, 'distance', distances.ravel())
+        return comparables
+
+
+def _build_index(use_features):
+    """
+    Builds the index of the processed data, or loads it from the cache when the same data was indexed before.
+    """
+    housing_data = DataStore.get_processed_data()
+    key = ResultCache.fingerprint(housing_data, use_features)
+    index = ResultCache.load('comparables', key)
+    if index is None:
+        index = ComparablesIndex(housing_data, use_features)
+        ResultCache.store('comparables', key, index)
+    return index
+
+
+def get_index(use_features=False) -> ComparablesIndex:
+    """
+    :param use_features: get the index of the standardized features instead of the location
+    :return: the ComparablesIndex of the processed data, built once per data version
+    """
+    return DataStore.memoize(f'comparables_{use_features}', DataStore.PROCESSED_TABLE,
+                             lambda: _build_index(use_features))
+
+
+def nearest_comparables(houses, k=DEFAULT_COMPARABLES, use_features=False) -> pd.DataFrame:
+    """
+    Finds the k nearest sold houses of many target houses.
+    :param houses: a DataFrame with the feature columns, or an array with a row of features per house
+    :param k: the number of comparables per target house
+    :param use_features: compare the standardized features instead of the location
+    :return: the comparables DataFrame described in ComparablesIndex.query
+    """
+    return get_index(use_features).query(houses, k)
+
+
+def find_comparables(lat, long, k=DEFAULT_COMPARABLES) -> pd.DataFrame:
+    """
+    Finds the k sold houses nearest to a location.
+    :param lat: the latitude of the location
+    :param long: the longitude of the location
+    :param k: the number of comparables
+    :return: the comparables DataFrame described in ComparablesIndex.query, nearest first
+    """
+    location = pd.DataFrame({column: [0.0] for column in FEATURE_COLUMNS}).assign(lat=lat, long=long)
+    return get_index().query(location, k)
@@ -0,0 +1,189 @@
+"""
+A module that manages a bounded pool of connections to the sqlite3 database.
+
+Connections are opened once with WAL journaling and tuned pragmas and are then reused. A thread that asks for a
+connection while it already holds one gets the same connection back, so nested calls never wait on themselves.
+The work of a nested with block runs in a savepoint of the outer transaction: it is rolled back on its own when
+the block raises, and only the outermost block commits.
+Statements are cached per connection by sqlite3 itself, which is why callers should use parameterized SQL with
+constant text instead of formatting values into the query.
+"""
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+# Settings applied to every new connection
+DEFAULT_PRAGMAS = {
+    'journal_mode': 'WAL',  # readers no longer block the writer and the writer no longer blocks readers
+    'synchronous': 'NORMAL',  # safe with WAL and avoids a sync on every commit
+    'temp_store': 'MEMORY',
+    'cache_size': -64000,  # 64 MB of page cache per connection
+    'mmap_size': 268435456,  # read pages through a 256 MB memory map
+    'busy_timeout': 5000,  # wait up to 5 seconds for a lock instead of failing straight away
+}
+
+
+class PooledConnection(sqlite3.Connection):
+    """
+    A sqlite3 Connection that goes back to its pool when it is closed instead of being closed for good.
+    While it is held more than once by its thread, commit() leaves the transaction to the outermost holder and
+    rollback() only undoes the work of the innermost with block.
+    """
+    pool = None
+    owner = None
+    depth = 0
+    savepoints = ()
+
+    def close(self):
+        if self.pool is None:
+            super().close()
+        else:
+            self.pool.release(self)
+
+    def commit(self):
+        if self.depth <= 1:
+            super().commit()
+
+    def rollback(self):
+        if self.depth <= 1:
+            super().rollback()
+        elif self.savepoints:
+            self.execute(f"ROLLBACK TO SAVEPOINT {self.savepoints[-1]}")
+        else:
+            raise sqlite3.OperationalError("cannot roll back the transaction of an outer connection block")
+
+
+class ConnectionPool:
+    """
+    A bounded, thread aware pool of connections to a single database file.
+    """
+    def __init__(self, database, max_connections=5, timeout=30.0, pragmas=None, cached_statements=256):
+        """
+        :param database: the path to the sqlite3 database file
+        :param max_connections: the most connections that can be checked out at the same time
+        :param timeout: seconds to wait for a free connection before giving up
+        :param pragmas: the pragmas applied to new connections, DEFAULT_PRAGMAS when None
+        :param cached_statements: how many prepared statements each connection keeps
+        """
+        self.database = database
+        self.max_connections = max_connections
+        self.timeout = timeout
+        self.pragmas = DEFAULT_PRAGMAS if pragmas is None else pragmas
+        self.cached_statements = cached_statements
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(max_connections)
+        self._idle = []
+        self._checked_out = {}
+
+    def open_connection(self):
+        """
+        Opens a connection with the settings of the pool that is not part of the pool and does not take one of
+        its slots, for callers that keep a connection open for a long time.
+        :return: a sqlite3 Connection, the caller closes it
+        """
+        connection = sqlite3.connect(self.database, factory=PooledConnection, check_same_thread=False,
+                                     cached_statements=self.cached_statements)
+        for pragma, value in self.pragmas.items():
+            connection.execute(f"PRAGMA {pragma}={value}")
+        return connection
+
+    def _open(self):
+        """
+        Opens and configures a new connection for the pool.
+        :return: a PooledConnection
+        """
+        connection = self.open_connection()
+        connection.pool = self
+        return connection
+
+    def acquire(self):
+        """
+        Checks a connection out of the pool. Calling this again from the same thread before the connection
+        is released returns the same connection.
+        :return: a PooledConnection, release it with close() or release()
+        """
+        thread_id = threading.get_ident()
+        with self._lock:
+            connection = self._checked_out.get(thread_id)
+            if connection is not None:
+                connection.depth += 1
+                return connection
+
+        if not self._slots.acquire(timeout=self.timeout):
+            raise sqlite3.OperationalError(f"no free database connection after {self.timeout} seconds")
+        try:
+            with self._lock:
+                connection = self._idle.pop() if self._idle else self._open()
+                connection.owner = thread_id
+                connection.depth = 1
+                self._checked_out[thread_id] = connection
+        except Exception:
+            self._slots.release()
+            raise
+        return connection
+
+    def release(self, connection):
+        """
+        Gives a connection back to the pool once every acquire() of its thread has been matched.
+        Work that was not committed is rolled back so the next user starts clean.
+        :param connection: a connection from acquire()
+        """
+        with self._lock:
+            if connection.owner is None:
+                return  # already back in the pool
+            connection.depth -= 1
+            if connection.depth > 0:
+                return
+            del self._checked_out[connection.owner]
+            connection.owner = None
+            if connection.in_transaction:
+                connection.rollback()
+            self._idle.append(connection)
+        self._slots.release()
+
+    @contextmanager
+    def connection(self):
+        """
+        Checks out a connection for the length of a with block. The work is committed when the block
+        finishes and rolled back when it raises. A block nested in another block of the same thread works in a
+        savepoint instead, which is released into the outer transaction or rolled back on its own.
+        """
+        connection = self.acquire()
+        if connection.depth == 1:
+            try:
+                yield connection
+                connection.commit()
+            except Exception:
+                connection.rollback()
+                raise
+            finally:
+                self.release(connection)
+            return
+
+        savepoint = f"pool_block_{connection.depth}"
+        try:
+            # Open the outer transaction first, otherwise releasing the savepoint would commit it
+            if not connection.in_transaction:
+                connection.execute("BEGIN")
+            connection.execute(f"SAVEPOINT {savepoint}")
+            connection.savepoints = connection.savepoints + (savepoint,)
+            try:
+                yield connection
+            except Exception:
+                connection.execute(f"ROLLBACK TO SAVEPOINT {savepoint}")
+                raise
+            finally:
+                connection.savepoints = connection.savepoints[:-1]
+                connection.execute(f"RELEASE SAVEPOINT {savepoint}")
+        finally:
+            self.release(connection)
+
+    def close_all(self):
+        """
+        Closes the idle connections of the pool.
+        """
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for connection in idle:
+            connection.pool = None
+            connection.close()
@@ -0,0 +1,156 @@
+"""
+DataIngestion loads a county sales extract such as misc/kc_house_data.csv into the kc_housing_data_raw table.
+
+The csv file is streamed in fixed size chunks so the memory used stays the same whatever the size of the file.
+All chunks are written inside a single transaction and the indexes are built once the rows are loaded.
+Rows with a missing value or a value outside the range of its column type are left out and reported instead of
+stopping the load.
+
+Run it from the command line with:
+    python DataIngestion.py misc/kc_house_data.csv
+"""
+import argparse
+import os
+import time
+import numpy as np
+import pandas as pd
+import DatabaseConnection as dc
+from HousingSchema import RAW_DTYPES
+
+RAW_TABLE = 'kc_housing_data_raw'
+
+# The sql types of the columns, these match the table the project was originally built with
+RAW_SQL_TYPES = {
+    'id': 'INTEGER', 'date': 'DATETIME', 'price': 'DOUBLE', 'bedrooms': 'INTEGER', 'bathrooms': 'DOUBLE',
+    'sqft_living': 'INTEGER', 'sqft_lot': 'INTEGER', 'floors': 'DOUBLE', 'waterfront': 'INTEGER', 'view': 'INTEGER',
+    'condition': 'INTEGER', 'grade': 'INTEGER', 'sqft_above': 'INTEGER', 'sqft_basement': 'INTEGER',
+    'yr_built': 'INTEGER', 'yr_renovated': 'INTEGER', 'zipcode': 'INTEGER', 'lat': 'DOUBLE', 'long': 'DOUBLE',
+    'sqft_living15': 'INTEGER', 'sqft_lot15': 'INTEGER'
+}
+
+# The indexes that are rebuilt after every load
+RAW_INDEXES = {
+    'ix_kc_housing_data_raw_id': 'id',
+    'ix_kc_housing_data_raw_zipcode': 'zipcode',
+}
+
+# The format of the date column in the extract, for example 20141013T000000
+CSV_DATE_FORMAT = '%Y%m%dT%H%M%S'
+
+# The integer columns are read as wide nullable integers so a bad value rejects its row instead of the whole load
+CSV_DTYPES = {column: 'Int64' if dtype.startswith('int') else dtype for column, dtype in RAW_DTYPES.items()}
+# The line numbers of at most this many rejected rows are printed
+MAX_REPORTED_ROWS = 10
+
+
+def find_bad_rows(chunk, columns=None) -> pd.Series:
+    """
+    Finds the rows of a chunk that do not fit the raw column types.
+    :param chunk: a DataFrame read from the extract with CSV_DTYPES
+    :param columns: the columns that are checked, every raw column when None
+    :return: a boolean Series that is True for every row with a missing value or an integer out of range
+    """
+    columns = list(RAW_DTYPES) if columns is None else list(columns)
+    bad_rows = chunk[columns].isna().any(axis=1)
+    for column in columns:
+        dtype = RAW_DTYPES[column]
+        if dtype.startswith('int'):
+            limits = np.iinfo(dtype)
+            values = chunk[column]
+            bad_rows |= ((values < limits.min) | (values > limits.max)).fillna(False).astype(bool)
+    return bad_rows
+
+
+def parse_dates(chunk):
+    """
+    Converts the date column of a chunk from the extract format to the ISO format sqlite understands.
+    :param chunk: a DataFrame read from the extract
+    :return: the same DataFrame with the date column converted
+    """
+    dates = pd.to_datetime(chunk['date'], format=CSV_DATE_FORMAT)
+    chunk['date'] = dates.dt.strftime('%Y-%m-%d %H:%M:%S')
+    return chunk
+
+
+def _load(csv_path, connection, chunksize, replace):
+    """
+    Writes the extract into the raw table inside a single transaction.
+    :return: the number of rows loaded and the line numbers of the rows rejected
+    """
+    columns = list(RAW_DTYPES)
+    column_list = ', '.join(f'"{column}"' for column in columns)
+    insert_sql = f"INSERT INTO {RAW_TABLE}({column_list}) VALUES({', '.join('?' for _ in columns)})"
+
+    # Inside a with block of an outer connection block the pool has already opened the transaction
+    if not connection.in_transaction:
+        connection.execute("BEGIN")
+    # Drop the indexes so they are built once at the end instead of being updated row by row
+    for index_name in RAW_INDEXES:
+        connection.execute(f"DROP INDEX IF EXISTS {index_name}")
+    if replace:
+        connection.execute(f"DROP TABLE IF EXISTS {RAW_TABLE}")
+    column_types = ', '.join(f'"{column}" {sql_type}' for column, sql_type in RAW_SQL_TYPES.items())
+    connection.execute(f"CREATE TABLE IF NOT EXISTS {RAW_TABLE} ({column_types})")
+
+    rows_loaded = 0
+    rejected_lines = []
+    start_time = time.perf_counter()
+    for chunk in pd.read_csv(csv_path, usecols=columns, dtype=CSV_DTYPES, chunksize=chunksize):
+        bad_rows = find_bad_rows(chunk)
+        if bad_rows.any():
+            # The index counts the data rows from 0, the header is line 1
+            rejected_lines.extend((chunk.index[bad_rows] + 2).tolist())
+            chunk = chunk[~bad_rows]
+        chunk = parse_dates(chunk.astype(RAW_DTYPES))
+        connection.executemany(insert_sql, chunk[columns].itertuples(index=False, name=None))
+        rows_loaded += len(chunk)
+        elapsed = time.perf_counter() - start_time
+        print(f"{rows_loaded:,} rows loaded ({rows_loaded / elapsed:,.0f} rows/s)")
+
+    for index_name, column in RAW_INDEXES.items():
+        connection.execute(f'CREATE INDEX {index_name} ON {RAW_TABLE}("{column}")')
+    dc.bump_data_version(connection, RAW_TABLE)
+    connection.commit()
+    if rejected_lines:
+        print(f"{len(rejected_lines):,} rows rejected for missing or out of range values, lines "
+              f"{', '.join(map(str, rejected_lines[:MAX_REPORTED_ROWS]))}"
+              f"{' ...' if len(rejected_lines) > MAX_REPORTED_ROWS else ''}")
+    return rows_loaded, rejected_lines
+
+
+def ingest_csv(csv_path, connection=None, chunksize=50000, replace=True) -> dict:
+    """
+    Streams a sales extract into the kc_housing_data_raw table.
+    :param csv_path: the path of the csv extract
+    :param connection: a sqlite3 Connection, a pooled connection to the project database is used when None
+    :param chunksize: the number of rows read and written at a time
+    :param replace: replace the rows already in the table instead of adding to them
+    :return: a dict with the number of rows loaded, the line numbers of the rows rejected, the seconds taken and
+             the rows per second
+    """
+    start_time = time.perf_counter()
+    if connection is None:
+        with dc.connection() as conn:
+            rows_loaded, rejected_lines = _load(csv_path, conn, chunksize, replace)
+    else:
+        try:
+            rows_loaded, rejected_lines = _load(csv_path, connection, chunksize, replace)
+        except Exception:
+            connection.rollback()
+            raise
+    seconds = time.perf_counter() - start_time
+
+    return {'rows': rows_loaded, 'rejected_lines': rejected_lines, 'seconds': seconds,
+            'rows_per_second': rows_loaded / seconds if seconds else 0.0}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Load a house sales csv extract into kc_housing_data_raw.')
+    parser.add_argument('csv_path', nargs='?', default=os.path.join(dc.current_directory, 'misc', 'kc_house_data.csv'),
+                        help='the csv extract to load')
+    parser.add_argument('--chunksize', type=int, default=50000, help='rows read and written at a time')
+    parser.add_argument('--append', action='store_true', help='add to the rows already in the table')
+    args = parser.parse_args()
+
+    result = ingest_csv(args.csv_path, chunksize=args.chunksize, replace=not args.append)
+    print(f"Loaded {result['rows']:,} rows in {result['seconds']:.2f}s ({result['rows_per_second']:,.0f} rows/s)")
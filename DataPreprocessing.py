@@ -2,18 +2,22 @@
 Data Preprocessing handles processing and analyzing the raw housing data and making it
 usable for KMeansAnalysis and RegressionPrediction modules, as well as generating some
 figures that describe how/why the data was filtered the way it was.
+
+The raw data is downloaded the first time it is used and shared through DataStore, the module attribute
+house_data_raw reads from it.
 """
-import matplotlib.pyplot as plt
-import seaborn as sns
 import DatabaseConnection as dc
+import DataStatistics
+import DataStore
+import PriceTiles
 from matplotlib.figure import Figure
 
-# Open the database connection
-conn = dc.connect()
-# Download the data from the database
-house_data_raw = dc.download_raw_housing_data(conn)
-# Drop null data
-house_data_raw.dropna()
+
+def __getattr__(name):
+    # DataPreprocessing.house_data_raw is downloaded on first access
+    if name == 'house_data_raw':
+        return DataStore.get_raw_data()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 def create_plots():
     """
@@ -21,25 +25,29 @@ def create_plots():
 
     Creates an outliers plot of the price showing the distribution across the dataset.
 
+    Both are drawn from the precomputed summary of the raw data, so the table is not read again.
+
     :return: a Figure object that holds the information about two subplots
     """
 
+    summary = DataStatistics.get_summary(DataStore.RAW_TABLE)
     figure = Figure(figsize=(5,8))
     sub_fig_corr = figure.add_subplot(211)
-    house_data_raw.corr()['price'].sort_values().plot(kind='barh', ax=sub_fig_corr)
+    DataStatistics.price_correlations(summary).sort_values().plot(kind='barh', ax=sub_fig_corr)
     sub_fig_corr.set(title='Price Correlation Chart')
 
     sub_fig_outliers = figure.add_subplot(212)
-    price_data = house_data_raw['price']
-    sns.kdeplot(data=price_data, shade=True, ax=sub_fig_outliers)
+    price_density = DataStatistics.price_density(summary)
+    sub_fig_outliers.fill_between(price_density.index, price_density.values, alpha=0.25)
+    sub_fig_outliers.plot(price_density.index, price_density.values)
     sub_fig_outliers.set(xlabel='Price (millions)', ylabel='Density Value', title='Price Distribution')
-    plt.tight_layout()
+    figure.tight_layout()
     return figure
 
 def upload_to_db_post_processed_data():
     """
     Calls the database upload command after the features are filtered then the DataFrame is
-    uploaded to the database.
+    uploaded to the database. Only the houses that changed since the last upload are written.
 
     Chosen features: price, bedrooms, bathrooms, sqft_living, floors, waterfront, view, grade,
     sqft_basement, yr_built, yr_renovated, lat, long
@@ -47,8 +55,16 @@ def upload_to_db_post_processed_data():
     Not chosen: id, date, sqft_lot, condition, sqft_above, zipcode, sqft_living15, sqft_lot15
     These were not chose because they either have low correlation with the price or they are
     redundant to another feature.
+
+    The price tiles are brought up to date with the new data as well.
+
+    :return: a dict with the number of houses inserted, updated and deleted, the new data version and the
+             number of price tiles aggregated again
     """
     house_features = ['price', 'bedrooms', 'bathrooms', 'sqft_living', 'floors',
                       'waterfront', 'view', 'grade', 'sqft_basement', 'yr_built', 'yr_renovated', 'lat', 'long']
-    house_data = house_data_raw[house_features]
-    dc.upload_processed_data(house_data, conn)
+    house_data = DataStore.get_raw_data()[house_features]
+    with dc.connection() as conn:
+        changes = dc.upload_processed_data(house_data, conn)
+        changes['tiles_updated'] = PriceTiles.update_price_tiles(house_data, conn)['tiles_updated']
+    return changes
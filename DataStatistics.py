@@ -0,0 +1,209 @@
+"""
+DataStatistics summarizes the house data in a single streaming pass for the Data Analysis tab.
+
+The table is read in chunks. The correlations come from mergeable accumulators of the count, the means and
+the co-moments of the numeric columns, and the price density from a fixed width histogram that is smoothed
+with a Gaussian kernel through an FFT. Neither grows with the number of rows, so the summary stays a few
+thousand numbers whatever the size of the table.
+
+Summaries are stored in the data_summaries table by table and data version and are only computed again when
+the table changes.
+"""
+import json
+import numpy as np
+import pandas as pd
+import DatabaseConnection as dc
+import DataStore
+
+# The width of the price histogram bins in dollars
+PRICE_BIN_WIDTH = 10000
+# The rows read at a time
+CHUNKSIZE = 50000
+# The kernel is cut off this many bandwidths from its centre, the density grid reaches as far past the prices
+KERNEL_BANDWIDTHS = 4
+# Stored summaries of an older layout are computed again
+SUMMARY_FORMAT = 2
+
+
+class MomentAccumulator:
+    """
+    The count, means and co-moments of a set of columns. Accumulators of different chunks can be merged in any
+    order, and the correlation of the merged data is exactly that of all the rows together.
+    """
+    def __init__(self, columns):
+        self.columns = list(columns)
+        self.count = 0
+        self.mean = np.zeros(len(self.columns))
+        self.comoment = np.zeros((len(self.columns), len(self.columns)))
+
+    def update(self, chunk):
+        """
+        Adds the rows of a chunk.
+        :param chunk: a DataFrame with the columns of the accumulator
+        """
+        values = chunk[self.columns].to_numpy(dtype=np.float64)
+        if not len(values):
+            return
+        other = MomentAccumulator(self.columns)
+        other.count = len(values)
+        other.mean = values.mean(axis=0)
+        centered = values - other.mean
+        other.comoment = centered.T @ centered
+        self.merge(other)
+
+    def merge(self, other):
+        """
+        Adds the rows summarized by another accumulator of the same columns.
+        :param other: a MomentAccumulator
+        """
+        if not other.count:
+            return
+        count = self.count + other.count
+        delta = other.mean - self.mean
+        self.comoment = self.comoment + other.comoment + np.outer(delta, delta) * self.count * other.count / count
+        self.mean = self.mean + delta * other.count / count
+        self.count = count
+
+    def std(self) -> np.ndarray:
+        """
+        :return: the sample standard deviation of every column
+        """
+        return np.sqrt(np.diag(self.comoment) / max(self.count - 1, 1))
+
+    def correlation(self) -> pd.DataFrame:
+        """
+        :return: the Pearson correlation matrix of the columns, NaN for columns that never change
+        """
+        spread = np.sqrt(np.diag(self.comoment))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            correlation = self.comoment / np.outer(spread, spread)
+        return pd.DataFrame(correlation, index=self.columns, columns=self.columns)
+
+
+class Histogram:
+    """
+    Counts of values in fixed width bins starting at zero. The bins grow as larger values arrive so histograms
+    of different chunks can be merged by adding their counts.
+    """
+    def __init__(self, bin_width):
+        self.bin_width = bin_width
+        self.counts = np.zeros(0, dtype=np.int64)
+
+    def update(self, values):
+        """
+        Adds values, which must not be negative.
+        :param values: an array of values
+        """
+        bins = np.floor(np.asarray(values, dtype=np.float64) / self.bin_width).astype(np.int64)
+        self.merge_counts(np.bincount(bins))
+
+    def merge_counts(self, counts):
+        """
+        Adds the counts of another histogram with the same bin width.
+        :param counts: an array of bin counts
+        """
+        if len(counts) > len(self.counts):
+            self.counts = np.pad(self.counts, (0, len(counts) - len(self.counts)))
+        self.counts[:len(counts)] += counts
+
+
+def binned_kde(counts, bin_width, bandwidth) -> np.ndarray:
+    """
+    Estimates a Gaussian kernel density from histogram counts by convolving them with the kernel sampled at the
+    bin spacing, through an FFT so the cost depends on the number of bins rather than the number of values.
+    :param counts: the histogram counts
+    :param bin_width: the width of the bins
+    :param bandwidth: the standard deviation of the Gaussian kernel
+    :return: the density at the centre of every bin
+    """
+    half_width = max(int(np.ceil(KERNEL_BANDWIDTHS * bandwidth / bin_width)), 1)
+    offsets = np.arange(-half_width, half_width + 1) * bin_width
+    kernel = np.exp(-0.5 * (offsets / bandwidth) ** 2) / (bandwidth * np.sqrt(2 * np.pi))
+
+    # Zero pad to the full length of the convolution so the FFT does not wrap around
+    size = len(counts) + len(kernel) - 1
+    convolved = np.fft.irfft(np.fft.rfft(counts, size) * np.fft.rfft(kernel, size), size)
+    density = convolved[half_width:half_width + len(counts)] / counts.sum()
+    return np.clip(density, 0, None)
+
+
+def compute_summary(chunks) -> dict:
+    """
+    Summarizes a table in one pass over its chunks.
+    :param chunks: an iterable of DataFrames with a price column
+    :return: a dict of plain numbers and lists that can be stored as JSON, with no correlations and an empty
+             density when there are no rows
+    """
+    moments = None
+    histogram = Histogram(PRICE_BIN_WIDTH)
+    for chunk in chunks:
+        if moments is None:
+            moments = MomentAccumulator(chunk.select_dtypes('number').columns)
+        moments.update(chunk)
+        histogram.update(chunk['price'])
+
+    summary = {'format': SUMMARY_FORMAT, 'rows': 0, 'columns': [], 'price_correlations': [], 'means': [],
+               'stds': [], 'price_bin_width': PRICE_BIN_WIDTH, 'price_counts': [], 'price_bandwidth': None,
+               'price_density_start': 0.0, 'price_density': []}
+    if moments is None or not moments.count:
+        return summary
+
+    # Scott's rule, the same bandwidth seaborn uses for its KDE plots
+    price_std = moments.std()[moments.columns.index('price')]
+    bandwidth = max(price_std * moments.count ** (-1 / 5), PRICE_BIN_WIDTH / 2)
+
+    # The density is estimated from the lowest to the highest price bin and as far as the kernel reaches past them
+    filled_bins = np.flatnonzero(histogram.counts)
+    margin = int(np.ceil(KERNEL_BANDWIDTHS * bandwidth / PRICE_BIN_WIDTH))
+    grid_counts = np.pad(histogram.counts[filled_bins[0]:filled_bins[-1] + 1], margin)
+    density = binned_kde(grid_counts, PRICE_BIN_WIDTH, bandwidth)
+
+    summary.update(rows=moments.count, columns=moments.columns,
+                   price_correlations=moments.correlation()['price'].tolist(),
+                   means=moments.mean.tolist(), stds=moments.std().tolist(),
+                   price_counts=histogram.counts.tolist(), price_bandwidth=bandwidth,
+                   price_density_start=(filled_bins[0] - margin + 0.5) * PRICE_BIN_WIDTH,
+                   price_density=density.tolist())
+    return summary
+
+
+def _summarize_table(table_name):
+    """
+    Loads the stored summary of the current data version of a table, computing and storing it when missing.
+    """
+    with dc.connection() as conn:
+        version = dc.get_data_version(conn, table_name)
+        summary = dc.load_data_summary(conn, table_name, version)
+        if summary is None or json.loads(summary).get('format') != SUMMARY_FORMAT:
+            if table_name == DataStore.RAW_TABLE:
+                chunks = dc.download_raw_housing_data(conn, chunksize=CHUNKSIZE)
+            else:
+                chunks = dc.download_housing_data(conn, chunksize=CHUNKSIZE)
+            summary = json.dumps(compute_summary(chunks))
+            dc.save_data_summary(conn, table_name, version, summary)
+    return json.loads(summary)
+
+
+def get_summary(table_name=DataStore.RAW_TABLE) -> dict:
+    """
+    :param table_name: kc_housing_data_raw or house_data_processed
+    :return: the summary dict built by compute_summary for the current data version of the table
+    """
+    return DataStore.memoize(f'summary_{table_name}', table_name, lambda: _summarize_table(table_name))
+
+
+def price_correlations(summary) -> pd.Series:
+    """
+    :param summary: a summary dict
+    :return: the correlation of every numeric column with the price
+    """
+    return pd.Series(summary['price_correlations'], index=summary['columns'])
+
+
+def price_density(summary) -> pd.Series:
+    """
+    :param summary: a summary dict
+    :return: the estimated density of the prices, indexed by price
+    """
+    centers = summary['price_density_start'] + np.arange(len(summary['price_density'])) * summary['price_bin_width']
+    return pd.Series(summary['price_density'], index=centers)
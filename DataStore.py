@@ -0,0 +1,82 @@
+"""
+DataStore loads the house data the first time it is needed and shares it between the modules of the program.
+
+Each value is remembered together with the data version of the table it was made from. When the version of
+that table moves on, for example after the processed data is reset, the value is loaded again on next access.
+The DataFrames handed out are shared, callers must not change them in place.
+"""
+import threading
+import DatabaseConnection as dc
+import ColumnarSnapshot
+
+RAW_TABLE = 'kc_housing_data_raw'
+PROCESSED_TABLE = 'house_data_processed'
+
+# The loaded values by name, each entry is a (data version, value) pair
+_store = {}
+_lock = threading.RLock()
+# One lock per name, so different values can be loaded at the same time by different threads
+_name_locks = {}
+
+
+def data_version(table_name=PROCESSED_TABLE) -> int:
+    """
+    Reads the current data version of a table.
+    :param table_name: the table to get the version of
+    :return: the version of the table
+    """
+    with dc.connection() as conn:
+        return dc.get_data_version(conn, table_name)
+
+
+def memoize(name, table_name, loader):
+    """
+    Returns a value derived from a table, calling the loader only when the value has not been loaded yet or the
+    table has changed since it was.
+    :param name: the name the value is stored under
+    :param table_name: the table the value is derived from
+    :param loader: a function without arguments that builds the value
+    :return: the stored or newly loaded value
+    """
+    version = data_version(table_name)
+    with _lock:
+        name_lock = _name_locks.setdefault(name, threading.RLock())
+    with name_lock:
+        entry = _store.get(name)
+        if entry is not None and entry[0] == version:
+            return entry[1]
+        value = loader()
+        with _lock:
+            _store[name] = (version, value)
+        return value
+
+
+def invalidate(name=None):
+    """
+    Forgets a stored value so it is loaded again on next access.
+    :param name: the value to forget, every value when None
+    """
+    with _lock:
+        if name is None:
+            _store.clear()
+        else:
+            _store.pop(name, None)
+
+
+def _load_raw_data():
+    with dc.connection() as conn:
+        return dc.download_raw_housing_data(conn)
+
+
+def get_raw_data():
+    """
+    :return: pandas DataFrame containing the raw house data
+    """
+    return memoize('raw_data', RAW_TABLE, _load_raw_data)
+
+
+def get_processed_data():
+    """
+    :return: pandas DataFrame containing the processed house data
+    """
+    return memoize('processed_data', PROCESSED_TABLE, ColumnarSnapshot.load_housing_data)
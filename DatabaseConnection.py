@@ -4,63 +4,256 @@ A module that handles communication with the database.
 Upload and download data from the database.
 Get a connection object to the database.
 Handle users in the database.
+
+Connections come from a shared pool, prefer `with connection() as conn:` so they are always given back.
 """
-import sqlite3
 from sqlite3 import Error
 import pandas as pd
 import os
+from ConnectionPool import ConnectionPool
+import HousingSchema
 
-# The path to the database
+# The path to the database, the MCCORE_DATABASE environment variable points the program at another copy of it
 current_directory = os.path.dirname(os.path.abspath(__file__))
-database_location = os.path.join(current_directory, "mccore_investing_database.db")
+database_location = os.environ.get('MCCORE_DATABASE', os.path.join(current_directory, "mccore_investing_database.db"))
+
+# The shared pool every caller checks connections out of
+pool = ConnectionPool(database_location)
+
+# Parameterized statements, sqlite3 prepares each of them once per pooled connection
+LOGIN_USER_SQL = "SELECT 1 FROM users WHERE username = ? AND password = ? LIMIT 1"
+REGISTER_USER_SQL = "INSERT INTO users(username, password, user_type) VALUES(?, ?, 'user')"
+SUBMIT_ERROR_REPORT_SQL = "INSERT INTO error_reports(report, data_err, UI_err, func_err) VALUES(?, ?, ?, ?)"
+INSERT_SAVED_SQL = "INSERT INTO saved_price_predictions(bedrooms, bathrooms, sqft_living, floors, waterfront, " \
+                   "view, grade, sqft_basement, yr_built, yr_renovated, lat, long, price) " \
+                   "VALUES(?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)"
+
+# Statements for the data version counters and the row hashes of the processed data
+CREATE_DATA_VERSIONS_SQL = "CREATE TABLE IF NOT EXISTS data_versions(table_name TEXT PRIMARY KEY, " \
+                           "version INTEGER NOT NULL)"
+GET_DATA_VERSION_SQL = "SELECT version FROM data_versions WHERE table_name = ?"
+SET_DATA_VERSION_SQL = "INSERT OR REPLACE INTO data_versions(table_name, version) VALUES(?, ?)"
+CREATE_PROCESSED_HASHES_SQL = "CREATE TABLE IF NOT EXISTS house_data_processed_hashes(id INTEGER PRIMARY KEY, " \
+                              "row_hash INTEGER NOT NULL)"
+SELECT_PROCESSED_HASHES_SQL = "SELECT id, row_hash FROM house_data_processed_hashes"
+INSERT_PROCESSED_HASH_SQL = "INSERT OR REPLACE INTO house_data_processed_hashes(id, row_hash) VALUES(?, ?)"
+DELETE_PROCESSED_HASH_SQL = "DELETE FROM house_data_processed_hashes WHERE id = ?"
+DELETE_PROCESSED_ROWS_SQL = "DELETE FROM house_data_processed WHERE id = ?"
+CREATE_CLUSTERS_SQL = "CREATE TABLE house_data_clusters(id INTEGER NOT NULL, cluster_id INTEGER NOT NULL)"
+INSERT_CLUSTER_SQL = "INSERT INTO house_data_clusters(id, cluster_id) VALUES(?, ?)"
+INDEX_CLUSTERS_SQL = "CREATE INDEX IF NOT EXISTS house_data_clusters_id ON house_data_clusters(id)"
+CREATE_DATA_SUMMARIES_SQL = "CREATE TABLE IF NOT EXISTS data_summaries(table_name TEXT NOT NULL, " \
+                            "version INTEGER NOT NULL, summary TEXT NOT NULL, PRIMARY KEY(table_name, version))"
+SELECT_DATA_SUMMARY_SQL = "SELECT summary FROM data_summaries WHERE table_name = ? AND version = ?"
+DELETE_DATA_SUMMARIES_SQL = "DELETE FROM data_summaries WHERE table_name = ?"
+INSERT_DATA_SUMMARY_SQL = "INSERT INTO data_summaries(table_name, version, summary) VALUES(?, ?, ?)"
+CREATE_PRICE_TILES_SQL = "CREATE TABLE price_tiles(tiles_per_degree INTEGER NOT NULL, tile_lat INTEGER NOT NULL, " \
+                         "tile_long INTEGER NOT NULL, houses INTEGER NOT NULL, mean_price REAL, median_price REAL, " \
+                         "mean_price_per_sqft REAL, PRIMARY KEY(tiles_per_degree, tile_lat, tile_long))"
+INSERT_PRICE_TILE_SQL = "INSERT OR REPLACE INTO price_tiles(tiles_per_degree, tile_lat, tile_long, houses, " \
+                        "mean_price, median_price, mean_price_per_sqft) VALUES(?, ?, ?, ?, ?, ?, ?)"
+DELETE_PRICE_TILE_SQL = "DELETE FROM price_tiles WHERE tiles_per_degree = ? AND tile_lat = ? AND tile_long = ?"
+SELECT_PRICE_TILE_SQL = "SELECT * FROM price_tiles WHERE tiles_per_degree = ? AND tile_lat = ? AND tile_long = ?"
+CREATE_PRICE_TILE_HOUSES_SQL = "CREATE TABLE price_tile_houses(id INTEGER PRIMARY KEY, row_hash INTEGER NOT NULL, " \
+                               "lat REAL NOT NULL, long REAL NOT NULL)"
+INSERT_PRICE_TILE_HOUSE_SQL = "INSERT OR REPLACE INTO price_tile_houses(id, row_hash, lat, long) VALUES(?, ?, ?, ?)"
+DELETE_PRICE_TILE_HOUSE_SQL = "DELETE FROM price_tile_houses WHERE id = ?"
 
 
 def connect():
     """
-    Opens a new connection to the sqlite3 database
+    Opens a connection to the sqlite3 database with the settings of the shared pool, outside of the pool so
+    a connection that is kept open never holds one of its slots. Close it when done.
     :return: a sqlite3.Connection object
     """
     connection = None
     try:
-        connection = sqlite3.connect(database_location)
+        connection = pool.open_connection()
     except Error as err:
         print(err)
 
     return connection
 
 
+def connection():
+    """
+    Checks a connection out of the shared pool for a with block, commits when the block finishes and
+    gives the connection back to the pool.
+    :return: a context manager that yields a sqlite3.Connection object
+    """
+    return pool.connection()
+
+
+def _download_typed(sql, connection, chunksize):
+    """
+    Runs a query and converts the result to the shared column types, chunk by chunk when a chunksize is given.
+    """
+    if chunksize is None:
+        return HousingSchema.apply_schema(pd.read_sql(sql, connection, index_col='id'))
+    return (HousingSchema.apply_schema(chunk) for chunk in pd.read_sql(sql, connection, index_col='id',
+                                                                        chunksize=chunksize))
+
+
 # Select all the rows of data from the database.
-def download_raw_housing_data(connection) -> pd.DataFrame:
+def download_raw_housing_data(connection, chunksize=None):
     """
     Queries the database and returns all the raw house data for preprocessing module
     :param connection: accepts a sqlite3 Connection
-    :return: pandas DataFrame containing the raw house data
+    :param chunksize: when given, return a generator of DataFrames with at most this many rows each
+    :return: pandas DataFrame containing the raw house data, typed by HousingSchema
     """
     sql = "SELECT * FROM kc_housing_data_raw"
-    df = pd.read_sql(sql, connection, index_col='id')
-    return df
+    return _download_typed(sql, connection, chunksize)
 
 
-def download_housing_data(connection) -> pd.DataFrame:
+def download_housing_data(connection, chunksize=None):
     """
     Queries the database and returns the house data from the table that contains the cleaned and preprocessed data
     :param connection: accepts a sqlite3 Connection
-    :return: pandas DataFrame containing the processed house data
+    :param chunksize: when given, return a generator of DataFrames with at most this many rows each
+    :return: pandas DataFrame containing the processed house data, typed by HousingSchema
     """
     sql = 'SELECT * FROM house_data_processed'
-    df = pd.read_sql(sql, connection, index_col='id')
-    return df
+    return _download_typed(sql, connection, chunksize)
+
+
+def table_exists(connection, table_name) -> bool:
+    """
+    :param connection: a sqlite3 Connection object
+    :param table_name: the name of the table
+    :return: whether the table is in the database
+    """
+    return connection.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?",
+                              (table_name,)).fetchone() is not None
+
+
+def get_data_version(connection, table_name='house_data_processed') -> int:
+    """
+    Reads the version counter of a table, the counter goes up every time the rows of the table change.
+    :param connection: a sqlite3 Connection object
+    :param table_name: the table to get the version of
+    :return: the version of the table, 0 when it has never been recorded
+    """
+    connection.execute(CREATE_DATA_VERSIONS_SQL)
+    row = connection.execute(GET_DATA_VERSION_SQL, (table_name,)).fetchone()
+    return 0 if row is None else row[0]
+
+
+def bump_data_version(connection, table_name) -> int:
+    """
+    Records that the rows of a table have changed.
+    :param connection: a sqlite3 Connection object
+    :param table_name: the table that changed
+    :return: the new version of the table
+    """
+    version = get_data_version(connection, table_name) + 1
+    connection.execute(SET_DATA_VERSION_SQL, (table_name, version))
+    return version
 
 
-def upload_processed_data(dataframe, connection):
+def load_data_summary(connection, table_name, version):
     """
-    Uploads the preprocessed data into the database
+    Reads the stored statistics summary of a version of a table.
+    :param connection: a sqlite3 Connection object
+    :param table_name: the table that was summarized
+    :param version: the data version of the table
+    :return: the summary as a JSON string, or None when that version was not summarized
+    """
+    connection.execute(CREATE_DATA_SUMMARIES_SQL)
+    row = connection.execute(SELECT_DATA_SUMMARY_SQL, (table_name, version)).fetchone()
+    return None if row is None else row[0]
+
+
+def save_data_summary(connection, table_name, version, summary):
+    """
+    Stores the statistics summary of a version of a table, replacing the summaries of older versions.
+    :param connection: a sqlite3 Connection object
+    :param table_name: the table that was summarized
+    :param version: the data version of the table
+    :param summary: the summary as a JSON string
+    """
+    connection.execute(CREATE_DATA_SUMMARIES_SQL)
+    connection.execute(DELETE_DATA_SUMMARIES_SQL, (table_name,))
+    connection.execute(INSERT_DATA_SUMMARY_SQL, (table_name, version, summary))
+    connection.commit()
+
+
+def hash_rows(dataframe) -> pd.Series:
+    """
+    Creates a content hash for every id in a DataFrame. Houses sold more than once have several rows with the
+    same id, those rows are combined into a single hash. Float columns are hashed as float64 so the hash does
+    not depend on how compactly the data was typed.
+    :param dataframe: a DataFrame indexed by id
+    :return: a Series of signed 64 bit hashes indexed by id
+    """
+    float_columns = dataframe.select_dtypes('floating').columns
+    dataframe = dataframe.astype({column: 'float64' for column in float_columns})
+    row_hashes = pd.util.hash_pandas_object(dataframe, index=False).values.view('int64')
+    hashes = pd.Series(row_hashes, index=dataframe.index)
+    duplicated = hashes.index.duplicated(keep=False)
+    if duplicated.any():
+        combined = hashes[duplicated].groupby(level=0).agg(lambda group: hash(tuple(group)))
+        hashes = pd.concat([hashes[~duplicated], combined.astype('int64')])
+    return hashes
+
+
+def _replace_processed_data(dataframe, hashes, connection):
+    """
+    Writes the whole processed table and its row hashes from scratch.
+    """
+    dataframe.to_sql('house_data_processed', connection, if_exists='replace')
+    connection.execute("DROP TABLE IF EXISTS house_data_processed_hashes")
+    connection.execute(CREATE_PROCESSED_HASHES_SQL)
+    connection.executemany(INSERT_PROCESSED_HASH_SQL, hashes.items())
+
+
+def upload_processed_data(dataframe, connection) -> dict:
+    """
+    Uploads the preprocessed data into the database. Only the houses whose id is new, whose rows changed or that
+    are no longer in the data are written, which is found by comparing a content hash of every id against the
+    hashes saved by the previous upload. The version of the table goes up whenever anything was written.
     :param dataframe: A DataFrame containing the processed data
     :param connection: A Connection object to the database
+    :return: a dict with the number of ids inserted, updated and deleted and the data version
     """
-    dataframe.to_sql('house_data_processed', connection, if_exists='replace')
+    hashes = hash_rows(dataframe)
+    columns = ['id'] + list(dataframe.columns)
+    table_columns = [row[1] for row in connection.execute("PRAGMA table_info(house_data_processed)")]
+    has_hashes = connection.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND "
+                                    "name = 'house_data_processed_hashes'").fetchone() is not None
+
+    # Without saved hashes or with different columns there is nothing to compare against, so rebuild the table
+    if table_columns != columns or not has_hashes:
+        _replace_processed_data(dataframe, hashes, connection)
+        version = bump_data_version(connection, 'house_data_processed')
+        connection.commit()
+        return {'inserted': len(hashes), 'updated': 0, 'deleted': 0, 'version': version}
+
+    saved_hashes = pd.read_sql(SELECT_PROCESSED_HASHES_SQL, connection, index_col='id')['row_hash']
+    new_ids = hashes.index.difference(saved_hashes.index)
+    deleted_ids = saved_hashes.index.difference(hashes.index)
+    common_ids = hashes.index.intersection(saved_hashes.index)
+    changed_ids = common_ids[hashes[common_ids].values != saved_hashes[common_ids].values]
+
+    if len(new_ids) or len(deleted_ids) or len(changed_ids):
+        # Changed houses are removed and written again so repeat sales of the same id stay together
+        stale_ids = [(int(house_id),) for house_id in deleted_ids.append(changed_ids)]
+        connection.executemany(DELETE_PROCESSED_ROWS_SQL, stale_ids)
+        connection.executemany(DELETE_PROCESSED_HASH_SQL, stale_ids)
+
+        written_ids = new_ids.append(changed_ids)
+        written_rows = dataframe[dataframe.index.isin(written_ids)]
+        column_list = ', '.join(f'"{column}"' for column in columns)
+        insert_sql = f"INSERT INTO house_data_processed({column_list}) VALUES({', '.join('?' for _ in columns)})"
+        connection.executemany(insert_sql, written_rows.itertuples(index=True, name=None))
+        connection.executemany(INSERT_PROCESSED_HASH_SQL, hashes[written_ids].items())
+        version = bump_data_version(connection, 'house_data_processed')
+    else:
+        version = get_data_version(connection, 'house_data_processed')
     connection.commit()
 
+    return {'inserted': len(new_ids), 'updated': len(changed_ids), 'deleted': len(deleted_ids), 'version': version}
+
 
 def register_user(username, password, connection):
     """
@@ -69,8 +262,7 @@ def register_user(username, password, connection):
     :param password: a unique pass phrase
     :param connection: a sqlite3 Connection object
     """
-    cursor = connection.cursor()
-    cursor.execute(f"INSERT INTO users(username, password, user_type) VALUES('{username}', '{password}', 'user')")
+    connection.execute(REGISTER_USER_SQL, (username, password))
     connection.commit()
 
 def save_prediction(dataframe):
@@ -85,10 +277,9 @@ def login_user(username, password, connection):
     :param connection: a connection object.
     :return: the bool validity of the login.
     """
-    query_result = pd.read_sql(f"SELECT * FROM users WHERE username='{username}' AND password='{password}'",connection)
-    print(query_result)
+    query_result = connection.execute(LOGIN_USER_SQL, (username, password)).fetchone()
     # The password fails if the username and login are not valid int he database.
-    if query_result.empty:
+    if query_result is None:
         return False  # return false when the result is empty.
     else:
         return True  # return true when the result is matched.
@@ -102,11 +293,8 @@ def submit_error_report(report, data_err, UI_err, func_err, connection):
     :param func_err: a unique tag for if its a functionality error
     :param connection: a sqlite3 Connection object
     """
-    cursor = connection.cursor()
-    cursor.execute(f"INSERT INTO error_reports(report, data_err, UI_err, func_err) VALUES('{report}', {data_err},"
-                   f"{UI_err},{func_err})")
+    connection.execute(SUBMIT_ERROR_REPORT_SQL, (report, data_err, UI_err, func_err))
     connection.commit()
-    connection.close()
 
 def download_saved_data(connection) -> pd.DataFrame:
     """
@@ -136,12 +324,140 @@ def insert_data_into_saved(bedrooms, bathrooms, sqft_living, floors, waterfront,
     :param price:
     :return:
     """
-    connection = connect()
-    cursor = connection.cursor()
-    cursor.execute(f'INSERT INTO saved_price_predictions('
-                       f'bedrooms ,bathrooms, sqft_living, floors, waterfront, view, grade, sqft_basement,'
-                       f'yr_built, yr_renovated, lat, long, price) VALUES ( {bedrooms}, {bathrooms}, {sqft_living},'
-                   f' {floors}, {waterfront}, {view}, {grade}, {sqft_basement}, {yr_built}, {yr_renovated}, '
-                   f'{lat}, {long}, "{price}")')
+    with connection() as conn:
+        conn.execute(INSERT_SAVED_SQL, (bedrooms, bathrooms, sqft_living, floors, waterfront, view, grade,
+                                        sqft_basement, yr_built, yr_renovated, lat, long, str(price)))
+
+
+def insert_predictions_into_saved(dataframe, connection):
+    """
+    Saves many predicted prices in one call.
+    :param dataframe: a DataFrame with the feature columns and a price column holding the predicted prices
+    :param connection: a sqlite3 Connection object
+    """
+    rows = dataframe[HousingSchema.FEATURE_COLUMNS].assign(price=dataframe['price'].astype(str))
+    connection.executemany(INSERT_SAVED_SQL, rows.itertuples(index=False, name=None))
+    connection.commit()
+
+
+def upload_model_leaderboard(dataframe, connection):
+    """
+    Saves the results of a model comparison, replacing the previous results.
+    :param dataframe: the leaderboard DataFrame with one row per model
+    :param connection: a sqlite3 Connection object
+    """
+    dataframe.assign(created=pd.Timestamp.now().isoformat(timespec='seconds')).to_sql(
+        'model_leaderboard', connection, if_exists='replace', index=False)
     connection.commit()
-    connection.close()
\ No newline at end of file
+
+
+def download_model_leaderboard(connection) -> pd.DataFrame:
+    """
+    Queries the database and returns the results of the last model comparison.
+    :param connection: accepts a sqlite3 Connection
+    :return: pandas DataFrame with one row per model
+    """
+    return pd.read_sql('SELECT * FROM model_leaderboard', connection)
+
+
+def clear_cluster_labels(connection):
+    """
+    Empties the house_data_clusters table, the cluster of every processed house, creating it when missing.
+    The index is dropped with the table and added back by index_cluster_labels once the labels are written.
+    :param connection: a sqlite3 Connection object
+    """
+    connection.execute("DROP TABLE IF EXISTS house_data_clusters")
+    connection.execute(CREATE_CLUSTERS_SQL)
+
+
+def insert_cluster_labels(ids, cluster_ids, connection):
+    """
+    Adds the clusters of a chunk of houses, the caller commits.
+    :param ids: the ids of the houses
+    :param cluster_ids: the cluster of every house
+    :param connection: a sqlite3 Connection object
+    """
+    connection.executemany(INSERT_CLUSTER_SQL, zip(map(int, ids), map(int, cluster_ids)))
+
+
+def index_cluster_labels(connection):
+    """
+    Indexes house_data_clusters by id so it can be joined to house_data_processed.
+    :param connection: a sqlite3 Connection object
+    """
+    connection.execute(INDEX_CLUSTERS_SQL)
+
+
+def download_cluster_labels(connection) -> pd.DataFrame:
+    """
+    Queries the database and returns the cluster of every processed house.
+    :param connection: accepts a sqlite3 Connection
+    :return: pandas DataFrame with the id and cluster_id of every house
+    """
+    return pd.read_sql('SELECT id, cluster_id FROM house_data_clusters', connection)
+
+
+def clear_price_tiles(connection):
+    """
+    Empties the price_tiles table and the price_tile_houses table of the houses the tiles were built from,
+    creating them when missing.
+    :param connection: a sqlite3 Connection object
+    """
+    connection.execute("DROP TABLE IF EXISTS price_tiles")
+    connection.execute("DROP TABLE IF EXISTS price_tile_houses")
+    connection.execute(CREATE_PRICE_TILES_SQL)
+    connection.execute(CREATE_PRICE_TILE_HOUSES_SQL)
+
+
+def replace_price_tiles(stale_tiles, tiles, connection):
+    """
+    Removes tiles and writes their new aggregates, the caller commits.
+    :param stale_tiles: (tiles_per_degree, tile_lat, tile_long) tuples of the tiles to remove
+    :param tiles: a DataFrame with the columns of price_tiles, one row per tile to write
+    :param connection: a sqlite3 Connection object
+    """
+    connection.executemany(DELETE_PRICE_TILE_SQL, stale_tiles)
+    columns = ['tiles_per_degree', 'tile_lat', 'tile_long', 'houses', 'mean_price', 'median_price',
+               'mean_price_per_sqft']
+    connection.executemany(INSERT_PRICE_TILE_SQL, tiles[columns].astype(object).itertuples(index=False, name=None))
+
+
+def download_price_tile_houses(connection) -> pd.DataFrame:
+    """
+    Queries the database and returns the hash and location of every house the price tiles were built from.
+    :param connection: accepts a sqlite3 Connection
+    :return: pandas DataFrame with the row_hash, lat and long of every house, indexed by id
+    """
+    return pd.read_sql('SELECT id, row_hash, lat, long FROM price_tile_houses', connection, index_col='id')
+
+
+def replace_price_tile_houses(stale_ids, houses, connection):
+    """
+    Removes houses from price_tile_houses and writes new rows, the caller commits.
+    :param stale_ids: the ids of the houses to remove
+    :param houses: a DataFrame with the row_hash, lat and long of the houses to write, indexed by id
+    :param connection: a sqlite3 Connection object
+    """
+    connection.executemany(DELETE_PRICE_TILE_HOUSE_SQL, [(int(house_id),) for house_id in stale_ids])
+    connection.executemany(INSERT_PRICE_TILE_HOUSE_SQL, houses[['row_hash', 'lat', 'long']].astype(object)
+                           .itertuples(index=True, name=None))
+
+
+def download_price_tiles(connection, tiles_per_degree) -> pd.DataFrame:
+    """
+    Queries the database and returns the price aggregates of every tile at one grid resolution.
+    :param connection: accepts a sqlite3 Connection
+    :param tiles_per_degree: the resolution of the grid
+    :return: pandas DataFrame with one row per tile that has houses
+    """
+    return pd.read_sql('SELECT * FROM price_tiles WHERE tiles_per_degree = ?', connection,
+                       params=(tiles_per_degree,))
+
+
+def download_price_tile(connection, tiles_per_degree, tile_lat, tile_long) -> pd.DataFrame:
+    """
+    Queries the database and returns the price aggregates of a single tile.
+    :param connection: accepts a sqlite3 Connection
+    :return: pandas DataFrame with the row of the tile, empty when the tile has no houses
+    """
+    return pd.read_sql(SELECT_PRICE_TILE_SQL, connection, params=(tiles_per_degree, tile_lat, tile_long))
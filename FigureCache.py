@@ -0,0 +1,115 @@
+"""
+FigureCache keeps rendered PNG images of the dashboard figures so the tabs can show them without waiting for
+matplotlib and seaborn.
+
+Each figure is stored in ResultCache under a key made from the data version or model version it was drawn from.
+Figures are rendered off-screen in a separate worker process with the Agg backend, so the Tk thread only loads a
+finished image. A tab shows the newest image it has straight away, even from an older version, and asks for a
+new one in the background when the key has moved on.
+"""
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+import ResultCache
+
+# How many images of each figure are kept
+KEEP_IMAGES = 2
+
+# The worker process that renders the figures, started on first use
+_executor = None
+
+
+def _render_regression(y_test, y_predict):
+    from RegressionPrediction import plot_predictions
+    return plot_predictions(y_test, y_predict, fast=True)
+
+
+def _render_clusters(hue_choice):
+    import KmeansAnalysis
+    return KmeansAnalysis.get_clustering_plot(hue_choice)
+
+
+def _render_analysis():
+    import DataPreprocessing
+    return DataPreprocessing.create_plots()
+
+
+# The figures that can be cached, each renders a matplotlib Figure from its arguments
+RENDERERS = {'regression': _render_regression, 'clusters': _render_clusters, 'analysis': _render_analysis}
+
+
+def _namespace(kind, variant):
+    return f"figures_{kind}_{variant}" if variant else f"figures_{kind}"
+
+
+def _use_agg_backend():
+    # The worker never shows a window, so it draws with the non-interactive backend
+    import matplotlib
+    matplotlib.use('Agg')
+
+
+def render_figure(kind, key, args, variant='') -> str:
+    """
+    Renders a figure and saves it as a PNG image, run inside the worker process.
+    :param kind: one of RENDERERS
+    :param key: the version key of the figure
+    :param args: the arguments of the renderer
+    :param variant: tells apart figures of the same kind, such as the hue of the cluster plot
+    :return: the path of the image
+    """
+    import matplotlib.pyplot as plt
+    figure = RENDERERS[kind](*args)
+    namespace = _namespace(kind, variant)
+    path = ResultCache.cache_path(namespace, key, extension='png')
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    # Write under a temporary name first so a half written image is never shown
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    figure.savefig(temp_path, format='png', dpi='figure')
+    os.replace(temp_path, path)
+    plt.close(figure)
+    ResultCache.prune(namespace, KEEP_IMAGES)
+    return path
+
+
+def cached_figure(kind, key, variant=''):
+    """
+    Finds the image to show for a figure.
+    :param kind: one of RENDERERS
+    :param key: the current version key of the figure
+    :param variant: tells apart figures of the same kind
+    :return: the path of the newest image or None when there is none, and whether it is for the current key
+    """
+    path = ResultCache.cache_path(_namespace(kind, variant), key, extension='png')
+    if os.path.exists(path):
+        return path, True
+    folder = os.path.dirname(path)
+    if not os.path.isdir(folder):
+        return None, False
+    images = [os.path.join(folder, name) for name in os.listdir(folder) if name.endswith('.png')]
+    return (max(images, key=os.path.getmtime) if images else None), False
+
+
+def refresh(kind, key, *args, variant=''):
+    """
+    Renders a figure again in the background worker process.
+    :param kind: one of RENDERERS
+    :param key: the current version key of the figure
+    :param args: the arguments of the renderer
+    :param variant: tells apart figures of the same kind
+    :return: a Future that holds the path of the new image
+    """
+    global _executor
+    if _executor is None:
+        # A fresh interpreter rather than a fork, the Tk state of the user interface must not be copied
+        _executor = ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn'),
+                                        initializer=_use_agg_backend)
+    return _executor.submit(render_figure, kind, key, args, variant)
+
+
+def figure_key(*versions) -> str:
+    """
+    :param versions: the data versions, model keys and options a figure is drawn from
+    :return: the key the image of the figure is stored under
+    """
+    return ResultCache.fingerprint(*versions)
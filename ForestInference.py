@@ -0,0 +1,270 @@
+"""
+ForestInference evaluates a fitted random forest without going through pandas or scikit-learn.
+
+The nodes of every tree are exported once into flat NumPy arrays. A prediction walks all the trees at the same
+time, one level per step, so one or a few houses are priced with a few dozen small array operations instead
+of building a DataFrame and validating it on every call. The results are bit-identical to regressor.predict.
+
+A compiled forest can also be compacted into a smaller serving model with narrower types, quantized leaf
+values, merged leaves and a depth limit, and sweep_compaction reports what each option costs in accuracy.
+"""
+import numpy as np
+import pandas as pd
+from sklearn.metrics import mean_absolute_error, r2_score
+
+# scikit-learn compares the features as float32 against float64 thresholds
+FEATURE_DTYPE = np.float32
+# How many levels are walked between checks of whether every tree has reached a leaf
+LEAF_CHECK_INTERVAL = 4
+
+
+class CompiledForest:
+    """
+    The nodes of a random forest regressor stored as flat arrays. Node i of the forest splits on feature[i] at
+    threshold[i], and its children are children[2 * i] (feature <= threshold) and children[2 * i + 1]. Leaves
+    point back at themselves so walking a tree past its leaf leaves the position unchanged.
+
+    When a codebook is given the values are codes and the value of node i is codebook[value[i]].
+    """
+    def __init__(self, feature, threshold, children, value, roots, max_depth, n_features, codebook=None):
+        self.feature = feature
+        self.threshold = threshold
+        self.children = children
+        self.value = value
+        self.roots = roots
+        self.max_depth = max_depth
+        self.n_features = n_features
+        self.codebook = codebook
+        self.is_leaf = children[0::2] == np.arange(len(value))
+
+    @classmethod
+    def from_forest(cls, forest):
+        """
+        Exports the nodes of a fitted forest.
+        :param forest: a fitted RandomForestRegressor, or any forest of single output regression trees
+        :return: a CompiledForest
+        """
+        trees = [estimator.tree_ for estimator in forest.estimators_]
+        node_counts = np.array([tree.node_count for tree in trees])
+        offsets = np.concatenate([[0], np.cumsum(node_counts)[:-1]])
+        # leaf_values indexes the children with 2 * node + 1, which must fit in the index type as well
+        index_dtype = np.int32 if 2 * node_counts.sum() + 1 <= np.iinfo(np.int32).max else np.int64
+
+        features, thresholds, children, values = [], [], [], []
+        for tree, offset in zip(trees, offsets):
+            nodes = np.arange(tree.node_count) + offset
+            is_leaf = tree.children_left == -1
+            left = np.where(is_leaf, nodes, tree.children_left + offset)
+            right = np.where(is_leaf, nodes, tree.children_right + offset)
+            features.append(np.where(is_leaf, 0, tree.feature))
+            thresholds.append(np.where(is_leaf, np.inf, tree.threshold))
+            children.append(np.column_stack([left, right]).ravel())
+            values.append(tree.value[:, 0, 0])
+
+        return cls(feature=np.concatenate(features).astype(np.int8 if forest.n_features_in_ < 128 else np.int32),
+                   threshold=np.concatenate(thresholds),
+                   children=np.concatenate(children).astype(index_dtype),
+                   value=np.concatenate(values),
+                   roots=offsets.astype(index_dtype),
+                   max_depth=max(tree.max_depth for tree in trees),
+                   n_features=forest.n_features_in_)
+
+    @property
+    def nbytes(self) -> int:
+        """
+        :return: the memory used by the node arrays in bytes
+        """
+        arrays = [self.feature, self.threshold, self.children, self.value, self.roots]
+        if self.codebook is not None:
+            arrays.append(self.codebook)
+        return sum(array.nbytes for array in arrays)
+
+    @property
+    def node_count(self) -> int:
+        """
+        :return: the number of nodes in all the trees
+        """
+        return len(self.value)
+
+    def node_values(self, node) -> np.ndarray:
+        """
+        :param node: an array of node positions
+        :return: the float64 values of the nodes
+        """
+        if self.codebook is None:
+            return self.value[node]
+        return self.codebook[self.value[node]]
+
+    def leaf_values(self, features) -> np.ndarray:
+        """
+        Finds the leaf every tree puts each house in.
+        :param features: a 2-D array with one row of features per house
+        :return: a 2-D float64 array with the leaf value of every tree, one row per house
+        """
+        # Round the features the same way scikit-learn does before comparing them to the thresholds
+        features = np.asarray(features, dtype=FEATURE_DTYPE).reshape(-1, self.n_features)
+        feature, threshold, children = self.feature, self.threshold, self.children
+
+        if len(features) == 1:
+            # A single house only needs 1-D lookups, which is the common case for interactive predictions
+            house = features[0]
+            node = self.roots
+            for level in range(1, self.max_depth + 1):
+                node = children[2 * node + (house[feature[node]] > threshold[node])]
+                if level % LEAF_CHECK_INTERVAL == 0 and self.is_leaf[node].all():
+                    break
+            return self.node_values(node)[None, :]
+
+        rows = np.arange(len(features))[:, None]
+        node = np.broadcast_to(self.roots, (len(features), len(self.roots)))
+        for level in range(1, self.max_depth + 1):
+            node = children[2 * node + (features[rows, feature[node]] > threshold[node])]
+            if level % LEAF_CHECK_INTERVAL == 0 and self.is_leaf[node].all():
+                break
+        return self.node_values(node)
+
+    def predict(self, features) -> np.ndarray:
+        """
+        Predicts the value of every row of features.
+        :param features: a 2-D array with one row of features per house, or a single row
+        :return: a float64 array with one prediction per house
+        """
+        # Add the trees up one after another like scikit-learn does so the rounding is the same
+        return np.cumsum(self.leaf_values(features), axis=1)[:, -1] / len(self.roots)
+
+    def predict_one(self, features) -> float:
+        """
+        Predicts the value of a single house.
+        :param features: the features of one house
+        :return: the predicted value
+        """
+        return self.predict(features)[0]
+
+    def compact(self, max_depth=None, leaf_bits=None, merge_leaves=True):
+        """
+        Creates a smaller copy of the forest for serving.
+
+        The thresholds are stored as float32, rounded down so that every float32 feature still goes the same
+        way and the splits are unchanged. The other options trade accuracy for size.
+        :param max_depth: turn the nodes at this depth into leaves holding the mean of their samples
+        :param leaf_bits: store the node values as 8 or 16 bit codes into a codebook of price levels
+        :param merge_leaves: turn splits whose two leaves hold the same value into a single leaf
+        :return: a new CompiledForest
+        """
+        is_leaf = self.is_leaf.copy()
+        value = self.node_values(np.arange(self.node_count))
+        codebook = None
+        if leaf_bits is not None:
+            codebook, value = _quantize(value[is_leaf], value, leaf_bits)
+
+        # Walk the trees level by level, the nodes at the depth limit become leaves
+        levels = []
+        frontier = self.roots.astype(np.int64)
+        while frontier.size:
+            if max_depth is not None and len(levels) == max_depth:
+                is_leaf[frontier] = True
+            levels.append(frontier)
+            split = frontier[~is_leaf[frontier]]
+            frontier = self.children[np.column_stack([2 * split, 2 * split + 1]).ravel()].astype(np.int64)
+
+        # Merge from the deepest level up so merged leaves can be merged again one level higher
+        if merge_leaves:
+            for level in reversed(levels):
+                split = level[~is_leaf[level]]
+                left, right = self.children[2 * split], self.children[2 * split + 1]
+                mergeable = is_leaf[left] & is_leaf[right] & (value[left] == value[right])
+                is_leaf[split[mergeable]] = True
+                value[split[mergeable]] = value[left[mergeable]]
+
+        # Number the nodes that are still reachable in level order, the roots come first
+        order = []
+        frontier = self.roots.astype(np.int64)
+        while frontier.size:
+            order.append(frontier)
+            split = frontier[~is_leaf[frontier]]
+            frontier = self.children[np.column_stack([2 * split, 2 * split + 1]).ravel()].astype(np.int64)
+        order = np.concatenate(order)
+        new_position = np.empty(self.node_count, dtype=np.int64)
+        new_position[order] = np.arange(len(order))
+
+        kept_leaf = is_leaf[order]
+        index_dtype = np.int16 if 2 * len(order) + 1 <= np.iinfo(np.int16).max else np.int32
+        left = np.where(kept_leaf, np.arange(len(order)), new_position[self.children[2 * order]])
+        right = np.where(kept_leaf, np.arange(len(order)), new_position[self.children[2 * order + 1]])
+        threshold = np.where(kept_leaf, np.inf, self.threshold[order])
+
+        return CompiledForest(feature=np.where(kept_leaf, 0, self.feature[order]).astype(self.feature.dtype),
+                              threshold=_round_down_to_float32(threshold),
+                              children=np.column_stack([left, right]).ravel().astype(index_dtype),
+                              value=value[order],
+                              roots=np.arange(len(self.roots)).astype(index_dtype),
+                              max_depth=len(levels) - 1,
+                              n_features=self.n_features,
+                              codebook=codebook)
+
+
+def _round_down_to_float32(threshold) -> np.ndarray:
+    """
+    Converts thresholds to the largest float32 that is not above them. A float32 feature is at or below the
+    float64 threshold exactly when it is at or below the rounded down float32 threshold.
+    """
+    rounded = threshold.astype(np.float32)
+    too_high = rounded.astype(np.float64) > threshold
+    rounded[too_high] = np.nextafter(rounded[too_high], np.float32(-np.inf))
+    return rounded
+
+
+def _quantize(leaf_values, values, leaf_bits):
+    """
+    Builds a codebook of price levels spread over the quantiles of the leaf values and codes every value as the
+    nearest level.
+    :return: the float64 codebook and the codes of the values
+    """
+    if leaf_bits not in (8, 16):
+        raise ValueError("leaf_bits must be 8 or 16")
+    levels = 2 ** leaf_bits
+    codebook = np.unique(np.quantile(leaf_values, np.linspace(0, 1, levels)))
+    midpoints = (codebook[1:] + codebook[:-1]) / 2
+    codes = np.searchsorted(midpoints, values).astype(np.uint8 if leaf_bits == 8 else np.uint16)
+    return codebook, codes
+
+
+def evaluate_compaction(forest, features, target, **options):
+    """
+    Compacts a forest and measures what it costs in size and accuracy.
+    :param forest: the full CompiledForest
+    :param features: the features of the test houses
+    :param target: the true prices of the test houses
+    :param options: the options passed to CompiledForest.compact
+    :return: the compacted CompiledForest and a dict with the options, the sizes and the accuracy of both forests
+    """
+    compact_forest = forest.compact(**options)
+    full_predictions = forest.predict(features)
+    compact_predictions = compact_forest.predict(features)
+    full_mae = mean_absolute_error(target, full_predictions)
+    compact_mae = mean_absolute_error(target, compact_predictions)
+
+    report = {'max_depth': options.get('max_depth'), 'leaf_bits': options.get('leaf_bits'),
+              'merge_leaves': options.get('merge_leaves', True),
+              'nodes': compact_forest.node_count, 'bytes': compact_forest.nbytes, 'full_bytes': forest.nbytes,
+              'size_ratio': compact_forest.nbytes / forest.nbytes,
+              'maerr': compact_mae, 'full_maerr': full_mae, 'maerr_change': compact_mae - full_mae,
+              'r2': r2_score(target, compact_predictions), 'full_r2': r2_score(target, full_predictions),
+              'max_price_change': float(np.abs(compact_predictions - full_predictions).max())}
+    return compact_forest, report
+
+
+def sweep_compaction(forest, features, target, depths=(None, 30, 20, 15, 12), leaf_bits=(None, 16, 8)):
+    """
+    Tries every combination of depth limit and leaf coding to help choose a serving model.
+    :param forest: the full CompiledForest
+    :param features: the features of the test houses
+    :param target: the true prices of the test houses
+    :param depths: the depth limits to try, None keeps the full depth
+    :param leaf_bits: the leaf codings to try, None keeps the exact float64 values
+    :return: a DataFrame with one row per combination, smallest model first
+    """
+    results = [evaluate_compaction(forest, features, target, max_depth=depth, leaf_bits=bits)[1]
+               for depth in depths for bits in leaf_bits]
+    return pd.DataFrame(results).sort_values('bytes').reset_index(drop=True)
+
@@ -0,0 +1,53 @@
+"""
+HousingSchema holds the column types shared by every module that reads the house data.
+
+The types are as small as the range of each column allows, for example the grade of a house fits in an int8,
+which keeps the DataFrames several times smaller than the int64/float64 columns pandas picks by default.
+"""
+import numpy as np
+import pandas as pd
+
+# Bump when the types change so stored copies of the data made with the old types are rebuilt
+SCHEMA_VERSION = 1
+
+# The columns of the raw sales data and their types, the date column is kept as text
+RAW_DTYPES = {
+    'id': 'int64', 'date': 'str', 'price': 'float64', 'bedrooms': 'int8', 'bathrooms': 'float32',
+    'sqft_living': 'int32', 'sqft_lot': 'int32', 'floors': 'float32', 'waterfront': 'int8', 'view': 'int8',
+    'condition': 'int8', 'grade': 'int8', 'sqft_above': 'int32', 'sqft_basement': 'int32', 'yr_built': 'int16',
+    'yr_renovated': 'int16', 'zipcode': 'int32', 'lat': 'float64', 'long': 'float64', 'sqft_living15': 'int32',
+    'sqft_lot15': 'int32'
+}
+
+# The columns kept after preprocessing, price is the target and the rest are the model features
+PROCESSED_COLUMNS = ['price', 'bedrooms', 'bathrooms', 'sqft_living', 'floors', 'waterfront', 'view', 'grade',
+                     'sqft_basement', 'yr_built', 'yr_renovated', 'lat', 'long']
+FEATURE_COLUMNS = PROCESSED_COLUMNS[1:]
+PROCESSED_DTYPES = {column: RAW_DTYPES[column] for column in PROCESSED_COLUMNS}
+
+
+def apply_schema(dataframe, schema=None) -> pd.DataFrame:
+    """
+    Converts the columns of a DataFrame to the types of the schema. An integer column is only converted when it
+    has no missing values and every value fits the smaller type, otherwise it keeps the type pandas gave it.
+    :param dataframe: the DataFrame to convert, columns that are not in the schema are left alone
+    :param schema: a dict of column types, RAW_DTYPES when None
+    :return: the converted DataFrame
+    """
+    schema = RAW_DTYPES if schema is None else schema
+    conversions = {}
+    for column, dtype in schema.items():
+        if column not in dataframe.columns or dtype == 'str':
+            continue
+        target = np.dtype(dtype)
+        values = dataframe[column]
+        if values.dtype == target:
+            continue
+        if target.kind == 'i':
+            limits = np.iinfo(target)
+            if values.isna().any() or values.min() < limits.min or values.max() > limits.max:
+                continue
+            if values.dtype.kind == 'f' and not (values == np.floor(values)).all():
+                continue
+        conversions[column] = target
+    return dataframe.astype(conversions) if conversions else dataframe
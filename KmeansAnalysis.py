@@ -1,70 +1,341 @@
 """
 KmeansAnalysis handles the processed data from the database and runs a K-means clustering analaysis
 to see different groups in the house data.
+
+The filtered and scaled data is prepared the first time it is used and shared through DataStore, the module
+attributes home_data, cata_home_data, price_data, scaler and scaled_data read from it. The K-means labels,
+centroids and 2-D PCA projection are fitted once per data version, kept in memory and stored in ResultCache.
+
+The number of clusters is chosen by an elbow search that fits the numbers of clusters in parallel, stops once
+the score curve has flattened out and picks the knee of the curve.
 """
+import os
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import sklearn
 from sklearn.preprocessing import StandardScaler
-from sklearn.cluster import KMeans
+from sklearn.cluster import KMeans, MiniBatchKMeans
+from sklearn.metrics import silhouette_score
 from sklearn.decomposition import PCA
 import seaborn as sns
 import matplotlib.pyplot as plt
-import DatabaseConnection as dc
+from matplotlib.figure import Figure
+from matplotlib.patches import Patch
+import DataStore
+import ResultCache
+
+# Houses at or above this price are outliers and left out of the cluster analysis
+MAX_PRICE = 1250000
+# The number of clusters used when none is chosen
+DEFAULT_CLUSTERS = 8
+# The elbow search tries 1 up to this many clusters
+ELBOW_MAX_CLUSTERS = 14
+# The search stops after this many numbers of clusters in a row that each improve the score by less than
+# ELBOW_MIN_GAIN times the improvement from 1 to 2 clusters
+ELBOW_PATIENCE = 2
+ELBOW_MIN_GAIN = 0.1
+# The K-means runs per number of clusters in the elbow search
+ELBOW_N_INIT = 3
+# The most numbers of clusters fitted at the same time, a running fit cannot be stopped so a small wave is what
+# lets the search skip the fits after the curve has flattened
+ELBOW_WAVE_SIZE = 4
+# The cluster plot picks its default number of clusters with an elbow search fitted on this many houses, so the
+# first plot of a large table does not fit every number of clusters on all of it
+KNEE_SAMPLE_SIZE = 20000
+# The houses the silhouette score is computed on, it compares every pair so the full data is too slow
+SILHOUETTE_SAMPLE_SIZE = 5000
+# Above this many houses the cluster plot is drawn as a density image instead of a marker per house
+RASTER_THRESHOLD = 100000
+# The density image has this many cells along each axis, and colours the prices in this many buckets
+RASTER_GRID_SIZE = 400
+PRICE_BUCKETS = 16
+
+
+def _load_cluster_data():
+    """
+    Filters and standardizes the processed data for the cluster analysis.
+    :return: a dict of the filtered data, the features, the prices, the fitted scaler and the scaled features
+    """
+    home_data = DataStore.get_processed_data()
+
+    # Filter out outliers in the dataset based on the outlier graph from preprocessing
+    # indicating that the majority of the data is in the lower end of the price range.
+    home_data = home_data[home_data['price'] < MAX_PRICE]
+
+    # Visualize the different groupings of houses in the dataset using kmeans cluster analysis.
+    # Dropping the price creates a new frame, so the shared data keeps its integrity without a copy
+    cata_home_data = home_data.drop(['price'], axis=1)
+    price_data = home_data['price']
+
+    # Standardize the data.
+    scaler = StandardScaler()
+    scaled_data = scaler.fit_transform(cata_home_data)
+
+    return {'home_data': home_data, 'cata_home_data': cata_home_data, 'price_data': price_data,
+            'scaler': scaler, 'scaled_data': scaled_data}
+
+
+# The keys of the dict built by _load_cluster_data, which can also be read as module attributes
+CLUSTER_DATA_KEYS = ('home_data', 'cata_home_data', 'price_data', 'scaler', 'scaled_data')
+
+
+def get_cluster_data():
+    """
+    :return: the dict built by _load_cluster_data, loaded once per data version
+    """
+    return DataStore.memoize('cluster_data', DataStore.PROCESSED_TABLE, _load_cluster_data)
+
+
+def _fit_clusters(n_clusters):
+    """
+    Fits K-means and the 2-D PCA projection of the scaled data, or loads them from the cache when the same
+    data was clustered before.
+    :param n_clusters: the number of clusters
+    :return: a dict of the cluster labels, the centroids and the 2-D projection of every house
+    """
+    cluster_data = get_cluster_data()
+    key = ResultCache.fingerprint(cluster_data['home_data'], n_clusters, sklearn.__version__)
+    cluster_fit = ResultCache.load('clusters', key)
+    if cluster_fit is None:
+        scaled_data = cluster_data['scaled_data']
+        kmeans = KMeans(n_clusters=n_clusters, init='k-means++').fit(scaled_data)
+        cluster_fit = {'labels': kmeans.labels_, 'centroids': kmeans.cluster_centers_,
+                       'projection': PCA(2).fit_transform(scaled_data)}
+        ResultCache.store('clusters', key, cluster_fit)
+    return cluster_fit
+
+
+def get_cluster_fit(n_clusters=DEFAULT_CLUSTERS):
+    """
+    :param n_clusters: the number of clusters
+    :return: the dict built by _fit_clusters, fitted once per data version and number of clusters
+    """
+    return DataStore.memoize(f'cluster_fit_{n_clusters}', DataStore.PROCESSED_TABLE,
+                             lambda: _fit_clusters(n_clusters))
+
+
+def __getattr__(name):
+    # Module attributes such as KmeansAnalysis.scaled_data are loaded on first access
+    if name in CLUSTER_DATA_KEYS:
+        return get_cluster_data()[name]
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+def score_clusters(scaled_data, n_clusters, mini_batch=False, sample_size=None) -> dict:
+    """
+    Fits one number of clusters for the elbow search, run inside a worker process.
+    :param scaled_data: the standardized features of the houses
+    :param n_clusters: the number of clusters
+    :param mini_batch: fit with MiniBatchKMeans, which is faster on large tables
+    :param sample_size: fit on a random sample of this many houses, every house when None
+    :return: a dict with the number of clusters, the K-means score and the silhouette score on every house
+    """
+    fit_data = scaled_data
+    if sample_size is not None and sample_size < len(scaled_data):
+        rows = np.random.default_rng(0).choice(len(scaled_data), sample_size, replace=False)
+        fit_data = scaled_data[rows]
+    if mini_batch:
+        kmeans = MiniBatchKMeans(n_clusters=n_clusters, n_init=ELBOW_N_INIT, random_state=0)
+    else:
+        kmeans = KMeans(n_clusters=n_clusters, init='k-means++', n_init=ELBOW_N_INIT, random_state=0)
+    kmeans.fit(fit_data)
+
+    # Score every house, the silhouette is not defined for a single cluster
+    silhouette = np.nan
+    if n_clusters > 1:
+        silhouette = silhouette_score(scaled_data, kmeans.predict(scaled_data), random_state=0,
+                                      sample_size=min(SILHOUETTE_SAMPLE_SIZE, len(scaled_data)))
+    return {'clusters': n_clusters, 'score': kmeans.score(scaled_data), 'silhouette': silhouette}
 
-# Connect to database and get the data
-home_data = dc.download_housing_data(dc.connect())
 
-# Filter out outliers in the dataset based on the outlier graph from preprocessing
-# indicating that the majority of the data is in the lower end of the price range.
-home_data = home_data[home_data['price'] < 1250000]
+def find_knee(cluster_counts, scores):
+    """
+    Finds the knee of the elbow curve, the point furthest above the straight line between both ends of the
+    curve once both axes are scaled to run from 0 to 1.
+    :param cluster_counts: the numbers of clusters in increasing order
+    :param scores: the K-means score of every number of clusters, which rises as clusters are added
+    :return: the number of clusters at the knee, or None when the curve has no knee
+    """
+    cluster_counts = np.asarray(cluster_counts, dtype=np.float64)
+    scores = np.asarray(scores, dtype=np.float64)
+    if len(scores) < 3 or scores[-1] <= scores[0]:
+        return None
+    x = (cluster_counts - cluster_counts[0]) / (cluster_counts[-1] - cluster_counts[0])
+    y = (scores - scores[0]) / (scores[-1] - scores[0])
+    above_line = y - x
+    knee = above_line.argmax()
+    return int(cluster_counts[knee]) if above_line[knee] > 0 else None
+
 
-# Visualize the different groupings of houses in the dataset using kmeans cluster analysis.
-cata_home_data = home_data.copy() # copy of the dataset to maintain integrity
-price_data = cata_home_data['price']
-cata_home_data.drop(['price'],axis=1,inplace=True)
+def _has_flattened(scores, patience, min_gain):
+    """
+    :return: whether the last patience additions each improved the score by less than min_gain times the first
+    """
+    gains = np.diff(scores)
+    if len(gains) <= patience:
+        return False
+    return bool((gains[-patience:] < min_gain * gains[0]).all())
+
+
+def _run_elbow_search(max_clusters, mini_batch, sample_size, n_workers, patience, min_gain):
+    """
+    Scores the numbers of clusters in parallel until the curve flattens, or loads the curve from the cache.
+    :return: a dict of the numbers of clusters tried, their scores and silhouettes and the chosen knee
+    """
+    cluster_data = get_cluster_data()
+    key = ResultCache.fingerprint(cluster_data['home_data'], max_clusters, mini_batch, sample_size,
+                                  patience, min_gain, ELBOW_N_INIT, sklearn.__version__)
+    curve = ResultCache.load('elbow', key)
+    if curve is not None:
+        return curve
+
+    scaled_data = cluster_data['scaled_data']
+    n_workers = n_workers or os.cpu_count()
+    wave_size = min(n_workers, ELBOW_WAVE_SIZE)
+    results = []
+    flattened = False
+    with ProcessPoolExecutor(max_workers=wave_size) as executor:
+        # Submit a small wave of fits at a time, a running fit cannot be stopped so the search only stops
+        # submitting once the curve has flattened
+        for wave_start in range(1, max_clusters + 1, wave_size):
+            wave = [executor.submit(score_clusters, scaled_data, n_clusters, mini_batch, sample_size)
+                    for n_clusters in range(wave_start, min(wave_start + wave_size, max_clusters + 1))]
+            # Collect in order of the number of clusters, the rest of the wave is dropped once the curve flattens
+            for job in wave:
+                results.append(job.result())
+                flattened = _has_flattened([result['score'] for result in results], patience, min_gain)
+                if flattened:
+                    break
+            if flattened:
+                break
+
+    curve = {'clusters': [result['clusters'] for result in results],
+             'scores': [result['score'] for result in results],
+             'silhouettes': [result['silhouette'] for result in results]}
+    knee = find_knee(curve['clusters'], curve['scores'])
+    if knee is None:
+        # Without a knee take the number of clusters with the best silhouette among those scored
+        silhouettes = np.asarray(curve['silhouettes'], dtype=np.float64)
+        if np.isnan(silhouettes).all():
+            knee = curve['clusters'][-1]
+        else:
+            knee = curve['clusters'][int(np.nanargmax(silhouettes))]
+    curve['knee'] = knee
+    ResultCache.store('elbow', key, curve)
+    return curve
+
+
+def elbow_search(max_clusters=ELBOW_MAX_CLUSTERS, mini_batch=False, sample_size=None, n_workers=None,
+                 patience=ELBOW_PATIENCE, min_gain=ELBOW_MIN_GAIN) -> dict:
+    """
+    Finds the best number of clusters with the elbow method, once per data version and set of options.
+    :param max_clusters: the largest number of clusters tried
+    :param mini_batch: fit with MiniBatchKMeans, which is faster on large tables
+    :param sample_size: fit on a random sample of this many houses, every house when None
+    :param n_workers: the number of worker processes, one per core when None
+    :param patience: how many small improvements in a row stop the search
+    :param min_gain: an improvement is small below this share of the improvement from 1 to 2 clusters
+    :return: a dict of the numbers of clusters tried, their scores and silhouettes and the chosen knee
+    """
+    name = f'elbow_{max_clusters}_{mini_batch}_{sample_size}_{patience}_{min_gain}'
+    return DataStore.memoize(name, DataStore.PROCESSED_TABLE,
+                             lambda: _run_elbow_search(max_clusters, mini_batch, sample_size, n_workers,
+                                                       patience, min_gain))
 
-# Standardize the data.
-scaler = StandardScaler()
-scaler.fit(cata_home_data)
-scaled_data = scaler.transform(cata_home_data)
 
 # Determine the obtimal number of clusters
-def show_elbow_plot():
+def show_elbow_plot(**search_options):
     """
     Displays the elbow graph used to choose the optimal number of clusters for the final cluster graph.
+    :param search_options: the options passed to elbow_search
     """
+    curve = elbow_search(**search_options)
 
-    test_cluster_max = 15
-    kmeans_tests = [KMeans(n_clusters=i) for i in range(1, test_cluster_max)]
-    score = [kmeans_tests[i].fit(scaled_data).score(scaled_data) for i in range(len(kmeans_tests))]
-
-    # Plot the curve
-    elbow_plot = plt.plot(range(1, test_cluster_max),score)
+    # Plot the curve and mark the chosen number of clusters
+    elbow_plot = plt.plot(curve['clusters'], curve['scores'])
+    plt.axvline(curve['knee'], color='gray', linestyle='--')
     plt.xlabel('Number of Clusters')
     plt.ylabel('Score')
-    plt.title('Elbow Curve')
+    plt.title(f"Elbow Curve (knee at {curve['knee']} clusters)")
     plt.show()
 
-def get_clustering_plot(hue_choice):
+def density_image(points, categories, n_categories, colormap, grid_size=RASTER_GRID_SIZE):
+    """
+    Bins 2-D points into a grid of cells, counting every category separately. Each cell takes the colour of the
+    category with the most points in it, and is more opaque the more points it holds.
+    :param points: an array with the x and y of every point
+    :param categories: the category of every point, from 0 up to n_categories
+    :param n_categories: the number of categories
+    :param colormap: the name of the matplotlib colormap the categories are coloured from
+    :param grid_size: the number of cells along each axis
+    :return: an RGBA image with the first row at the bottom, and its [left, right, bottom, top] extent
+    """
+    x, y = points[:, 0], points[:, 1]
+    extent = [x.min(), x.max(), y.min(), y.max()]
+    column = np.clip(((x - extent[0]) / max(extent[1] - extent[0], 1e-12) * grid_size).astype(np.int64),
+                     0, grid_size - 1)
+    row = np.clip(((y - extent[2]) / max(extent[3] - extent[2], 1e-12) * grid_size).astype(np.int64),
+                  0, grid_size - 1)
+    cells = grid_size * grid_size
+    counts = np.bincount(np.asarray(categories, dtype=np.int64) * cells + row * grid_size + column,
+                         minlength=n_categories * cells).reshape(n_categories, grid_size, grid_size)
+
+    total = counts.sum(axis=0)
+    image = plt.get_cmap(colormap)(counts.argmax(axis=0) / max(n_categories - 1, 1))
+    image[..., 3] = np.where(total > 0, 0.25 + 0.75 * np.log1p(total) / np.log1p(total.max()), 0)
+    return image, extent
+
+
+def _raster_clustering_plot(scaled_data_2d, hue_choice, labels, n_clusters, price_data):
+    """
+    Draws the cluster plot as a single density image, so the cost of showing it does not grow with the houses.
+    """
+    if hue_choice == 'clusters':
+        categories, n_categories, colormap = labels, n_clusters, 'rainbow'
+    else:
+        # Bucket the prices at their quantiles so every colour covers a similar number of houses
+        edges = np.unique(np.quantile(price_data, np.linspace(0, 1, PRICE_BUCKETS + 1)))
+        categories = np.clip(np.searchsorted(edges, price_data, side='right') - 1, 0, len(edges) - 2)
+        n_categories, colormap = len(edges) - 1, 'hot'
+    image, extent = density_image(scaled_data_2d, categories, n_categories, colormap)
+
+    figure = Figure(figsize=(12, 12))
+    axes = figure.add_subplot()
+    axes.imshow(image, extent=extent, origin='lower', aspect='auto', interpolation='nearest')
+    colours = plt.get_cmap(colormap)(np.arange(n_categories) / max(n_categories - 1, 1))
+    if hue_choice == 'clusters':
+        names = [str(cluster) for cluster in range(n_clusters)]
+    else:
+        names = [f"${edges[bucket]:,.0f} - ${edges[bucket + 1]:,.0f}" for bucket in range(n_categories)]
+    axes.legend(handles=[Patch(color=colour, label=name) for colour, name in zip(colours, names)],
+                title=hue_choice)
+    return figure
+
+
+def get_clustering_plot(hue_choice, n_clusters=None, raster_threshold=RASTER_THRESHOLD):
     """
     Creates and returns a seaborn scatterplot of the differnt clusters apparent in the data after the K-Means
-    analysis.
+    analysis. The clusters and the projection are reused between calls, changing the hue only recolours.
+    :param hue_choice: 'price' or 'clusters'
+    :param n_clusters: the number of clusters, the knee found by elbow_search on KNEE_SAMPLE_SIZE houses when
+                       None
+    :param raster_threshold: above this many houses a density image is drawn instead of the scatterplot
     :return: a Seaborn scatter plot figure object
     """
-    # Initialize the kmeans clustering algorithm
-    kmeans = KMeans(n_clusters=8,init='k-means++')
-
-    # Fit the data to the algo
-    kmeans.fit(scaled_data)
+    if n_clusters is None:
+        n_clusters = elbow_search(sample_size=KNEE_SAMPLE_SIZE)['knee']
+    cluster_data = get_cluster_data()
+    cluster_fit = get_cluster_fit(n_clusters)
+    labels = cluster_fit['labels']
 
-    # Get the clusters
-    labels = kmeans.predict(scaled_data)
+    # The data points converted into two dimensions
+    scaled_data_2d = cluster_fit['projection']
 
-    # Convert the data points into two dimensions
-    pca = PCA(2)
-    scaled_data_2d = pca.fit_transform(scaled_data)
-    # scaled_data_2d = scaled_data
+    if len(scaled_data_2d) > raster_threshold:
+        return _raster_clustering_plot(scaled_data_2d, hue_choice, labels, n_clusters,
+                                       cluster_data['price_data'].to_numpy())
 
     #choose which labels to give the color choose
-    hues = {'price': {'data':home_data['price'], 'huemap':'hot'}, 'clusters':{'data':labels, 'huemap':'rainbow'}}
+    hues = {'price': {'data':cluster_data['price_data'], 'huemap':'hot'}, 'clusters':{'data':labels, 'huemap':'rainbow'}}
 
     # Plot the data
     plt.figure(figsize=(12,12))
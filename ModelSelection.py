@@ -0,0 +1,127 @@
+"""
+ModelSelection compares candidate regression models for the house price prediction on speed and accuracy.
+
+Every candidate is cross-validated with k folds, and the folds of all candidates are fitted in parallel in a
+process pool. For each model the fit time, the single house and batch prediction speed, the pickled model
+size, the mean absolute error and the r2 score are recorded and written to the model_leaderboard table.
+
+Run it from the command line with:
+    python ModelSelection.py --folds 5
+"""
+import argparse
+import os
+import pickle
+import time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+from sklearn.ensemble import ExtraTreesRegressor, RandomForestRegressor
+from sklearn.linear_model import LinearRegression
+from sklearn.metrics import mean_absolute_error, r2_score
+from sklearn.model_selection import KFold
+try:
+    from sklearn.ensemble import HistGradientBoostingRegressor
+except ImportError:
+    # scikit-learn before 1.0 keeps the histogram gradient boosting behind an experimental flag
+    from sklearn.experimental import enable_hist_gradient_boosting  # noqa: F401
+    from sklearn.ensemble import HistGradientBoostingRegressor
+import DatabaseConnection as dc
+import DataStore
+from RegressionPrediction import RANDOM_STATE
+
+# The models that are compared
+CANDIDATES = ['LinearRegression', 'RandomForest', 'HistGradientBoosting', 'ExtraTrees']
+
+# How many single house predictions are timed per fold
+SINGLE_ROW_SAMPLES = 50
+
+
+def make_candidate(name, n_jobs=1):
+    """
+    Creates an untrained candidate model.
+    :param name: one of CANDIDATES
+    :param n_jobs: the number of cores the tree ensembles fit and predict on
+    :return: a scikit-learn regressor
+    """
+    if name == 'LinearRegression':
+        return LinearRegression()
+    if name == 'RandomForest':
+        return RandomForestRegressor(random_state=RANDOM_STATE, n_jobs=n_jobs)
+    if name == 'HistGradientBoosting':
+        return HistGradientBoostingRegressor(random_state=RANDOM_STATE)
+    if name == 'ExtraTrees':
+        return ExtraTreesRegressor(random_state=RANDOM_STATE, n_jobs=n_jobs)
+    raise ValueError(f"unknown candidate model {name}")
+
+
+def evaluate_fold(name, X, y, train_index, test_index, n_jobs=1) -> dict:
+    """
+    Fits a candidate on one fold and measures its speed, size and accuracy.
+    :return: a dict with the measurements of the fold
+    """
+    X_train, X_test = X.iloc[train_index], X.iloc[test_index]
+    y_train, y_test = y.iloc[train_index], y.iloc[test_index]
+    model = make_candidate(name, n_jobs)
+
+    start_time = time.perf_counter()
+    model.fit(X_train, y_train)
+    fit_seconds = time.perf_counter() - start_time
+
+    start_time = time.perf_counter()
+    y_predict = model.predict(X_test)
+    batch_seconds = time.perf_counter() - start_time
+
+    # Time one house at a time the way the prediction engine tab asks for prices
+    single_row_seconds = []
+    for row in range(min(SINGLE_ROW_SAMPLES, len(X_test))):
+        start_time = time.perf_counter()
+        model.predict(X_test.iloc[[row]])
+        single_row_seconds.append(time.perf_counter() - start_time)
+
+    return {'model': name, 'fit_seconds': fit_seconds,
+            'single_row_ms': float(np.median(single_row_seconds)) * 1000,
+            'single_row_p99_ms': float(np.percentile(single_row_seconds, 99)) * 1000,
+            'batch_rows_per_second': len(X_test) / batch_seconds,
+            'model_bytes': len(pickle.dumps(model)),
+            'maerr': mean_absolute_error(y_test, y_predict), 'r2': r2_score(y_test, y_predict)}
+
+
+def benchmark_models(candidates=None, n_splits=5, n_workers=None, n_jobs=1, housing_data=None) -> pd.DataFrame:
+    """
+    Cross-validates every candidate, running the folds in parallel in a process pool.
+    :param candidates: the names of the models to compare, every one of CANDIDATES when None
+    :param n_splits: the number of cross-validation folds
+    :param n_workers: the number of worker processes, one per core when None
+    :param n_jobs: the number of cores each tree ensemble uses inside its worker
+    :param housing_data: the processed house data, loaded from DataStore when None
+    :return: a leaderboard DataFrame with the mean of every measurement per model, most accurate first
+    """
+    candidates = CANDIDATES if candidates is None else candidates
+    housing_data = DataStore.get_processed_data() if housing_data is None else housing_data
+    X = housing_data.drop(['price'], axis=1)
+    y = housing_data['price']
+    folds = list(KFold(n_splits=n_splits, shuffle=True, random_state=RANDOM_STATE).split(X))
+
+    with ProcessPoolExecutor(max_workers=n_workers or os.cpu_count()) as executor:
+        jobs = [executor.submit(evaluate_fold, name, X, y, train_index, test_index, n_jobs)
+                for name in candidates for train_index, test_index in folds]
+        results = pd.DataFrame([job.result() for job in jobs])
+
+    leaderboard = results.groupby('model').mean()
+    leaderboard['maerr_std'] = results.groupby('model')['maerr'].std()
+    leaderboard['folds'] = n_splits
+    return leaderboard.sort_values('maerr').reset_index()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Cross-validate the candidate price models and rank them.')
+    parser.add_argument('--folds', type=int, default=5, help='the number of cross-validation folds')
+    parser.add_argument('--workers', type=int, default=None, help='worker processes, one per core by default')
+    parser.add_argument('--jobs', type=int, default=1, help='cores each tree ensemble uses inside its worker')
+    parser.add_argument('--models', nargs='+', choices=CANDIDATES, help='the models to compare, all by default')
+    args = parser.parse_args()
+
+    board = benchmark_models(args.models, args.folds, args.workers, args.jobs)
+    with dc.connection() as conn:
+        dc.upload_model_leaderboard(board, conn)
+    print(board.to_string(index=False))
@@ -0,0 +1,143 @@
+"""
+PriceTiles keeps price aggregates of the houses on a grid of latitude and longitude tiles.
+
+The houses are binned into square tiles at several grid resolutions, and the number of houses, the mean and
+median price and the mean price per sqft of living space of every tile are stored in the price_tiles table.
+Dashboards and per area checks of a predicted price read a few tiles instead of the whole table.
+
+The tiles are updated incrementally: the tile columns of every house are hashed and compared with the hashes
+saved in price_tile_houses by the previous update, and only the tiles that a changed house was in or moved into
+are aggregated again.
+"""
+import numpy as np
+import pandas as pd
+import DatabaseConnection as dc
+import DataStore
+
+# The columns the tiles are aggregated from, a change to any other column leaves the tiles as they are
+TILE_COLUMNS = ['price', 'sqft_living', 'lat', 'long']
+# The grid resolutions in tiles per degree, about 11 km, 4.5 km and 1.1 km tiles north to south
+TILES_PER_DEGREE = (10, 25, 100)
+# The resolution used by area_summary when none is given
+DEFAULT_TILES_PER_DEGREE = 25
+
+
+def tile_index(lat, long, tiles_per_degree):
+    """
+    Finds the tile of each location.
+    :param lat: the latitudes
+    :param long: the longitudes
+    :param tiles_per_degree: the resolution of the grid
+    :return: the row and column of the tile of every location
+    """
+    return (np.floor(np.asarray(lat, dtype=np.float64) * tiles_per_degree).astype(np.int64),
+            np.floor(np.asarray(long, dtype=np.float64) * tiles_per_degree).astype(np.int64))
+
+
+def aggregate_tiles(housing_data, tiles_per_degree) -> pd.DataFrame:
+    """
+    Aggregates the prices of the houses by tile.
+    :param housing_data: a DataFrame with at least the tile columns
+    :param tiles_per_degree: the resolution of the grid
+    :return: a DataFrame with the columns of the price_tiles table, one row per tile that has houses
+    """
+    tile_lat, tile_long = tile_index(housing_data['lat'], housing_data['long'], tiles_per_degree)
+    houses = pd.DataFrame({'tile_lat': tile_lat, 'tile_long': tile_long,
+                           'price': housing_data['price'].to_numpy(dtype=np.float64),
+                           'price_per_sqft': (housing_data['price'] / housing_data['sqft_living']).to_numpy()})
+    tiles = houses.groupby(['tile_lat', 'tile_long']).agg(
+        houses=('price', 'size'), mean_price=('price', 'mean'), median_price=('price', 'median'),
+        mean_price_per_sqft=('price_per_sqft', 'mean')).reset_index()
+    tiles.insert(0, 'tiles_per_degree', tiles_per_degree)
+    return tiles
+
+
+def _house_rows(housing_data, hashes):
+    """
+    :return: the row_hash, lat and long of every id, repeat sales of a house share its location
+    """
+    locations = housing_data[['lat', 'long']].astype('float64').groupby(level=0).first()
+    return locations.assign(row_hash=hashes[locations.index])
+
+
+def update_price_tiles(housing_data, connection) -> dict:
+    """
+    Brings the price tiles up to date with the house data, aggregating only the tiles whose houses changed.
+    The tables are built from scratch when they do not exist yet.
+    :param housing_data: the processed house data indexed by id
+    :param connection: a sqlite3 Connection object
+    :return: a dict with the number of houses that changed, the number of tiles aggregated again and the
+             data version of the tiles
+    """
+    hashes = dc.hash_rows(housing_data[TILE_COLUMNS])
+    houses = _house_rows(housing_data, hashes)
+
+    if not dc.table_exists(connection, 'price_tiles') or not dc.table_exists(connection, 'price_tile_houses'):
+        dc.clear_price_tiles(connection)
+        tiles = pd.concat([aggregate_tiles(housing_data, resolution) for resolution in TILES_PER_DEGREE])
+        dc.replace_price_tiles([], tiles, connection)
+        dc.replace_price_tile_houses([], houses, connection)
+        version = dc.bump_data_version(connection, 'price_tiles')
+        connection.commit()
+        return {'houses_changed': len(houses), 'tiles_updated': len(tiles), 'version': version}
+
+    saved_houses = dc.download_price_tile_houses(connection)
+    new_ids = houses.index.difference(saved_houses.index)
+    deleted_ids = saved_houses.index.difference(houses.index)
+    common_ids = houses.index.intersection(saved_houses.index)
+    changed_ids = common_ids[houses.loc[common_ids, 'row_hash'].values !=
+                             saved_houses.loc[common_ids, 'row_hash'].values]
+    stale_ids = deleted_ids.append(changed_ids)
+    written_ids = new_ids.append(changed_ids)
+    if not len(stale_ids) and not len(written_ids):
+        return {'houses_changed': 0, 'tiles_updated': 0, 'version': dc.get_data_version(connection, 'price_tiles')}
+
+    # The tiles the changed houses were in before and are in now
+    moved = pd.concat([saved_houses.loc[stale_ids, ['lat', 'long']], houses.loc[written_ids, ['lat', 'long']]])
+    tiles_updated = 0
+    for resolution in TILES_PER_DEGREE:
+        affected = pd.MultiIndex.from_arrays(tile_index(moved['lat'], moved['long'], resolution)).unique()
+        in_affected = pd.MultiIndex.from_arrays(tile_index(housing_data['lat'], housing_data['long'],
+                                                           resolution)).isin(affected)
+        stale_tiles = [(resolution, int(tile_lat), int(tile_long)) for tile_lat, tile_long in affected]
+        dc.replace_price_tiles(stale_tiles, aggregate_tiles(housing_data[in_affected], resolution), connection)
+        tiles_updated += len(affected)
+
+    dc.replace_price_tile_houses(stale_ids, houses.loc[written_ids], connection)
+    version = dc.bump_data_version(connection, 'price_tiles')
+    connection.commit()
+    return {'houses_changed': len(stale_ids.union(written_ids)), 'tiles_updated': tiles_updated,
+            'version': version}
+
+
+def _ensure_tiles(connection):
+    """
+    Builds the tiles from the processed data the first time they are read.
+    """
+    if not dc.table_exists(connection, 'price_tiles'):
+        update_price_tiles(DataStore.get_processed_data(), connection)
+
+
+def get_price_tiles(tiles_per_degree=DEFAULT_TILES_PER_DEGREE) -> pd.DataFrame:
+    """
+    :param tiles_per_degree: the resolution of the grid, one of TILES_PER_DEGREE
+    :return: the price aggregates of every tile with houses at the resolution
+    """
+    with dc.connection() as conn:
+        _ensure_tiles(conn)
+        return dc.download_price_tiles(conn, tiles_per_degree)
+
+
+def area_summary(lat, long, tiles_per_degree=DEFAULT_TILES_PER_DEGREE):
+    """
+    Looks up the prices around a location, for example to sanity check a predicted price.
+    :param lat: the latitude of the location
+    :param long: the longitude of the location
+    :param tiles_per_degree: the resolution of the grid, one of TILES_PER_DEGREE
+    :return: a dict with the aggregates of the tile of the location, or None when no houses were sold in it
+    """
+    tile_lat, tile_long = tile_index([lat], [long], tiles_per_degree)
+    with dc.connection() as conn:
+        _ensure_tiles(conn)
+        tile = dc.download_price_tile(conn, tiles_per_degree, int(tile_lat[0]), int(tile_long[0]))
+    return tile.to_dict('records')[0] if len(tile) else None
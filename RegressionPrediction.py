@@ -1,33 +1,192 @@
 """
 RegressionPrediction handles the prediction of house prices from the processed data in the database.
 
-It also creates a reg plot of this data for display by the UI.
+It also creates a reg plot of this data for display by the UI. Trained models are cached on disk and are only
+retrained when the processed data or the model settings change.
 """
 import matplotlib.pyplot as plt
+from matplotlib.figure import Figure
 from sklearn.model_selection import train_test_split
 from sklearn.linear_model import LinearRegression
 from sklearn.ensemble import RandomForestRegressor
 from sklearn.metrics import mean_absolute_error, r2_score
 import seaborn as sns
+import sklearn
+import threading
+from cachetools import TTLCache
+import joblib
+import numpy as np
 import DatabaseConnection as dc
+import DataStore
+import ResultCache
+from ForestInference import CompiledForest, evaluate_compaction, sweep_compaction
+from HousingSchema import FEATURE_COLUMNS
 import pandas as pd
 
+# The split and model settings, a change to any of them means the cached model is retrained
+TEST_SIZE = 0.10
+RANDOM_STATE = 102
+
+# The default bounds of the prediction cache, in entries and in seconds
+PREDICTION_CACHE_SIZE = 1024
+PREDICTION_CACHE_TTL = 600
+
+# Incremental updates grow this many trees, and retrain from scratch once the forest would pass the maximum
+TREES_PER_UPDATE = 10
+MAX_ESTIMATORS = 200
+
+# Above this many predictions the fast plot draws a hexbin of the point density instead of every point
+HEXBIN_THRESHOLD = 5000
+
+
+def new_regressor():
+    """
+    :return: an untrained regressor with the model settings
+    """
+    return RandomForestRegressor(random_state=RANDOM_STATE)
+
+
+def model_key(housing_data) -> str:
+    """
+    Identifies a model by the data it is trained on and the settings used to train it.
+    :param housing_data: the processed house data including the price
+    :return: the key the model is cached under
+    """
+    return ResultCache.fingerprint(housing_data, sorted(new_regressor().get_params().items()),
+                                   TEST_SIZE, RANDOM_STATE, sklearn.__version__)
+
+
+def update_key(base_key, housing_data, n_estimators) -> str:
+    """
+    Identifies a model that was grown from another one with warm_start. It differs from the model_key of the same
+    data, so a later startup never loads a grown forest as if it were the model trained from scratch.
+    :param base_key: the key of the model the trees were added to
+    :param housing_data: the processed house data including the price the trees were added for
+    :param n_estimators: the number of trees of the grown forest
+    :return: the key the grown model is cached under
+    """
+    return ResultCache.fingerprint(base_key, model_key(housing_data), n_estimators)
+
+
+def in_holdout(ids) -> np.ndarray:
+    """
+    Decides from the id alone whether a house that arrives after training belongs to the holdout set, so that
+    about TEST_SIZE of the new houses are kept for testing and a house always lands on the same side.
+    :param ids: an array of house ids
+    :return: a boolean array, True for the houses that go to the holdout set
+    """
+    scrambled = (np.asarray(ids, dtype=np.uint64) * np.uint64(2654435761)) % np.uint64(1000)
+    return scrambled < TEST_SIZE * 1000
+
+def plot_predictions(y_test, y_predict, fast=False, residuals=False):
+    """
+    Creates a seaborn regplot of predicted house prices vs the actual house prices. It only needs the prices so
+    the figure can also be rendered in another process.
+    :param y_test: the true prices
+    :param y_predict: the predicted prices
+    :param fast: draw with plot_predictions_fast instead of seaborn
+    :param residuals: add a histogram of the residuals, only used by the fast plot
+    :return: a Figure object
+    """
+    if fast:
+        return plot_predictions_fast(y_test, y_predict, residuals)
+    reg_plot_price = sns.regplot(x=y_test, y=y_predict).get_figure()
+    plt.xlabel('True Values [Price]')
+    plt.ylabel('Predictions [Price]')
+    plt.title('RandomForest Regression predictions for the test data')
+    return reg_plot_price
+
+
+def plot_predictions_fast(y_test, y_predict, residuals=False, hexbin_threshold=HEXBIN_THRESHOLD):
+    """
+    Creates the predicted vs actual price plot on its own Figure, with a least squares fit line instead of the
+    bootstrapped confidence band of regplot. Many points are drawn as a hexbin density, so the drawing cost
+    stays the same however many houses are predicted.
+    :param y_test: the true prices
+    :param y_predict: the predicted prices
+    :param residuals: add a histogram of the differences between the predicted and true prices
+    :param hexbin_threshold: the number of points above which the hexbin is drawn
+    :return: a Figure object
+    """
+    y_test = np.asarray(y_test, dtype=np.float64)
+    y_predict = np.asarray(y_predict, dtype=np.float64)
+    figure = Figure(figsize=(12 if residuals else 6.4, 4.8))
+
+    price_plot = figure.add_subplot(1, 2 if residuals else 1, 1)
+    if len(y_test) > hexbin_threshold:
+        price_plot.hexbin(y_test, y_predict, gridsize=60, bins='log', mincnt=1, cmap='Blues')
+    else:
+        price_plot.scatter(y_test, y_predict, s=10, alpha=0.5)
+    slope, intercept = np.polyfit(y_test, y_predict, 1)
+    line_x = np.array([y_test.min(), y_test.max()])
+    price_plot.plot(line_x, slope * line_x + intercept, color='tab:orange')
+    price_plot.set(xlabel='True Values [Price]', ylabel='Predictions [Price]',
+                   title='RandomForest Regression predictions for the test data')
+
+    if residuals:
+        residual_plot = figure.add_subplot(1, 2, 2)
+        residual_plot.hist(y_predict - y_test, bins=50)
+        residual_plot.set(xlabel='Prediction - True Value [Price]', ylabel='Houses', title='Residuals')
+    figure.tight_layout()
+    return figure
+
+
 class PredictionTrainer:
     """
     Class that combines the entire prediction process into a single entity
     """
-    def __init__(self):
-        # Get the data from the database
-        conn = dc.connect()
-        housing_data = dc.download_housing_data(conn)
-        conn.close()
+    def __init__(self, use_cache=True, prediction_cache_size=PREDICTION_CACHE_SIZE,
+                 prediction_cache_ttl=PREDICTION_CACHE_TTL, on_progress=None):
+        """
+        :param use_cache: load a previously trained model for the same data and settings instead of retraining
+        :param prediction_cache_size: the most single house predictions remembered
+        :param prediction_cache_ttl: the seconds a remembered prediction stays valid
+        :param on_progress: called with the fraction done and a message as each stage of loading starts
+        """
+        report = on_progress or (lambda fraction, message: None)
+        self._prediction_cache = TTLCache(maxsize=prediction_cache_size, ttl=prediction_cache_ttl)
+        self._prediction_cache_lock = threading.Lock()
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.trained_hashes = None
+
+        # Get the shared processed data, it is loaded from the memory mapped snapshot of the database table
+        report(0.0, 'loading the house data')
+        housing_data = DataStore.get_processed_data()
+
+        # The model is identified by the data it was trained on and the settings used to train it
+        report(0.3, 'loading the saved price model')
+        self.model_key = model_key(housing_data)
+
+        cached_model = ResultCache.load('models', self.model_key) if use_cache else None
+        if cached_model is not None:
+            self.__dict__.update(cached_model)
+            self.model_changed()
+            report(1.0, 'price model loaded')
+            return
+
+        report(0.4, 'training the price model')
+        self.train(housing_data)
+        if use_cache:
+            report(0.9, 'saving the price model')
+            self.save_model()
+        report(1.0, 'price model trained')
+
+    def train(self, housing_data):
+        """
+        Splits the data and trains the forest from scratch.
+        :param housing_data: the processed house data including the price
+        """
+        # Remember what every house looked like so later updates can find the rows that changed
+        self.trained_hashes = dc.hash_rows(housing_data)
 
         price_data = housing_data['price'] # Choose the price data as the target
-        housing_data.drop(['price'], axis=1, inplace=True) # Drop the price data from the main feature set
+        housing_data = housing_data.drop(['price'], axis=1) # Drop the price data from the main feature set
         # Split the dataset into a traning set and test set.
         self.X = housing_data
         self.y = price_data
-        self.X_train, self.X_test, self.y_train, self.y_test = train_test_split(self.X, self.y, test_size=0.10, random_state=102)
+        self.X_train, self.X_test, self.y_train, self.y_test = train_test_split(self.X, self.y, test_size=TEST_SIZE,
+                                                                                random_state=RANDOM_STATE)
 
         # Train the data with Linear Regression.
         # Outcome has a lower accuracy of mean absolute error: 127497.25764150245 r2 score: 0.6914914635024427
@@ -37,7 +196,7 @@ class PredictionTrainer:
         # y_predict = regressor.predict(X_test)
 
         # Use a RandomForestRegressor() to create a prediction
-        self.regressor = RandomForestRegressor(random_state=102)
+        self.regressor = new_regressor()
         self.regressor.fit(self.X_train, self.y_train)
         self.y_predict = self.regressor.predict(self.X_test)
 
@@ -45,25 +204,173 @@ class PredictionTrainer:
         self.maerr = mean_absolute_error(self.y_test, self.y_predict)
         self.r2 = r2_score(self.y_test, self.y_predict)
 
+        self.model_changed()
+
+    def update(self, trees_per_update=TREES_PER_UPDATE, max_estimators=MAX_ESTIMATORS, use_cache=True) -> dict:
+        """
+        Brings the model up to date with the processed data without retraining it from scratch.
+
+        The houses that are new or changed since the model was trained are found from their content hashes.
+        Rows that changed or were removed leave the training and holdout sets, and new and changed rows are added
+        to one of them by id. Then a few more trees are grown with warm_start on the updated training set, and
+        the accuracy is measured again on the maintained holdout set. The older trees keep what they learned
+        from the previous data. The forest is retrained from scratch when it would grow past max_estimators or
+        when the model has no record of the data it was trained on.
+        :param trees_per_update: the number of trees to add
+        :param max_estimators: the largest forest grown before retraining from scratch
+        :param use_cache: save the updated model, a forest grown with warm_start is saved under its update_key
+        :return: a dict with the number of houses inserted, updated and deleted, the trees added and the scores
+        """
+        housing_data = DataStore.get_processed_data()
+        hashes = dc.hash_rows(housing_data)
+        trained_hashes = self.trained_hashes
+        summary = {'inserted': len(hashes), 'updated': 0, 'deleted': 0, 'trees_added': 0, 'full_retrain': False}
+
+        if trained_hashes is not None:
+            common_ids = hashes.index.intersection(trained_hashes.index)
+            changed_ids = common_ids[hashes[common_ids].values != trained_hashes[common_ids].values]
+            new_ids = hashes.index.difference(trained_hashes.index)
+            deleted_ids = trained_hashes.index.difference(hashes.index)
+            summary.update(inserted=len(new_ids), updated=len(changed_ids), deleted=len(deleted_ids))
+            if not (len(new_ids) or len(changed_ids) or len(deleted_ids)):
+                return dict(summary, n_estimators=len(self.regressor.estimators_), maerr=self.maerr, r2=self.r2)
+
+        grown_estimators = len(self.regressor.estimators_) + trees_per_update
+        if trained_hashes is None or grown_estimators > max_estimators:
+            self.train(housing_data)
+            self.model_key = model_key(housing_data)
+            summary['full_retrain'] = True
+        else:
+            stale_ids = deleted_ids.append(changed_ids)
+            arrived = housing_data[housing_data.index.isin(new_ids.append(changed_ids))]
+            arrived_in_holdout = in_holdout(arrived.index)
+
+            # Drop the old versions of the houses and add the arrivals to the training or holdout set
+            keep_train = ~self.X_train.index.isin(stale_ids)
+            keep_test = ~self.X_test.index.isin(stale_ids)
+            arrived_features = arrived.drop(['price'], axis=1)
+            self.X_train = pd.concat([self.X_train[keep_train], arrived_features[~arrived_in_holdout]])
+            self.y_train = pd.concat([self.y_train[keep_train], arrived['price'][~arrived_in_holdout]])
+            self.X_test = pd.concat([self.X_test[keep_test], arrived_features[arrived_in_holdout]])
+            self.y_test = pd.concat([self.y_test[keep_test], arrived['price'][arrived_in_holdout]])
+            self.X = housing_data.drop(['price'], axis=1)
+            self.y = housing_data['price']
+
+            # Only the added trees are fitted, the existing ones are kept as they are
+            self.regressor.set_params(warm_start=True, n_estimators=grown_estimators)
+            self.regressor.fit(self.X_train, self.y_train)
+            self.regressor.set_params(warm_start=False)
+            summary['trees_added'] = trees_per_update
+
+            self.y_predict = self.regressor.predict(self.X_test)
+            self.maerr = mean_absolute_error(self.y_test, self.y_predict)
+            self.r2 = r2_score(self.y_test, self.y_predict)
+            self.trained_hashes = hashes
+            self.model_key = update_key(self.model_key, housing_data, grown_estimators)
+            self.model_changed()
+
+        if use_cache:
+            self.save_model()
+        return dict(summary, n_estimators=len(self.regressor.estimators_), maerr=self.maerr, r2=self.r2)
+
+    def save_model(self):
+        """
+        Saves the trained model, the data split and the accuracy scores so later startups can skip training.
+        """
+        cached_fields = ['X', 'y', 'X_train', 'X_test', 'y_train', 'y_test', 'regressor', 'y_predict', 'maerr', 'r2',
+                         'trained_hashes']
+        ResultCache.store('models', self.model_key, {field: self.__dict__[field] for field in cached_fields})
+
+    def model_changed(self):
+        """
+        Forgets everything derived from the previous model, call it whenever the regressor is trained or loaded.
+        """
+        self._compiled_forest = None
+        with self._prediction_cache_lock:
+            self._prediction_cache.clear()
+
+    def prediction_cache_info(self) -> dict:
+        """
+        :return: a dict with the hits, misses, current size and bounds of the prediction cache
+        """
+        return {'hits': self.cache_hits, 'misses': self.cache_misses, 'size': len(self._prediction_cache),
+                'maxsize': self._prediction_cache.maxsize, 'ttl': self._prediction_cache.ttl}
+
+    def compiled_forest(self):
+        """
+        Exports the trained forest to flat arrays the first time it is needed.
+        :return: a CompiledForest that gives the same predictions as the regressor
+        """
+        if self._compiled_forest is None:
+            self._compiled_forest = CompiledForest.from_forest(self.regressor)
+        return self._compiled_forest
+
+    def compact_forest(self, max_depth=None, leaf_bits=None, merge_leaves=True):
+        """
+        Creates a smaller serving copy of the forest and compares its accuracy with the full forest on X_test.
+        The copy only needs NumPy, so scoring workers can load it without the scikit-learn model.
+        :param max_depth: the depth the trees are cut back to, None keeps the full depth
+        :param leaf_bits: 8 or 16 to store the leaf prices as codes, None keeps the exact prices
+        :param merge_leaves: merge splits whose two leaves predict the same price
+        :return: the compacted CompiledForest and a dict with its size and accuracy against the full forest
+        """
+        return evaluate_compaction(self.compiled_forest(), self.X_test.to_numpy(), self.y_test,
+                                   max_depth=max_depth, leaf_bits=leaf_bits, merge_leaves=merge_leaves)
+
+    def compaction_sweep(self, depths=(None, 30, 20, 15, 12), leaf_bits=(None, 16, 8)):
+        """
+        Compares the size and accuracy of the forest compacted with every combination of depth and leaf coding.
+        :return: a DataFrame with one row per combination, smallest model first
+        """
+        return sweep_compaction(self.compiled_forest(), self.X_test.to_numpy(), self.y_test, depths, leaf_bits)
+
     def predict_house_price(self,fields_data):
         """
         Takes in the features from the fields and returns a predicted value for the house.
+        The compiled forest is used so no DataFrame is built for the single house, and the price of a house that
+        was predicted recently by the same model is taken from the prediction cache.
         :return: predicted value for house
         """
-        house_features = pd.DataFrame(
-            [fields_data], columns=['bedrooms', 'bathrooms', 'sqft_living', 'floors',
-                      'waterfront', 'view', 'grade', 'sqft_basement', 'yr_built', 'yr_renovated', 'lat', 'long'])
+        cache_key = (self.model_key,) + tuple(float(field) for field in fields_data)
+        with self._prediction_cache_lock:
+            price = self._prediction_cache.get(cache_key)
+            if price is not None:
+                self.cache_hits += 1
+                return price
+            self.cache_misses += 1
+
+        price = self.compiled_forest().predict_one(fields_data)
+        with self._prediction_cache_lock:
+            self._prediction_cache[cache_key] = price
+        return price
 
+    def predict_prices(self, houses, n_jobs=None) -> np.ndarray:
+        """
+        Predicts the prices of many houses in a single call.
+        :param houses: a DataFrame with the feature columns, a NumPy array with the 12 features in the order of
+            FEATURE_COLUMNS, or an SQL query that selects the feature columns from the database
+        :param n_jobs: the number of cores the trees are evaluated on, -1 for all of them
+        :return: a NumPy array with the predicted price of every house
+        """
+        if isinstance(houses, str):
+            with dc.connection() as conn:
+                houses = pd.read_sql(houses, conn)
+        if isinstance(houses, pd.DataFrame):
+            house_features = houses[FEATURE_COLUMNS]
+        else:
+            house_features = pd.DataFrame(np.asarray(houses).reshape(-1, len(FEATURE_COLUMNS)),
+                                          columns=FEATURE_COLUMNS)
 
-        return self.regressor.predict(house_features)[0]
+        # The regressor is shared between threads, so the cores are set for this call only instead of on it. The
+        # forest leaves n_jobs as None, which makes it use the number of jobs of the active joblib backend
+        with joblib.parallel_backend('threading', n_jobs=n_jobs):
+            return self.regressor.predict(house_features)
 
-    def get_reg_pred_prices(self):
+    def get_reg_pred_prices(self, fast=False, residuals=False):
         """
         Creates and returns a seaborn regplot of the predicted house prices vs the actual house prices.
+        :param fast: draw the fit line and point density on a new Figure without seaborn
+        :param residuals: add a histogram of the residuals, only used by the fast plot
         :return: a Figure object
         """
-        reg_plot_price = sns.regplot(x=self.y_test, y=self.y_predict).get_figure()
-        plt.xlabel('True Values [Price]')
-        plt.ylabel('Predictions [Price]')
-        plt.title('RandomForest Regression predictions for the test data')
-        return reg_plot_price
\ No newline at end of file
+        return plot_predictions(self.y_test, self.y_predict, fast, residuals)
\ No newline at end of file
@@ -0,0 +1,108 @@
+"""
+A module that stores the results of expensive computations on disk so they can be reused between runs.
+
+Results are grouped by a namespace (for example 'models') and looked up by a key, which is normally a
+fingerprint of everything the result was computed from.
+"""
+import hashlib
+import os
+import joblib
+import pandas as pd
+
+# The folder that holds the cached results, next to the database
+current_directory = os.path.dirname(os.path.abspath(__file__))
+cache_directory = os.path.join(current_directory, "cache")
+
+
+def fingerprint(*parts) -> str:
+    """
+    Creates a stable hash from DataFrames, Series and any other values with a stable repr.
+    :param parts: the things the cached result depends on
+    :return: a hex digest that identifies the combination of parts
+    """
+    digest = hashlib.sha256()
+    for part in parts:
+        if isinstance(part, (pd.DataFrame, pd.Series)):
+            # Hash the values row by row, plus the layout so a renamed or retyped column changes the key
+            digest.update(pd.util.hash_pandas_object(part, index=True).values.tobytes())
+            if isinstance(part, pd.DataFrame):
+                digest.update(repr(list(zip(part.columns, part.dtypes.astype(str)))).encode())
+            else:
+                digest.update(repr((part.name, str(part.dtype))).encode())
+        else:
+            digest.update(repr(part).encode())
+        digest.update(b'|')
+    return digest.hexdigest()
+
+
+def cache_path(namespace, key, extension='joblib'):
+    """
+    Builds the path of a cached result.
+    :param namespace: the group the result belongs to
+    :param key: the fingerprint of the result
+    :param extension: the file extension of the result
+    :return: the absolute path of the cache file
+    """
+    return os.path.join(cache_directory, namespace, f"{key}.{extension}")
+
+
+def load(namespace, key):
+    """
+    Loads a cached result.
+    :param namespace: the group the result belongs to
+    :param key: the fingerprint of the result
+    :return: the stored object, or None when nothing is cached under the key
+    """
+    path = cache_path(namespace, key)
+    if not os.path.exists(path):
+        return None
+    try:
+        return joblib.load(path)
+    except Exception as err:
+        # A cache file that cannot be read is treated like a miss and recomputed
+        print(err)
+        return None
+
+
+def store(namespace, key, result, keep=3):
+    """
+    Stores a result in the cache. The file is written under a temporary name first so that a crash
+    never leaves a half written entry behind.
+    :param namespace: the group the result belongs to
+    :param key: the fingerprint of the result
+    :param result: any object joblib can pickle
+    :param keep: how many entries of the namespace to keep, the oldest are removed first
+    """
+    path = cache_path(namespace, key)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    joblib.dump(result, temp_path)
+    os.replace(temp_path, path)
+    prune(namespace, keep)
+
+
+def prune(namespace, keep):
+    """
+    Removes the oldest entries of a namespace.
+    :param namespace: the group to prune
+    :param keep: how many of the newest entries to keep
+    """
+    folder = os.path.join(cache_directory, namespace)
+    entries = [os.path.join(folder, name) for name in os.listdir(folder) if not name.endswith('.tmp')]
+    entries.sort(key=os.path.getmtime, reverse=True)
+    for old_entry in entries[keep:]:
+        try:
+            os.remove(old_entry)
+        except OSError as err:
+            print(err)
+
+
+def clear(namespace):
+    """
+    Removes every entry of a namespace.
+    :param namespace: the group to clear
+    """
+    folder = os.path.join(cache_directory, namespace)
+    if os.path.isdir(folder):
+        for name in os.listdir(folder):
+            os.remove(os.path.join(folder, name))
@@ -0,0 +1,124 @@
+"""
+SegmentedRegression trains one smaller price model per K-means segment of the houses instead of one global forest.
+
+The training houses are standardized and clustered, and the forest of every cluster is trained at the same time
+in a process pool. A house is priced by the model of the cluster whose centroid is nearest to it after scaling
+with the stored scaler.
+"""
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from sklearn.cluster import KMeans
+from sklearn.ensemble import RandomForestRegressor
+from sklearn.metrics import mean_absolute_error, r2_score
+from sklearn.preprocessing import StandardScaler
+from ForestInference import CompiledForest
+from HousingSchema import FEATURE_COLUMNS
+from RegressionPrediction import PredictionTrainer, RANDOM_STATE
+
+# The number of segments, the same as the clusters of the house clusters tab
+DEFAULT_SEGMENTS = 8
+
+
+def fit_segment(features, prices, n_estimators):
+    """
+    Trains the forest of one segment, run inside a worker process.
+    :param features: the training features of the houses in the segment
+    :param prices: the prices of the houses in the segment
+    :param n_estimators: the number of trees
+    :return: the fitted forest and the seconds it took to fit
+    """
+    start_time = time.perf_counter()
+    regressor = RandomForestRegressor(n_estimators=n_estimators, random_state=RANDOM_STATE)
+    regressor.fit(features, prices)
+    return regressor, time.perf_counter() - start_time
+
+
+class SegmentedPredictor:
+    """
+    A set of per-cluster regressors with the scaler and centroids that route each house to its cluster.
+    """
+    def __init__(self, trainer=None, n_segments=DEFAULT_SEGMENTS, n_estimators=100, n_workers=None):
+        """
+        :param trainer: the PredictionTrainer whose data split is used, the cached model is loaded when None
+        :param n_segments: the number of K-means clusters and so the number of models
+        :param n_estimators: the number of trees in each segment's forest
+        :param n_workers: the number of worker processes, one per core when None
+        """
+        self.trainer = PredictionTrainer() if trainer is None else trainer
+        X_train = self.trainer.X_train[FEATURE_COLUMNS]
+
+        self.scaler = StandardScaler().fit(X_train)
+        self.kmeans = KMeans(n_clusters=n_segments, init='k-means++', n_init=10, random_state=RANDOM_STATE)
+        labels = self.kmeans.fit_predict(self.scaler.transform(X_train))
+        self.centroids = self.kmeans.cluster_centers_
+
+        start_time = time.perf_counter()
+        with ProcessPoolExecutor(max_workers=n_workers or os.cpu_count()) as executor:
+            jobs = {segment: executor.submit(fit_segment, X_train[labels == segment],
+                                             self.trainer.y_train[labels == segment], n_estimators)
+                    for segment in range(n_segments)}
+            fitted = {segment: job.result() for segment, job in jobs.items()}
+        self.fit_seconds = time.perf_counter() - start_time
+        self.models = {segment: model for segment, (model, _) in fitted.items()}
+        self.segment_fit_seconds = {segment: seconds for segment, (_, seconds) in fitted.items()}
+        self.segment_sizes = np.bincount(labels, minlength=n_segments)
+        self.compiled_models = {}
+
+        # Check the accuracy on the same test houses as the global model
+        self.y_predict = self.predict_prices(self.trainer.X_test)
+        self.maerr = mean_absolute_error(self.trainer.y_test, self.y_predict)
+        self.r2 = r2_score(self.trainer.y_test, self.y_predict)
+
+    def route(self, features) -> np.ndarray:
+        """
+        Finds the segment of every house from the stored scaler and centroids.
+        :param features: a DataFrame or 2-D array of house features in the order of FEATURE_COLUMNS
+        :return: an array with the segment of every house
+        """
+        features = np.asarray(features, dtype=np.float64).reshape(-1, len(FEATURE_COLUMNS))
+        scaled = (features - self.scaler.mean_) / self.scaler.scale_
+        distances = ((scaled[:, None, :] - self.centroids[None, :, :]) ** 2).sum(axis=2)
+        return distances.argmin(axis=1)
+
+    def predict_prices(self, houses) -> np.ndarray:
+        """
+        Predicts the prices of many houses, each with the model of its segment.
+        :param houses: a DataFrame with the feature columns
+        :return: an array with the predicted price of every house
+        """
+        houses = houses[FEATURE_COLUMNS]
+        segments = self.route(houses)
+        prices = np.empty(len(houses))
+        for segment in np.unique(segments):
+            in_segment = segments == segment
+            prices[in_segment] = self.models[segment].predict(houses[in_segment])
+        return prices
+
+    def predict_house_price(self, fields_data):
+        """
+        Predicts the price of a single house with the model of its segment.
+        :param fields_data: the 12 features of the house in the order of FEATURE_COLUMNS
+        :return: the predicted price
+        """
+        segment = self.route(fields_data)[0]
+        if segment not in self.compiled_models:
+            self.compiled_models[segment] = CompiledForest.from_forest(self.models[segment])
+        return self.compiled_models[segment].predict_one(fields_data)
+
+    def compare(self) -> dict:
+        """
+        Compares the segmented models with the global forest of the trainer.
+        :return: a dict with the accuracy and tree sizes of both approaches and the per segment fit times
+        """
+        segment_nodes = [np.mean([tree.tree_.node_count for tree in model.estimators_])
+                         for model in self.models.values()]
+        return {'segmented_maerr': self.maerr, 'global_maerr': self.trainer.maerr,
+                'segmented_r2': self.r2, 'global_r2': self.trainer.r2,
+                'segmented_fit_seconds': self.fit_seconds,
+                'slowest_segment_fit_seconds': max(self.segment_fit_seconds.values()),
+                'segment_sizes': self.segment_sizes.tolist(),
+                'segmented_mean_tree_nodes': float(np.average(segment_nodes, weights=self.segment_sizes)),
+                'global_mean_tree_nodes': float(np.mean([tree.tree_.node_count
+                                                         for tree in self.trainer.regressor.estimators_]))}
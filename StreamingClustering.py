@@ -0,0 +1,102 @@
+"""
+StreamingClustering clusters the processed house data without loading the whole table into memory.
+
+house_data_processed is read from the database in chunks three times. The first pass collects the scaler
+statistics, the second trains MiniBatchKMeans and IncrementalPCA with partial_fit on the scaled chunks, and the
+third assigns every house to a cluster and writes the labels to the house_data_clusters table. Only one chunk
+and the fitted models are held in memory at a time, so regional tables of millions of houses can be clustered
+on modest machines.
+
+The labels go to their own table keyed by the house id rather than a new column of house_data_processed,
+because every column of that table is read as a model feature.
+
+Run it from the command line with:
+    python StreamingClustering.py --clusters 8 --chunksize 50000
+"""
+import argparse
+import time
+import numpy as np
+from sklearn.cluster import MiniBatchKMeans
+from sklearn.decomposition import IncrementalPCA
+from sklearn.preprocessing import StandardScaler
+import DatabaseConnection as dc
+from HousingSchema import FEATURE_COLUMNS
+from KmeansAnalysis import DEFAULT_CLUSTERS, MAX_PRICE
+
+
+def _chunks(chunksize, connection):
+    """
+    Streams the features of the processed houses that are not price outliers.
+    :param chunksize: the number of rows read at a time
+    :param connection: a sqlite3 Connection object
+    :return: a generator of feature DataFrames indexed by id
+    """
+    for chunk in dc.download_housing_data(connection, chunksize=chunksize):
+        yield chunk.loc[chunk['price'] < MAX_PRICE, FEATURE_COLUMNS]
+
+
+def stream_cluster(n_clusters=DEFAULT_CLUSTERS, chunksize=50000, epochs=1, n_components=2,
+                   random_state=0, connection=None) -> dict:
+    """
+    Fits the scaler, the clusters and the 2-D projection chunk by chunk and saves the cluster of every
+    processed house, including the price outliers, to house_data_clusters.
+    :param n_clusters: the number of clusters
+    :param chunksize: the number of rows read at a time, at least n_clusters
+    :param epochs: how many times the chunks are passed to MiniBatchKMeans
+    :param n_components: the dimensions of the PCA projection
+    :param random_state: the seed of MiniBatchKMeans
+    :param connection: a sqlite3 Connection, a pooled connection to the project database is used when None
+    :return: a dict with the fitted scaler, kmeans and pca, the cluster sizes and the rows per second
+    """
+    if connection is None:
+        with dc.connection() as conn:
+            return stream_cluster(n_clusters, chunksize, epochs, n_components, random_state, conn)
+
+    start_time = time.perf_counter()
+
+    # Pass 1: the mean and variance of every feature
+    scaler = StandardScaler()
+    for chunk in _chunks(chunksize, connection):
+        scaler.partial_fit(chunk)
+
+    # Pass 2: the clusters and the projection, each chunk is one mini batch
+    kmeans = MiniBatchKMeans(n_clusters=n_clusters, random_state=random_state)
+    pca = IncrementalPCA(n_components=n_components)
+    for epoch in range(epochs):
+        for chunk in _chunks(chunksize, connection):
+            scaled_chunk = scaler.transform(chunk)
+            # The first batch has to contain at least one house per cluster, and PCA one per component
+            if len(scaled_chunk) >= n_clusters or hasattr(kmeans, 'cluster_centers_'):
+                kmeans.partial_fit(scaled_chunk)
+            if epoch == 0 and len(scaled_chunk) >= n_components:
+                pca.partial_fit(scaled_chunk)
+    if not hasattr(kmeans, 'cluster_centers_'):
+        raise ValueError(f"a chunk needs at least {n_clusters} houses to start {n_clusters} clusters")
+
+    # Pass 3: label every house and write the labels while streaming
+    rows = 0
+    cluster_sizes = np.zeros(n_clusters, dtype=np.int64)
+    dc.clear_cluster_labels(connection)
+    for chunk in dc.download_housing_data(connection, chunksize=chunksize):
+        labels = kmeans.predict(scaler.transform(chunk[FEATURE_COLUMNS]))
+        dc.insert_cluster_labels(chunk.index, labels, connection)
+        cluster_sizes += np.bincount(labels, minlength=n_clusters)
+        rows += len(chunk)
+    dc.index_cluster_labels(connection)
+    connection.commit()
+    seconds = time.perf_counter() - start_time
+
+    return {'scaler': scaler, 'kmeans': kmeans, 'pca': pca, 'rows': rows, 'cluster_sizes': cluster_sizes.tolist(),
+            'seconds': seconds, 'rows_per_second': rows / seconds if seconds else 0.0}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Cluster the processed houses chunk by chunk.')
+    parser.add_argument('--clusters', type=int, default=DEFAULT_CLUSTERS, help='the number of clusters')
+    parser.add_argument('--chunksize', type=int, default=50000, help='rows read at a time')
+    parser.add_argument('--epochs', type=int, default=1, help='passes of the chunks through MiniBatchKMeans')
+    args = parser.parse_args()
+
+    result = stream_cluster(args.clusters, args.chunksize, args.epochs)
+    print(f"Clustered {result['rows']:,} houses in {result['seconds']:.2f}s "
+          f"({result['rows_per_second']:,.0f} rows/s), cluster sizes {result['cluster_sizes']}")
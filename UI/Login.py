@@ -18,14 +18,16 @@ def start(window, font_styles, photo):
     # Log into the program
     def login():
 
-        if dc.login_user(username_entry.get(), password_entry.get(), dc.connect()):
+        with dc.connection() as conn:
+            valid_login = dc.login_user(username_entry.get(), password_entry.get(), conn)
+
+        if valid_login:
 
             login_frame.pack_forget()
             window.minsize(1200, 800)  # Change the size of the window to a better size
             window.state('zoomed')  # maximize the window
             loading_bar = ttk.Progressbar(window, mode='determinate', length=500, maximum=100)
             loading_bar.pack(expand=True)
-            loading_bar.step(30)
             loading_bar.update_idletasks()
 
             window.update()
@@ -5,19 +5,50 @@ import tkinter as tk
 from tkinter import ttk
 from tkinter import messagebox
 from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
+import Comparables
 import DataPreprocessing as dpp
 import DatabaseConnection as dc
-import KmeansAnalysis
+import DataStore
+import FigureCache
 from RegressionPrediction import PredictionTrainer
+from UI import TaskExecutor
+
+# How often a tab checks whether its figure has been rendered, in milliseconds
+FIGURE_POLL_MS = 200
+# How long a lazy tab waits before it is built, so its placeholder is drawn first, in milliseconds
+LAZY_BUILD_DELAY_MS = 20
+
+
+def get_trainer(on_progress=None):
+    """
+    :param on_progress: called with the fraction done and a message as each loading stage starts, only when this
+                        call is the one that loads the trainer
+    :return: the PredictionTrainer of the current processed data, loaded or trained the first time it is needed
+    """
+    return DataStore.memoize('prediction_trainer', DataStore.PROCESSED_TABLE,
+                             lambda: PredictionTrainer(on_progress=on_progress))
+
+
+def show_task_error(error):
+    """
+    Tells the user that a background task failed.
+    :param error: the exception the task raised
+    """
+    messagebox.showerror("Error", str(error))
 
 
 def create_note_page(master, name):
     """
-    Creates a new tab note page in the notebook.
+    Creates a new tab note page in the notebook. When add_lazy_page already added a page with the name, that
+    page is returned so the tab builder fills it in.
     :param master: the root element of this page should be the Notebook
     :param name: the Name for the note page
     :return: the Frame containing the note page
     """
+    lazy_pages = getattr(master, 'lazy_pages', {})
+    if name in lazy_pages:
+        return lazy_pages[name]
+
     frame = ttk.Frame(master)
     master.add(frame, text=name)
     tab_content_lbl = ttk.Label(frame, text=name, style='NB.Title.Label')
@@ -26,6 +57,66 @@ def create_note_page(master, name):
     return frame
 
 
+def add_lazy_page(notebook, name, builder, load=None):
+    """
+    Adds a tab that shows a loading placeholder until it is first selected, then calls its builder.
+    :param notebook: the Notebook to add the tab to
+    :param name: the Name for the note page, the builder creates its page with the same name
+    :param builder: a function that builds the content of the tab, without arguments unless load is given
+    :param load: a function without arguments that is run in a background task first, the builder is called with
+                 its result so the window stays responsive while the tab's data loads
+    :return: the Frame containing the note page
+    """
+    if not hasattr(notebook, 'lazy_pages'):
+        notebook.lazy_pages = {}
+        notebook.lazy_builders = {}
+        notebook.bind('<<NotebookTabChanged>>', lambda event: build_page(notebook, notebook.select()))
+
+    page = create_note_page(notebook, name)
+    placeholder = ttk.Frame(page)
+    placeholder_lbl = ttk.Label(placeholder, text=f'loading {name}...')
+    placeholder_lbl.pack()
+    placeholder_bar = ttk.Progressbar(placeholder, mode='indeterminate', length=300)
+    placeholder_bar.pack(pady=(10, 0))
+    placeholder_bar.start()
+    placeholder.pack(pady=(50, 0))
+
+    notebook.lazy_pages[name] = page
+    notebook.lazy_builders[str(page)] = (builder, load, placeholder)
+    return page
+
+
+def build_page(notebook, page, delay=LAZY_BUILD_DELAY_MS):
+    """
+    Builds a lazy tab if it has not been built yet.
+    :param notebook: the Notebook holding the tab
+    :param page: the page Frame of the tab or its widget name
+    :param delay: milliseconds to wait so the placeholder is drawn first, 0 builds straight away
+    """
+    entry = notebook.lazy_builders.pop(str(page), None)
+    if entry is None:
+        return
+    builder, load, placeholder = entry
+
+    def build():
+        if load is None:
+            builder()
+            placeholder.destroy()
+            return
+
+        def loaded(result):
+            builder(result)
+            placeholder.destroy()
+
+        TaskExecutor.get_executor().submit(load, name=f'load {notebook.tab(page, "text")}', on_done=loaded,
+                                           on_error=show_task_error)
+
+    if delay:
+        notebook.after(delay, build)
+    else:
+        build()
+
+
 def create_description(master, text):
     """
     Create a scaling description text field to hold some information about the various graphs and interactive elements.
@@ -54,6 +145,46 @@ def display_plot(master_frame, plot):
     return canvas
 
 
+def display_cached_figure(master_frame, kind, key, *args, variant=''):
+    """
+    Displays the cached image of a figure straight away and renders it again in the background when it was drawn
+    from an older version of the data or the model.
+    :param master_frame: the parent frame of the image
+    :param kind: the figure to display, one of FigureCache.RENDERERS
+    :param key: the current version key of the figure
+    :param args: the arguments the figure is rendered from
+    :param variant: tells apart figures of the same kind
+    :return: the label holding the image
+    """
+    figure_lbl = ttk.Label(master_frame, text='rendering the figure...')
+    figure_lbl.pack(expand=True)
+
+    def show(path):
+        image = tk.PhotoImage(file=path)
+        figure_lbl.configure(image=image, text='')
+        # tkinter does not keep a reference to the image itself
+        figure_lbl.image = image
+
+    path, current = FigureCache.cached_figure(kind, key, variant)
+    if path is not None:
+        show(path)
+    if not current:
+        rendering = FigureCache.refresh(kind, key, *args, variant=variant)
+
+        def poll():
+            if not rendering.done():
+                figure_lbl.after(FIGURE_POLL_MS, poll)
+            elif rendering.exception() is not None:
+                print(rendering.exception())
+                figure_lbl.configure(text='the figure could not be rendered')
+            else:
+                show(rendering.result())
+
+        figure_lbl.after(FIGURE_POLL_MS, poll)
+
+    return figure_lbl
+
+
 def display_price_regression(master_frame, regressor):
     """
     Create and display the tab of the notebook that contains the price prediction regression line and the scored metrics
@@ -65,8 +196,9 @@ def display_price_regression(master_frame, regressor):
     reg_plot_tab = create_note_page(master_frame, "Regression Plot Price")
     # The price regression plot
     predict_plot_frame = ttk.Frame(reg_plot_tab)
-    reg_plot = regressor.get_reg_pred_prices()  # The price regression plot
-    display_plot(predict_plot_frame, reg_plot)  # Display the plot
+    # The price regression plot, rendered in the background when the model has changed
+    regression_key = FigureCache.figure_key(regressor.model_key, 'fast')
+    display_cached_figure(predict_plot_frame, 'regression', regression_key, regressor.y_test, regressor.y_predict)
     predict_plot_frame.pack(side='left')
 
     # The text area describing the plot and the metrics of accuracy
@@ -95,9 +227,10 @@ def display_house_clusters(master_frame):
     choose_hue_var = tk.StringVar()
     choose_hue_var.set('clusters')
 
-    # Display the plot
-    cluster_plot = KmeansAnalysis.get_clustering_plot(choose_hue_var.get())
-    display_plot(cluster_plot_frame, cluster_plot)
+    # Display the plot, rendered in the background when the processed data has changed
+    hue_choice = choose_hue_var.get()
+    cluster_key = FigureCache.figure_key(DataStore.data_version(DataStore.PROCESSED_TABLE), hue_choice)
+    display_cached_figure(cluster_plot_frame, 'clusters', cluster_key, hue_choice, variant=hue_choice)
 
 
 def display_data_analysis(master_frame):
@@ -107,11 +240,11 @@ def display_data_analysis(master_frame):
     """
     data_analysis = create_note_page(master_frame, "Data Analysis")
 
-    # Create  and display the plots
-    corr_and_outlier = dpp.create_plots()
+    # Display the plots, rendered in the background when the raw data has changed
     corr_and_outlier_frame = ttk.Frame(data_analysis)
     corr_and_outlier_frame.pack(side='left', padx=(100, 0))
-    display_plot(corr_and_outlier_frame, corr_and_outlier)
+    analysis_key = FigureCache.figure_key(DataStore.data_version(DataStore.RAW_TABLE))
+    display_cached_figure(corr_and_outlier_frame, 'analysis', analysis_key)
 
     # Create and display the text describing the plots
     text_frame = ttk.Frame(data_analysis)
@@ -127,14 +260,38 @@ def display_data_analysis(master_frame):
     text_frame.pack(side='left', padx=(100, 0))
 
 
-def display_prediction_engine(master_frame, current_window, regressor):
+def display_prediction_engine(master_frame, current_window, get_regressor):
     """
     Creates and displays the prediction engine that allows users to enter house features and get predicted house prices.
     :param master_frame: the parent frame of the note page
     :param current_window: the main window of the program; used to register the form validation functions
-    :param regressor: a regressor that can make predictions about the house price
+    :param get_regressor: a function returning a regressor that can make predictions about the house price, it is
+                          only called when the first price is predicted
     """
     prediction_engine = create_note_page(master_frame, "Price Prediction Engine")
+    tasks = TaskExecutor.get_executor()
+    # The prediction whose price is shown, the prices of predictions started before it are dropped so a slow
+    # earlier prediction never overwrites a newer one
+    latest_prediction = None
+
+    def predict_in_background(function, name, on_done=None, **options):
+        nonlocal latest_prediction
+        price_predicted_var.set("House Price: predicting...")
+        task = None
+
+        def predicted(price):
+            if task is latest_prediction:
+                price_predicted_var.set("House Price: ${:,.2f}".format(price))
+            if on_done is not None:
+                on_done(price)
+
+        task = latest_prediction = tasks.submit(function, name=name, on_done=predicted, on_error=show_task_error,
+                                                **options)
+
+    def show_not_valid():
+        nonlocal latest_prediction
+        latest_prediction = None
+        price_predicted_var.set('All fields must be valid for a prediction')
 
     fields_frame = ttk.Frame(prediction_engine)
     fields_frame.pack(side='left', padx=(200, 200))
@@ -348,12 +505,10 @@ def display_prediction_engine(master_frame, current_window, regressor):
             fields_list = [bedrooms, bathrooms, sqft_living, floors, waterfront, view, grade, sqft_basement, yr_built,
                            yr_renovated, lat, long]
 
-            price = regressor.predict_house_price(fields_list)
-            price_var = "House Price: ${:,.2f}".format(price)
-            price_predicted_var.set(price_var)
+            # The model may still be loading, so the prediction runs in the background
+            predict_in_background(lambda: get_regressor().predict_house_price(fields_list), 'predict the price')
         else:
-            not_valid = 'All fields must be valid for a prediction'
-            price_predicted_var.set(not_valid)
+            show_not_valid()
 
     # The predict button that executes the prediction functions
     predict_btn = ttk.Button(fields_frame, text="predict price", command=submit)
@@ -386,23 +541,63 @@ def display_prediction_engine(master_frame, current_window, regressor):
             fields_list = [bedrooms, bathrooms, sqft_living, floors, waterfront, view, grade, sqft_basement, yr_built,
                            yr_renovated, lat, long]
 
-            price = regressor.predict_house_price(fields_list)
+            # The prediction may have to load the model, so only the short insert afterwards holds the database
+            # write lock
+            def save_price(price):
+                if price:
+                    tasks.submit(dc.insert_data_into_saved, bedrooms, bathrooms, sqft_living, floors, waterfront,
+                                 view, grade, sqft_basement, yr_built, yr_renovated, lat, long, price,
+                                 name='save the price', writes_database=True, on_error=show_task_error,
+                                 on_done=lambda result: messagebox.showinfo("alert", "price was saved"))
 
-            price_var = "House Price: ${:,.2f}".format(price)
-
-            price_predicted_var.set(price_var)
-            if price:
-                dc.insert_data_into_saved(bedrooms, bathrooms, sqft_living, floors, waterfront, view, grade,
-                                          sqft_basement, yr_built, yr_renovated, lat, long, price)
-                messagebox.showinfo("alert", "price was saved")
+            predict_in_background(lambda: get_regressor().predict_house_price(fields_list), 'predict the price',
+                                  on_done=save_price)
 
         else:
-            not_valid = 'All fields must be valid for a prediction'
-            price_predicted_var.set(not_valid)
+            show_not_valid()
 
     save_btn = ttk.Button(fields_frame, text="save price", command=save)
     save_btn.pack()
 
+    # The closest sold houses to the entered location, only the newest search is shown
+    comparables_var = tk.StringVar()
+    comparables_lbl = ttk.Label(output_frame, textvariable=comparables_var, justify='left')
+    latest_comparables = None
+
+    def show_comparables():
+        """
+        Function command for the comparables button that lists the nearest sold houses and their prices.
+        The first search loads the houses and their index, so it runs in the background.
+        """
+        nonlocal latest_comparables
+        lat_valid = str(lat_valid_var.get())
+        long_valid = str(long_valid_var.get())
+
+        if lat_valid == 'valid' and long_valid == 'valid':
+            # The longitude is entered as a positive number of degrees west
+            lat = float(lat_entry.get())
+            long = -abs(float(long_entry.get()))
+            task = None
+
+            def found(comparables):
+                if task is not latest_comparables:
+                    return
+                lines = [f"{row.distance:.2f} km: ${row.price:,.0f} ({row.bedrooms:g} bed, {row.bathrooms:g} bath, "
+                         f"{row.sqft_living:,.0f} sqft, built {row.yr_built})" for row in comparables.itertuples()]
+                comparables_var.set("Nearest sales:\n" + "\n".join(lines))
+
+            comparables_var.set("Finding the nearest sales...")
+            task = latest_comparables = tasks.submit(Comparables.find_comparables, lat, long,
+                                                     name='find comparables', on_done=found,
+                                                     on_error=show_task_error)
+        else:
+            latest_comparables = None
+            comparables_var.set('The latitude and longitude must be valid to find comparables')
+
+    comparables_btn = ttk.Button(fields_frame, text="find comparables", command=show_comparables)
+    comparables_btn.pack()
+    comparables_lbl.pack()
+
 
 def display_saved_data(master_frame):
     """
@@ -418,9 +613,12 @@ def display_saved_data(master_frame):
     data_table.config(yscrollcommand=scrollbar.set)
     scrollbar.config(command=data_table.yview)
 
-    def query_saved_data():
+    def download_saved_data():
+        with dc.connection() as conn:
+            return dc.download_saved_data(conn)
+
+    def show_saved_data(data):
         data_table.delete(0, tk.END)
-        data = dc.download_saved_data(dc.connect())
         for index, row in data.iterrows():
             data_row = (
                 f"bedrooms: {row['bedrooms']} "
@@ -439,6 +637,9 @@ def display_saved_data(master_frame):
                 )
             data_table.insert(tk.END, data_row)
 
+    def query_saved_data():
+        TaskExecutor.get_executor().submit(download_saved_data, on_done=show_saved_data, on_error=show_task_error)
+
     query_house_data_btn = ttk.Button(data_view, text='view saved price predictions', command=query_saved_data)
     query_house_data_btn.pack()
 
@@ -449,6 +650,7 @@ def display_debug(master_frame):
     :param master_frame: the parent frame
     """
     maintenance = create_note_page(master_frame, "Maintenance")
+    tasks = TaskExecutor.get_executor()
 
     # Report an error to the database to be read by the product managers
     report_options = ttk.Frame(maintenance)
@@ -475,31 +677,88 @@ def display_debug(master_frame):
         de = data_error_var.get()
         ue = UI_error_var.get()
         fe = function_error_var.get()
-        dc.submit_error_report(report,de,ue,fe,dc.connect())
-        messagebox.showinfo("info", "thank you for reporting errors")
+
+        def submit_report():
+            with dc.connection() as conn:
+                dc.submit_error_report(report, de, ue, fe, conn)
+
+        tasks.submit(submit_report, writes_database=True, on_error=show_task_error,
+                     on_done=lambda result: messagebox.showinfo("info", "thank you for reporting errors"))
 
     report_error = ttk.Button(maintenance, text='submit error report', command=submit_err)
     report_error.pack()
     report_error_lbl = ttk.Label(maintenance, text='report an error in the program')
     report_error_lbl.pack()
 
-    # Reset the data in the database using the original data and reprocessing it
+    # Reset the data in the database using the original data and reprocessing it. The reset runs in the
+    # background and can be cancelled until the upload starts, the upload itself is one transaction that is
+    # never interrupted
+    reset_task = None
+    reset_progress_var = tk.StringVar()
+
+    def reprocess_data(task):
+        task.report(0, 'reading the raw data')
+        DataStore.get_raw_data()
+        task.check_cancelled()
+        task.report(0.5, 'uploading the processed data')
+        return dpp.upload_to_db_post_processed_data()
+
+    def reset_finished():
+        reset_data_btn.configure(state='normal')
+        cancel_reset_btn.configure(state='disabled')
+
+    def data_reset(changes):
+        reset_finished()
+        reset_progress_var.set('')
+        messagebox.showwarning("Data Reset", f"data has been reset: {changes['inserted']} added, "
+                                             f"{changes['updated']} updated, {changes['deleted']} removed")
+
+    def reset_cancelled():
+        reset_finished()
+        reset_progress_var.set('reset cancelled')
+
+    def reset_failed(error):
+        reset_finished()
+        reset_progress_var.set('')
+        show_task_error(error)
+
     def reset_data():
-        dpp.upload_to_db_post_processed_data()
-        messagebox.showwarning("Data Reset", "data has been reset")
+        nonlocal reset_task
+        reset_data_btn.configure(state='disabled')
+        cancel_reset_btn.configure(state='normal')
+        reset_task = tasks.submit(reprocess_data, name='reset data', with_task=True, writes_database=True,
+                                  on_progress=lambda fraction, message: reset_progress_var.set(message),
+                                  on_done=data_reset, on_cancel=reset_cancelled, on_error=reset_failed)
+
+    def cancel_reset():
+        if reset_task is not None:
+            reset_task.cancel()
 
     # Reset button to reset the database data
     reset_data_btn = ttk.Button(maintenance, text='reset data', command=reset_data)
     reset_data_btn.pack()
     reset_lbl = ttk.Label(maintenance, text='reset the processed data')
     reset_lbl.pack()
+    cancel_reset_btn = ttk.Button(maintenance, text='cancel reset', command=cancel_reset, state='disabled')
+    cancel_reset_btn.pack()
+    reset_progress_lbl = ttk.Label(maintenance, textvariable=reset_progress_var)
+    reset_progress_lbl.pack()
 
 
 def start(window, loading_bar):
     """Starts up the main window part of the application after validation from the login screen
         includes a progress bar as each component loads.
+
+    Every tab is built the first time it is selected and loads its data in a background task, so the window
+    is shown straight away and the progress bar follows the stages of loading the model of the first tab.
     """
-    regression_training = PredictionTrainer()
+    loading_var = tk.StringVar(value='loading...')
+    loading_lbl = ttk.Label(window, textvariable=loading_var)
+    loading_lbl.pack()
+
+    def progress(fraction, message):
+        loading_bar['value'] = 100 * fraction
+        loading_var.set(message)
 
     # Settings for this window
     style = ttk.Style()
@@ -510,35 +769,40 @@ def start(window, loading_bar):
     # Create the sections of the notebook
     # Tab 1 is the price dashboard with the display predicted price regression plot and the display of the
     # predicted accuracy
-    display_price_regression(tab_control, regression_training)
-    loading_bar.step(20)
-    loading_bar.update_idletasks()
+    first_page = add_lazy_page(tab_control, "Regression Plot Price",
+                               lambda trainer: display_price_regression(tab_control, trainer), load=get_trainer)
     # Tab 2 is the cluster analysis through k-means and graphing with a seaborn scatter plot
-    display_house_clusters(tab_control)
-    loading_bar.step(10)
-    loading_bar.update_idletasks()
+    add_lazy_page(tab_control, "House Clusters", lambda: display_house_clusters(tab_control))
     # Tab 3 is the data analysis booklet with the graphs of raw data that describe how the data mining choices were made
-    display_data_analysis(tab_control)
-    loading_bar.step(10)
-    loading_bar.update_idletasks()
+    add_lazy_page(tab_control, "Data Analysis", lambda: display_data_analysis(tab_control))
     # Tab 4 is an interactive prediction engine that gives a guess at the price for a set of features
-    display_prediction_engine(tab_control, window, regression_training)
-    loading_bar.step(10)
-    loading_bar.update_idletasks()
+    add_lazy_page(tab_control, "Price Prediction Engine",
+                  lambda: display_prediction_engine(tab_control, window, get_trainer))
     # Tab 5 contains saved price predictions in the database
-    display_saved_data(tab_control)
-    loading_bar.step(10)
-    loading_bar.update_idletasks()
+    add_lazy_page(tab_control, 'Data Manager', lambda: display_saved_data(tab_control))
     # Tab 6 program maintenance and debugging
-    display_debug(tab_control)
-    loading_bar.step(10)
-    loading_bar.update_idletasks()
+    add_lazy_page(tab_control, "Maintenance", lambda: display_debug(tab_control))
 
-    tab_control.pack(expand=1, fill="both")
+    def load_trainer(task):
+        return get_trainer(on_progress=task.report)
+
+    def loading_finished():
+        loading_bar.pack_forget()
+        loading_lbl.pack_forget()
 
-    # Update the progress bar as the window loads
-    loading_bar.step(10)
-    loading_bar.update_idletasks()
-    loading_bar.pack_forget()
+    def loaded(trainer):
+        progress(1, 'ready')
+        loading_finished()
+
+    def load_failed(error):
+        loading_finished()
+        show_task_error(error)
+
+    # The first tab is shown straight away and its model loads in the background, reporting each stage to the
+    # progress bar. Both tasks wait on the same DataStore entry, so the model is only loaded once
+    TaskExecutor.get_executor(window).submit(load_trainer, name='load the price model', with_task=True,
+                                             on_progress=progress, on_done=loaded, on_error=load_failed)
+    build_page(tab_control, first_page, delay=0)
+    tab_control.pack(expand=1, fill="both")
 
     return window
@@ -0,0 +1,220 @@
+"""
+TaskExecutor runs the slow work of the user interface in the background so the window never freezes.
+
+Tasks run in a thread pool. CPU heavy rendering already runs in processes of its own, see FigureCache. Tk
+widgets may only be used from the Tk thread, so a task never calls back into the interface itself: its progress, result or error
+is put on a queue that the Tk thread empties every POLL_MS milliseconds through after(). Tasks that write to the
+database hold a shared lock so their writes never interleave.
+"""
+import queue
+import threading
+import tkinter as tk
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+# How often the Tk thread runs the callbacks of finished tasks, in milliseconds
+POLL_MS = 100
+# The number of tasks that run at the same time
+MAX_THREADS = 4
+
+# The executor shared by the windows of the program, created by get_executor
+_executor = None
+
+
+class TaskCancelled(Exception):
+    """
+    Raised inside a task by Task.check_cancelled once the task has been cancelled.
+    """
+
+
+class Task:
+    """
+    A function running in the background. The function can report its progress and check whether it has been
+    cancelled through the task, which is passed to it when it was submitted with_task.
+    """
+    def __init__(self, executor, name, on_progress=None):
+        self.name = name
+        self.future = None
+        self._executor = executor
+        self._on_progress = on_progress
+        self._cancel_event = threading.Event()
+
+    @property
+    def cancelled(self) -> bool:
+        """
+        :return: whether the task has been asked to stop
+        """
+        return self._cancel_event.is_set()
+
+    def cancel(self):
+        """
+        Asks the task to stop. A task that has not started does not run at all, a running task stops the next time
+        it calls check_cancelled.
+        """
+        self._cancel_event.set()
+        if self.future is not None:
+            self.future.cancel()
+
+    def check_cancelled(self):
+        """
+        Stops the task when it has been cancelled, called from inside the task between its steps.
+        """
+        if self.cancelled:
+            raise TaskCancelled(self.name)
+
+    def report(self, fraction, message=''):
+        """
+        Reports the progress of the task, called from inside the task. The on_progress callback receives it on
+        the Tk thread.
+        :param fraction: how much of the task is done, from 0 to 1
+        :param message: what the task is doing
+        """
+        self._executor.post(self._on_progress, fraction, message)
+
+    def done(self) -> bool:
+        """
+        :return: whether the task has finished, failed or been cancelled
+        """
+        return self.future is not None and self.future.done()
+
+
+class TaskExecutor:
+    """
+    The thread pool that runs the tasks and the queue their callbacks wait on.
+    """
+    def __init__(self, max_threads=MAX_THREADS):
+        """
+        :param max_threads: the number of tasks that run at the same time
+        """
+        self._threads = ThreadPoolExecutor(max_workers=max_threads, thread_name_prefix='ui-task')
+        # The tasks that have not finished yet, so shutdown can cancel them
+        self._tasks = set()
+        self._callbacks = queue.Queue()
+        self._root = None
+        # Held by every task that writes to the database
+        self.database_lock = threading.Lock()
+
+    def start_polling(self, root, poll_ms=POLL_MS):
+        """
+        Runs the waiting callbacks on the Tk thread every poll_ms milliseconds.
+        :param root: the Tk root window
+        :param poll_ms: the polling interval in milliseconds
+        """
+        if self._root is not None:
+            return
+        self._root = root
+
+        def poll_loop():
+            try:
+                self.poll()
+            finally:
+                try:
+                    root.after(poll_ms, poll_loop)
+                except tk.TclError:
+                    # The window has been closed
+                    self._root = None
+
+        root.after(poll_ms, poll_loop)
+
+    def poll(self):
+        """
+        Runs the callbacks that are waiting on the queue, this must be called from the Tk thread. A callback that
+        raises is reported and the callbacks after it still run.
+        """
+        while True:
+            try:
+                callback, args = self._callbacks.get_nowait()
+            except queue.Empty:
+                return
+            try:
+                callback(*args)
+            except Exception as error:
+                self.report_error(error)
+
+    def report_error(self, error):
+        """
+        Reports an error that nothing else handles, through Tk like the errors of other callbacks when the
+        executor is polling a window and on stderr otherwise.
+        :param error: the exception
+        """
+        if self._root is not None:
+            self._root.report_callback_exception(type(error), error, error.__traceback__)
+        else:
+            traceback.print_exception(type(error), error, error.__traceback__)
+
+    def post(self, callback, *args):
+        """
+        Queues a callback to run on the Tk thread, nothing is queued when the callback is None.
+        """
+        if callback is not None:
+            self._callbacks.put((callback, args))
+
+    def submit(self, function, *args, name=None, on_done=None, on_error=None, on_progress=None, on_cancel=None,
+               writes_database=False, with_task=False) -> Task:
+        """
+        Runs a function in a background thread.
+        :param function: the function to run
+        :param args: the arguments of the function
+        :param name: a name for the task, the name of the function when None
+        :param on_done: called on the Tk thread with the result of the function
+        :param on_error: called on the Tk thread with the exception the function raised, it is reported with
+                         report_error when None
+        :param on_progress: called on the Tk thread with the fraction done and a message when the task reports
+        :param on_cancel: called on the Tk thread when the task stopped because it was cancelled
+        :param writes_database: hold the database lock while the function runs
+        :param with_task: pass the Task to the function as the task keyword argument
+        :return: the Task
+        """
+        task = Task(self, name or function.__name__, on_progress)
+
+        def run():
+            task.check_cancelled()
+            if writes_database:
+                with self.database_lock:
+                    task.check_cancelled()
+                    return function(*args, task=task) if with_task else function(*args)
+            return function(*args, task=task) if with_task else function(*args)
+
+        self._tasks.add(task)
+        task.future = self._threads.submit(run)
+        task.future.add_done_callback(lambda future: self._finish(task, on_done, on_error, on_cancel))
+        return task
+
+    def _finish(self, task, on_done, on_error, on_cancel):
+        """
+        Queues the callback that matches how a task ended, runs in the thread that finished the task.
+        """
+        self._tasks.discard(task)
+        future = task.future
+        if future.cancelled():
+            self.post(on_cancel)
+            return
+        error = future.exception()
+        if isinstance(error, TaskCancelled):
+            self.post(on_cancel)
+        elif error is not None:
+            self.post(on_error or self.report_error, error)
+        else:
+            self.post(on_done, future.result())
+
+    def shutdown(self):
+        """
+        Cancels the tasks, those that have not started never run and running ones stop at their next check,
+        and stops the pool once the running tasks finish.
+        """
+        for task in list(self._tasks):
+            task.cancel()
+        self._threads.shutdown(wait=False)
+
+
+def get_executor(root=None) -> TaskExecutor:
+    """
+    :param root: the Tk root window, the executor starts polling on it the first time one is given
+    :return: the TaskExecutor shared by the windows of the program
+    """
+    global _executor
+    if _executor is None:
+        _executor = TaskExecutor()
+    if root is not None:
+        _executor.start_polling(root)
+    return _executor
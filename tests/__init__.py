@@ -0,0 +1,15 @@
+"""
+The tests run against a temporary copy of the project database, so running them leaves the shipped database and
+the snapshot next to it as they are.
+"""
+import atexit
+import os
+import shutil
+import tempfile
+
+_test_directory = tempfile.mkdtemp(prefix='mccore_tests_')
+atexit.register(shutil.rmtree, _test_directory, ignore_errors=True)
+_test_database = os.path.join(_test_directory, 'mccore_investing_database.db')
+shutil.copyfile(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                             'mccore_investing_database.db'), _test_database)
+os.environ.setdefault('MCCORE_DATABASE', _test_database)
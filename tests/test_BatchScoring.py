@@ -0,0 +1,51 @@
+from unittest import TestCase
+import os
+import tempfile
+import pandas
+
+import BatchScoring
+import DatabaseConnection as dc
+import RegressionPrediction
+
+csv_path = os.path.join(dc.current_directory, 'misc', 'kc_house_data.csv')
+
+
+class TestBatchScoring(TestCase):
+
+    def test_score_csv(self):
+        """ Test that every house in the feed is scored with the same price as the single house prediction"""
+        trainer = RegressionPrediction.PredictionTrainer()
+        with tempfile.TemporaryDirectory() as directory:
+            input_path = os.path.join(directory, 'listings.csv')
+            output_path = os.path.join(directory, 'scored.csv')
+            pandas.read_csv(csv_path, nrows=250).to_csv(input_path, index=False)
+
+            result = BatchScoring.score_csv(input_path, trainer, output_path=output_path, chunksize=100)
+            scored = pandas.read_csv(output_path)
+
+        self.assertEqual(result['rows'], 250)
+        self.assertEqual(len(scored), 250)
+        first_house = scored.loc[0, RegressionPrediction.FEATURE_COLUMNS].tolist()
+        self.assertAlmostEqual(scored.loc[0, BatchScoring.PREDICTION_COLUMN],
+                               trainer.predict_house_price(first_house))
+
+    def test_score_csv_rejects_bad_rows(self):
+        """ Test that houses with a missing or out of range feature are reported instead of failing or wrapping"""
+        trainer = RegressionPrediction.PredictionTrainer()
+        with tempfile.TemporaryDirectory() as directory:
+            input_path = os.path.join(directory, 'listings.csv')
+            output_path = os.path.join(directory, 'scored.csv')
+            listings = pandas.read_csv(csv_path, nrows=6)
+            listings['bedrooms'] = listings['bedrooms'].astype('Int64')
+            listings.loc[1, 'bedrooms'] = None
+            listings.loc[3, 'grade'] = 300
+            listings.loc[4, 'yr_built'] = 70000
+            listings.to_csv(input_path, index=False)
+
+            result = BatchScoring.score_csv(input_path, trainer, output_path=output_path, chunksize=4)
+            scored = pandas.read_csv(output_path)
+
+        self.assertEqual(result['rows'], 3)
+        self.assertEqual(result['rejected_lines'], [3, 5, 6])
+        self.assertListEqual(scored['id'].tolist(), listings['id'][[0, 2, 5]].tolist())
+        self.assertEqual(scored['grade'].max(), listings['grade'][[0, 2, 5]].max())
@@ -0,0 +1,20 @@
+from unittest import TestCase
+import ColumnarSnapshot
+import DatabaseConnection as dc
+
+
+class TestColumnarSnapshot(TestCase):
+
+    def test_load_housing_data_matches_database(self):
+        """ Test that the snapshot holds the same data as the processed table and is at its data version"""
+        with dc.connection() as conn:
+            housing_data = dc.download_housing_data(conn)
+            version = dc.get_data_version(conn)
+
+        self.assertTrue(ColumnarSnapshot.load_housing_data().equals(housing_data))
+        self.assertEqual(ColumnarSnapshot.read_metadata()['version'], version)
+
+    def test_load_columns(self):
+        """ Test that only the requested columns and the id are opened"""
+        columns = ColumnarSnapshot.load_columns(['price', 'lat'])
+        self.assertEqual(list(columns), ['id', 'price', 'lat'])
@@ -0,0 +1,30 @@
+from unittest import TestCase
+import numpy as np
+import Comparables
+import DataStore
+
+
+class TestComparables(TestCase):
+
+    def test_find_comparables(self):
+        """ Test that the comparables of a location are the nearest houses, nearest first"""
+        comparables = Comparables.find_comparables(47.5, -122.3, k=5)
+        self.assertEqual(len(comparables), 5)
+        self.assertTrue(np.all(np.diff(comparables['distance']) >= 0))
+
+        # Compare with the haversine distance to every house
+        housing_data = DataStore.get_processed_data()
+        lat, long = np.radians(housing_data['lat']), np.radians(housing_data['long'])
+        a = np.sin((lat - np.radians(47.5)) / 2) ** 2 + \
+            np.cos(lat) * np.cos(np.radians(47.5)) * np.sin((long - np.radians(-122.3)) / 2) ** 2
+        distances = 2 * Comparables.EARTH_RADIUS_KM * np.arcsin(np.sqrt(a))
+        self.assertTrue(np.allclose(comparables['distance'], np.sort(distances)[:5]))
+
+    def test_nearest_comparables_batch(self):
+        """ Test that a batch of houses gets k comparables each, with every house its own nearest sale"""
+        houses = DataStore.get_processed_data().drop_duplicates(['lat', 'long'], keep=False).head(20)
+        for use_features in (False, True):
+            comparables = Comparables.nearest_comparables(houses, k=3, use_features=use_features)
+            self.assertEqual(len(comparables), 60)
+            nearest = comparables[comparables['rank'] == 1]
+            self.assertListEqual(nearest['id'].tolist(), houses.index.tolist())
@@ -0,0 +1,50 @@
+from unittest import TestCase
+import os
+import sqlite3
+import tempfile
+
+import DataIngestion
+import DatabaseConnection as dc
+
+csv_path = os.path.join(dc.current_directory, 'misc', 'kc_house_data.csv')
+
+
+class TestDataIngestion(TestCase):
+
+    def test_ingest_csv(self):
+        """ Test that every row of the extract is loaded with the dates parsed and the indexes built"""
+        connection = sqlite3.connect(':memory:')
+        result = DataIngestion.ingest_csv(csv_path, connection, chunksize=5000)
+
+        self.assertEqual(result['rows'], 21613)
+        self.assertEqual(connection.execute("SELECT COUNT(*) FROM kc_housing_data_raw").fetchone()[0], 21613)
+        first_date = connection.execute("SELECT date FROM kc_housing_data_raw LIMIT 1").fetchone()[0]
+        self.assertEqual(first_date, '2014-10-13 00:00:00')
+        indexes = connection.execute("SELECT name FROM sqlite_master WHERE type = 'index' AND "
+                                     "tbl_name = 'kc_housing_data_raw'").fetchall()
+        self.assertEqual(sorted(name for name, in indexes), sorted(DataIngestion.RAW_INDEXES))
+        connection.close()
+
+    def test_ingest_csv_rejects_bad_rows(self):
+        """ Test that rows with a missing or out of range value are reported and the other rows still load"""
+        folder = tempfile.TemporaryDirectory()
+        self.addCleanup(folder.cleanup)
+        bad_csv_path = os.path.join(folder.name, 'bad.csv')
+        with open(csv_path) as csv_file:
+            lines = [next(csv_file) for _ in range(6)]
+        header = lines[0].strip().split(',')
+        # Line 3 is missing its bedrooms and line 5 has a grade too large for an int8
+        for line_number, column, value in ((3, 'bedrooms', ''), (5, 'grade', '300')):
+            fields = lines[line_number - 1].strip().split(',')
+            fields[header.index(column)] = value
+            lines[line_number - 1] = ','.join(fields) + '\n'
+        with open(bad_csv_path, 'w') as bad_csv:
+            bad_csv.writelines(lines)
+
+        connection = sqlite3.connect(':memory:')
+        self.addCleanup(connection.close)
+        result = DataIngestion.ingest_csv(bad_csv_path, connection, chunksize=2)
+
+        self.assertEqual(result['rows'], 3)
+        self.assertEqual(result['rejected_lines'], [3, 5])
+        self.assertEqual(connection.execute("SELECT COUNT(*) FROM kc_housing_data_raw").fetchone()[0], 3)
@@ -0,0 +1,47 @@
+from unittest import TestCase
+import numpy as np
+import pandas as pd
+import DataStatistics
+
+
+class TestDataStatistics(TestCase):
+
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        size = 5000
+        sqft_living = rng.uniform(500, 5000, size)
+        self.data = pd.DataFrame({'price': 100000 + 200 * sqft_living + rng.normal(0, 50000, size),
+                                  'sqft_living': sqft_living, 'bedrooms': rng.integers(1, 6, size),
+                                  'date': '20141013T000000'})
+
+    def test_chunked_correlation(self):
+        """ Test that merging the moments of chunks gives the correlation of the whole table"""
+        chunks = [self.data.iloc[start:start + 700] for start in range(0, len(self.data), 700)]
+        summary = DataStatistics.compute_summary(chunks)
+        expected = self.data.drop(columns='date').corr()['price']
+        correlations = DataStatistics.price_correlations(summary)
+        self.assertListEqual(correlations.index.tolist(), ['price', 'sqft_living', 'bedrooms'])
+        self.assertTrue(np.allclose(correlations, expected[correlations.index]))
+        self.assertEqual(summary['rows'], len(self.data))
+
+    def test_binned_kde(self):
+        """ Test that the binned density integrates to one and peaks near the middle of the prices"""
+        summary = DataStatistics.compute_summary([self.data])
+        density = DataStatistics.price_density(summary)
+        self.assertAlmostEqual(density.sum() * summary['price_bin_width'], 1.0, places=2)
+        self.assertAlmostEqual(density.idxmax(), self.data['price'].median(), delta=100000)
+
+    def test_density_grid_covers_the_prices(self):
+        """ Test that the density grid reaches a bandwidth margin past the lowest and highest prices"""
+        summary = DataStatistics.compute_summary([self.data])
+        density = DataStatistics.price_density(summary)
+        self.assertLess(density.index[0], self.data['price'].min() - summary['price_bandwidth'])
+        self.assertGreater(density.index[-1], self.data['price'].max() + summary['price_bandwidth'])
+
+    def test_empty_table(self):
+        """ Test that a table without rows gives an empty summary instead of failing"""
+        for chunks in ([], [self.data.iloc[:0]]):
+            summary = DataStatistics.compute_summary(chunks)
+            self.assertEqual(summary['rows'], 0)
+            self.assertTrue(DataStatistics.price_density(summary).empty)
+            self.assertTrue(DataStatistics.price_correlations(summary).empty)
@@ -0,0 +1,51 @@
+from unittest import TestCase
+import threading
+import DataStore
+import DatabaseConnection as dc
+
+
+class TestDataStore(TestCase):
+
+    def test_get_processed_data_is_shared(self):
+        """ Test that the processed data is only loaded once and shared between callers"""
+        self.assertIs(DataStore.get_processed_data(), DataStore.get_processed_data())
+
+    def test_memoize_reloads_when_the_data_version_changes(self):
+        """ Test that a stored value is loaded again after its table moves on to a new version"""
+        loads = []
+
+        def loader():
+            loads.append(1)
+            return len(loads)
+
+        try:
+            self.assertEqual(DataStore.memoize('test_value', 'datastore_test_table', loader), 1)
+            self.assertEqual(DataStore.memoize('test_value', 'datastore_test_table', loader), 1)
+            with dc.connection() as conn:
+                dc.bump_data_version(conn, 'datastore_test_table')
+            self.assertEqual(DataStore.memoize('test_value', 'datastore_test_table', loader), 2)
+        finally:
+            DataStore.invalidate('test_value')
+            with dc.connection() as conn:
+                conn.execute("DELETE FROM data_versions WHERE table_name = 'datastore_test_table'")
+
+    def test_memoize_loads_different_values_concurrently(self):
+        """ Test that a slow loader does not hold up the loading of another value"""
+        started = threading.Event()
+        release = threading.Event()
+
+        def slow_loader():
+            started.set()
+            release.wait(10)
+            return 'slow'
+
+        slow = threading.Thread(target=DataStore.memoize, args=('test_slow', 'datastore_test_table', slow_loader))
+        slow.start()
+        try:
+            self.assertTrue(started.wait(10))
+            self.assertEqual(DataStore.memoize('test_fast', 'datastore_test_table', lambda: 'fast'), 'fast')
+        finally:
+            release.set()
+            slow.join()
+            DataStore.invalidate('test_slow')
+            DataStore.invalidate('test_fast')
@@ -1,8 +1,11 @@
 from unittest import TestCase
+import os
 import pandas
 import sqlite3
+import tempfile
 
 import DatabaseConnection as dc
+from ConnectionPool import ConnectionPool
 
 connection = dc.connect()  # Create a connection to the db
 
@@ -52,3 +55,71 @@ class DatabaseConnectionUnitTests(TestCase):
 
         # Compare the saved original data to the database obtained data
         self.assertEqual(test_params, data_from_db)
+
+    # Tests that connections are reused from the pool and opened in WAL mode
+    def test_pooled_connection_is_reused(self):
+        with dc.connection() as first:
+            journal_mode = first.execute("PRAGMA journal_mode").fetchone()[0]
+        with dc.connection() as second:
+            self.assertIs(first, second)
+
+        self.assertEqual(journal_mode.lower(), 'wal')
+        # connect() hands out its own connection and never takes a slot of the pool
+        self.assertIsNone(connection.pool)
+
+    # Tests that a nested with block neither commits nor rolls back the work of the outer block
+    def test_nested_connection_blocks(self):
+        folder = tempfile.TemporaryDirectory()
+        self.addCleanup(folder.cleanup)
+        test_pool = ConnectionPool(os.path.join(folder.name, 'test.db'))
+        self.addCleanup(test_pool.close_all)
+        with test_pool.connection() as conn:
+            conn.execute("CREATE TABLE numbers(number INTEGER)")
+
+        with self.assertRaises(ValueError):
+            with test_pool.connection() as outer:
+                outer.execute("INSERT INTO numbers VALUES(1)")
+                with test_pool.connection() as inner:
+                    inner.execute("INSERT INTO numbers VALUES(2)")
+                    inner.commit()
+                with self.assertRaises(ZeroDivisionError):
+                    with test_pool.connection() as inner:
+                        inner.execute("INSERT INTO numbers VALUES(3)")
+                        1 / 0
+                self.assertEqual(outer.execute("SELECT number FROM numbers").fetchall(), [(1,), (2,)])
+                raise ValueError
+
+        # The outer block raised, so nothing was committed
+        with test_pool.connection() as conn:
+            self.assertEqual(conn.execute("SELECT number FROM numbers").fetchall(), [])
+
+    # Tests that quotes in the login fields are treated as data and not as SQL
+    def test_login_user_rejects_injection(self):
+        with dc.connection() as conn:
+            self.assertFalse(dc.login_user("' OR '1'='1", "' OR '1'='1", conn))
+
+    # Tests that a second upload only writes the houses that changed and moves the data version on
+    def test_upload_processed_data_only_writes_changes(self):
+        test_connection = sqlite3.connect(':memory:')
+        df = dc.download_housing_data(connection)
+        first_upload = dc.upload_processed_data(df, test_connection)
+
+        changed_df = df.drop(df.index[:2])
+        changed_df.iloc[0, 0] += 1000
+        second_upload = dc.upload_processed_data(changed_df, test_connection)
+
+        self.assertEqual(second_upload['inserted'], 0)
+        self.assertEqual(second_upload['updated'], 1)
+        self.assertEqual(second_upload['deleted'], 2)
+        self.assertEqual(second_upload['version'], first_upload['version'] + 1)
+        self.assertEqual(len(dc.download_housing_data(test_connection)), len(changed_df))
+        test_connection.close()
+
+    # Tests that the downloads use the compact column types and can be read in chunks
+    def test_download_housing_data_in_chunks(self):
+        chunks = list(dc.download_housing_data(connection, chunksize=5000))
+
+        self.assertGreater(len(chunks), 1)
+        self.assertTrue(all(len(chunk) <= 5000 for chunk in chunks))
+        self.assertEqual(str(chunks[0]['grade'].dtype), 'int8')
+        self.assertEqual(sum(len(chunk) for chunk in chunks), len(dc.download_housing_data(connection)))
@@ -0,0 +1,23 @@
+from unittest import TestCase
+import os
+import numpy as np
+import FigureCache
+import ResultCache
+
+
+class TestFigureCache(TestCase):
+
+    def test_render_in_background(self):
+        """ Test that a figure is rendered in the worker process and then found for its key"""
+        self.addCleanup(ResultCache.clear, 'figures_regression_test')
+        key = FigureCache.figure_key('test', os.getpid())
+        y_test = np.linspace(100000, 900000, 50)
+        self.assertFalse(FigureCache.cached_figure('regression', key, variant='test')[1])
+
+        path = FigureCache.refresh('regression', key, y_test, y_test * 1.1, variant='test').result(timeout=120)
+        with open(path, 'rb') as image:
+            self.assertEqual(image.read(8), b'\x89PNG\r\n\x1a\n')
+        self.assertEqual(FigureCache.cached_figure('regression', key, variant='test'), (path, True))
+
+        # A new key falls back to the newest image until it is rendered
+        self.assertEqual(FigureCache.cached_figure('regression', key + 'new', variant='test'), (path, False))
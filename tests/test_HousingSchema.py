@@ -0,0 +1,16 @@
+from unittest import TestCase
+import pandas
+import HousingSchema
+
+
+class TestHousingSchema(TestCase):
+
+    def test_apply_schema(self):
+        """ Test that columns are made smaller only when every value fits the smaller type"""
+        df = pandas.DataFrame({'grade': [7, 13], 'bedrooms': [3, 400], 'yr_built': [1955.0, None], 'other': [1, 2]})
+        typed = HousingSchema.apply_schema(df)
+
+        self.assertEqual(str(typed['grade'].dtype), 'int8')
+        self.assertEqual(str(typed['bedrooms'].dtype), 'int64')  # 400 does not fit an int8
+        self.assertEqual(str(typed['yr_built'].dtype), 'float64')  # missing values cannot be an int16
+        self.assertEqual(str(typed['other'].dtype), 'int64')
@@ -1,4 +1,5 @@
 from unittest import TestCase
+from unittest import mock
 import KmeansAnalysis
 from matplotlib.figure import Figure
 
@@ -11,4 +12,40 @@ class Test(TestCase):
         self.assertIsNotNone(KmeansAnalysis.scaled_data)
         self.assertIsNotNone(KmeansAnalysis.price_data)
         self.assertTrue(isinstance(KmeansAnalysis.get_clustering_plot('price'), Figure))
-        self.assertTrue(isinstance(KmeansAnalysis.get_clustering_plot('clusters'), Figure))
\ No newline at end of file
+        self.assertTrue(isinstance(KmeansAnalysis.get_clustering_plot('clusters'), Figure))
+
+    def test_unknown_attribute_does_not_load(self):
+        """ Test that looking up an attribute that is not cluster data fails without loading the data"""
+        with mock.patch.object(KmeansAnalysis, 'get_cluster_data') as get_cluster_data:
+            self.assertFalse(hasattr(KmeansAnalysis, '__path__'))
+            self.assertIsNone(getattr(KmeansAnalysis, 'load_tests', None))
+        get_cluster_data.assert_not_called()
+
+    def test_get_cluster_fit(self):
+        """ Test that the clusters are fitted once and reused for every hue"""
+        cluster_fit = KmeansAnalysis.get_cluster_fit()
+        self.assertIs(KmeansAnalysis.get_cluster_fit(), cluster_fit)
+        self.assertEqual(len(cluster_fit['labels']), len(KmeansAnalysis.scaled_data))
+        self.assertEqual(cluster_fit['centroids'].shape, (KmeansAnalysis.DEFAULT_CLUSTERS, KmeansAnalysis.scaled_data.shape[1]))
+        self.assertEqual(cluster_fit['projection'].shape, (len(KmeansAnalysis.scaled_data), 2))
+
+    def test_elbow_search(self):
+        """ Test that the elbow search stops early on a flat curve and chooses a knee it has scored"""
+        self.assertEqual(KmeansAnalysis.find_knee([1, 2, 3, 4, 5], [-100, -40, -30, -25, -22]), 2)
+        self.assertIsNone(KmeansAnalysis.find_knee([1, 2], [-100, -40]))
+        curve = KmeansAnalysis.elbow_search(max_clusters=8, sample_size=2000, n_workers=2)
+        self.assertIn(curve['knee'], curve['clusters'])
+        self.assertEqual(curve['clusters'], list(range(1, len(curve['clusters']) + 1)))
+        self.assertIs(KmeansAnalysis.elbow_search(max_clusters=8, sample_size=2000, n_workers=2), curve)
+
+        # A curve too short for a knee falls back to a number of clusters that was scored
+        short_curve = KmeansAnalysis.elbow_search(max_clusters=2, sample_size=2000, n_workers=1)
+        self.assertEqual(short_curve['knee'], 2)
+
+    def test_raster_clustering_plot(self):
+        """ Test that above the threshold the cluster plot is a single density image for both hues"""
+        for hue in ('price', 'clusters'):
+            figure = KmeansAnalysis.get_clustering_plot(hue, n_clusters=4, raster_threshold=0)
+            self.assertTrue(isinstance(figure, Figure))
+            self.assertEqual(len(figure.axes[0].images), 1)
+            self.assertEqual(len(figure.axes[0].collections), 0)
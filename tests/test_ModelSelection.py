@@ -0,0 +1,22 @@
+from unittest import TestCase
+import sqlite3
+
+import DatabaseConnection as dc
+import ModelSelection
+
+
+class TestModelSelection(TestCase):
+
+    def test_benchmark_models(self):
+        """ Test that the leaderboard has a row per model with the speed and accuracy measurements"""
+        leaderboard = ModelSelection.benchmark_models(['LinearRegression', 'HistGradientBoosting'], n_splits=2,
+                                                      n_workers=2)
+
+        self.assertEqual(list(leaderboard['model']), ['HistGradientBoosting', 'LinearRegression'])
+        for column in ['fit_seconds', 'single_row_ms', 'batch_rows_per_second', 'model_bytes', 'maerr', 'r2']:
+            self.assertTrue((leaderboard[column] > 0).all())
+
+        connection = sqlite3.connect(':memory:')
+        dc.upload_model_leaderboard(leaderboard, connection)
+        self.assertEqual(len(dc.download_model_leaderboard(connection)), 2)
+        connection.close()
@@ -0,0 +1,51 @@
+from unittest import TestCase
+import sqlite3
+import pandas as pd
+import PriceTiles
+
+
+class TestPriceTiles(TestCase):
+
+    def setUp(self):
+        self.connection = sqlite3.connect(':memory:')
+        self.housing_data = pd.DataFrame({'price': [300000.0, 500000.0, 700000.0, 450000.0],
+                                          'sqft_living': [1000, 2000, 2500, 1500],
+                                          'bedrooms': [2, 3, 4, 3],
+                                          'lat': [47.51, 47.52, 47.71, 47.515],
+                                          'long': [-122.31, -122.32, -122.11, -122.312]},
+                                         index=pd.Index([1, 2, 3, 4], name='id'))
+
+    def tearDown(self):
+        self.connection.close()
+
+    def tiles(self):
+        return pd.read_sql('SELECT * FROM price_tiles ORDER BY tiles_per_degree, tile_lat, tile_long',
+                           self.connection)
+
+    def test_build_price_tiles(self):
+        """ Test that the tiles hold the aggregates of the houses in them at every resolution"""
+        result = PriceTiles.update_price_tiles(self.housing_data, self.connection)
+        tiles = self.tiles()
+        self.assertEqual(result['tiles_updated'], len(tiles))
+        self.assertSetEqual(set(tiles['tiles_per_degree']), set(PriceTiles.TILES_PER_DEGREE))
+        coarse = tiles[(tiles['tiles_per_degree'] == 10) & (tiles['tile_lat'] == 475)].iloc[0]
+        self.assertEqual(coarse['houses'], 3)
+        self.assertAlmostEqual(coarse['median_price'], 450000.0)
+        self.assertAlmostEqual(coarse['mean_price_per_sqft'], (300 + 250 + 300) / 3)
+
+    def test_incremental_update(self):
+        """ Test that only the tiles of changed houses are rebuilt and the result matches a full build"""
+        PriceTiles.update_price_tiles(self.housing_data, self.connection)
+        self.assertEqual(PriceTiles.update_price_tiles(self.housing_data, self.connection)['tiles_updated'], 0)
+
+        # A bedroom count is not part of the tiles, a price change and a removed house are
+        changed = self.housing_data.drop(3)
+        changed.loc[1, 'price'] = 320000.0
+        changed.loc[2, 'bedrooms'] = 5
+        result = PriceTiles.update_price_tiles(changed, self.connection)
+        self.assertEqual(result['houses_changed'], 2)
+        incremental = self.tiles()
+
+        self.connection.execute('DROP TABLE price_tiles')
+        PriceTiles.update_price_tiles(changed, self.connection)
+        pd.testing.assert_frame_equal(incremental, self.tiles())
@@ -1,5 +1,9 @@
 from unittest import TestCase
+import numpy as np
+import DataStore
 import RegressionPrediction
+from ForestInference import CompiledForest
+from sklearn.ensemble import RandomForestRegressor
 from matplotlib.figure import Figure
 
 class TestPredictionTrainer(TestCase):
@@ -15,3 +19,114 @@ class TestPredictionTrainer(TestCase):
         """ Test to make sure that the plot of the regression line is the correct type and returns"""
         regressor = RegressionPrediction.PredictionTrainer()
         self.assertTrue(isinstance(regressor.get_reg_pred_prices(), Figure))
+
+    def test_plot_predictions_fast(self):
+        """ Test that the fast plot draws the points or a hexbin on its own figure, with optional residuals"""
+        regressor = RegressionPrediction.PredictionTrainer()
+        self.assertEqual(len(regressor.get_reg_pred_prices(fast=True, residuals=True).axes), 2)
+        y_test = np.linspace(100000, 900000, RegressionPrediction.HEXBIN_THRESHOLD + 1)
+        figure = RegressionPrediction.plot_predictions_fast(y_test, y_test * 1.05)
+        self.assertEqual(len(figure.axes), 1)
+        self.assertEqual(len(figure.axes[0].collections), 1)
+
+    def test_cached_model_matches_trained_model(self):
+        """ Test to make sure that a model loaded from the cache gives the same results as a freshly trained one"""
+        trained = RegressionPrediction.PredictionTrainer(use_cache=False)
+        trained.save_model()
+        cached = RegressionPrediction.PredictionTrainer()
+        test_fields = [1, 1, 1000, 1, 1, 1, 1, 0, 1900, 0, 44, 77]
+        self.assertEqual(trained.model_key, cached.model_key)
+        self.assertEqual(trained.r2, cached.r2)
+        self.assertEqual(trained.predict_house_price(test_fields), cached.predict_house_price(test_fields))
+
+    def test_loading_progress(self):
+        """ Test to make sure that the loading stages are reported in order and end when the model is ready"""
+        trained = []
+        RegressionPrediction.PredictionTrainer(use_cache=False, on_progress=lambda *args: trained.append(args))
+        self.assertEqual([message for fraction, message in trained],
+                         ['loading the house data', 'loading the saved price model', 'training the price model',
+                          'price model trained'])
+        fractions = [fraction for fraction, message in trained]
+        self.assertEqual(fractions, sorted(fractions))
+        self.assertEqual(fractions[-1], 1.0)
+
+    def test_predict_prices(self):
+        """ Test that the batch prediction gives the same prices for a DataFrame, an array and an SQL query"""
+        regressor = RegressionPrediction.PredictionTrainer()
+        query = 'SELECT * FROM house_data_processed LIMIT 20'
+        houses = regressor.X_test.head(20)
+        from_frame = regressor.predict_prices(houses)
+        from_array = regressor.predict_prices(houses.to_numpy())
+
+        self.assertEqual(len(from_frame), 20)
+        self.assertTrue((from_frame == from_array).all())
+        self.assertEqual(from_frame[0], regressor.predict_house_price(houses.iloc[0].tolist()))
+        self.assertEqual(len(regressor.predict_prices(query, n_jobs=-1)), 20)
+
+    def test_compiled_forest_matches_regressor(self):
+        """ Test that the compiled forest gives exactly the same prices as the scikit-learn forest"""
+        regressor = RegressionPrediction.PredictionTrainer()
+        compiled = regressor.compiled_forest()
+        houses = regressor.X_test.head(200)
+        expected = regressor.regressor.predict(houses)
+
+        self.assertTrue((compiled.predict(houses.to_numpy()) == expected).all())
+        self.assertEqual(compiled.predict_one(houses.iloc[0].to_numpy()), expected[0])
+
+    def test_compact_forest(self):
+        """ Test that compaction without a depth limit or leaf coding is lossless and that pruning shrinks the model"""
+        regressor = RegressionPrediction.PredictionTrainer()
+        lossless, lossless_report = regressor.compact_forest()
+        pruned, pruned_report = regressor.compact_forest(max_depth=15, leaf_bits=16)
+
+        self.assertEqual(lossless_report['max_price_change'], 0)
+        self.assertLess(lossless.nbytes, regressor.compiled_forest().nbytes)
+        self.assertLess(pruned.nbytes, lossless.nbytes / 2)
+        self.assertLess(abs(pruned_report['maerr_change']), 0.05 * pruned_report['full_maerr'])
+
+    def test_compact_deep_forest(self):
+        """ Test that compaction stays lossless when the node ids of a tree no longer fit in 16 bits when doubled"""
+        rng = np.random.default_rng(0)
+        features = rng.random((12000, 12))
+        forest = RandomForestRegressor(n_estimators=1, bootstrap=False, random_state=0)
+        forest.fit(features, rng.random(12000))
+        self.assertGreater(forest.estimators_[0].tree_.node_count, 16384)
+
+        houses = rng.random((2000, 12))
+        compact = CompiledForest.from_forest(forest).compact()
+        self.assertTrue((compact.predict(houses) == forest.predict(houses)).all())
+
+    def test_prediction_cache(self):
+        """ Test that a repeated prediction is served from the cache and that reloading the model clears it"""
+        regressor = RegressionPrediction.PredictionTrainer()
+        test_fields = [1, 1, 1000, 1, 1, 1, 1, 0, 1900, 0, 44, 77]
+        first_price = regressor.predict_house_price(test_fields)
+        second_price = regressor.predict_house_price([float(field) for field in test_fields])
+
+        self.assertEqual(first_price, second_price)
+        self.assertEqual(regressor.prediction_cache_info()['hits'], 1)
+        self.assertEqual(regressor.prediction_cache_info()['misses'], 1)
+        regressor.model_changed()
+        self.assertEqual(regressor.prediction_cache_info()['size'], 0)
+
+    def test_update_grows_trees_for_new_rows(self):
+        """ Test that houses the model has not seen are added by growing more trees instead of retraining"""
+        regressor = RegressionPrediction.PredictionTrainer()
+        self.assertEqual(regressor.update(use_cache=False)['trees_added'], 0)
+
+        # Pretend the model was trained before the last 50 houses arrived
+        unseen_ids = regressor.trained_hashes.index[-50:]
+        regressor.trained_hashes = regressor.trained_hashes.drop(unseen_ids)
+        regressor.X_train = regressor.X_train[~regressor.X_train.index.isin(unseen_ids)]
+        regressor.y_train = regressor.y_train[~regressor.y_train.index.isin(unseen_ids)]
+        regressor.X_test = regressor.X_test[~regressor.X_test.index.isin(unseen_ids)]
+        regressor.y_test = regressor.y_test[~regressor.y_test.index.isin(unseen_ids)]
+        summary = regressor.update(trees_per_update=5, use_cache=False)
+
+        self.assertEqual(summary['inserted'], 50)
+        self.assertFalse(summary['full_retrain'])
+        self.assertEqual(summary['n_estimators'], 105)
+        # The grown forest is not stored under the key of the model trained from scratch on the same data
+        self.assertNotEqual(regressor.model_key, RegressionPrediction.model_key(DataStore.get_processed_data()))
+        self.assertEqual(len(regressor.X_train) + len(regressor.X_test), len(regressor.X))
+        self.assertGreater(regressor.r2, 0.8)
@@ -0,0 +1,21 @@
+from unittest import TestCase
+import RegressionPrediction
+import SegmentedRegression
+
+
+class TestSegmentedPredictor(TestCase):
+
+    def test_segmented_predictor(self):
+        """ Test that every house is routed to its nearest cluster and priced by that cluster's model"""
+        trainer = RegressionPrediction.PredictionTrainer()
+        segmented = SegmentedRegression.SegmentedPredictor(trainer, n_segments=3, n_estimators=10, n_workers=2)
+        houses = trainer.X_test.head(50)
+
+        scaled = segmented.scaler.transform(houses)
+        self.assertTrue((segmented.route(houses) == segmented.kmeans.predict(scaled)).all())
+        self.assertEqual(len(segmented.predict_prices(houses)), 50)
+        self.assertEqual(segmented.predict_house_price(houses.iloc[0].to_numpy()),
+                         segmented.predict_prices(houses.head(1))[0])
+        comparison = segmented.compare()
+        self.assertEqual(sum(comparison['segment_sizes']), len(trainer.X_train))
+        self.assertGreater(comparison['segmented_r2'], 0.7)
@@ -0,0 +1,26 @@
+from unittest import TestCase
+import sqlite3
+import DatabaseConnection as dc
+import StreamingClustering
+from HousingSchema import FEATURE_COLUMNS
+
+
+class TestStreamingClustering(TestCase):
+
+    def test_stream_cluster(self):
+        """ Test that every processed house gets a cluster in house_data_clusters"""
+        # Cluster a copy of the processed data so the project database is left as it is
+        with dc.connection() as conn:
+            housing_data = dc.download_housing_data(conn)
+        connection = sqlite3.connect(':memory:')
+        self.addCleanup(connection.close)
+        dc.upload_processed_data(housing_data, connection)
+
+        result = StreamingClustering.stream_cluster(n_clusters=4, chunksize=5000, connection=connection)
+        labels = dc.download_cluster_labels(connection)
+
+        self.assertEqual(result['rows'], len(housing_data))
+        self.assertEqual(sum(result['cluster_sizes']), len(housing_data))
+        self.assertListEqual(labels['id'].tolist(), housing_data.index.tolist())
+        self.assertTrue(labels['cluster_id'].between(0, 3).all())
+        self.assertEqual(result['pca'].components_.shape, (2, len(FEATURE_COLUMNS)))
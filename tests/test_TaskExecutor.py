@@ -0,0 +1,126 @@
+from unittest import TestCase
+import threading
+import time
+from UI import TaskExecutor
+
+
+def wait_for(executor, received, count=1, timeout=30):
+    """ Runs the callbacks as the Tk thread would until count of them have been received"""
+    deadline = time.monotonic() + timeout
+    while len(received) < count:
+        if time.monotonic() > deadline:
+            raise AssertionError('the task callbacks did not arrive in time')
+        time.sleep(0.01)
+        executor.poll()
+
+
+class StubRoot:
+    """ Stands in for the Tk window, running nothing until the test calls the scheduled function"""
+    def __init__(self):
+        self.scheduled = []
+        self.reported = []
+
+    def after(self, delay, function):
+        self.scheduled.append(function)
+
+    def report_callback_exception(self, error_type, error, trace):
+        self.reported.append(error)
+
+
+class TestTaskExecutor(TestCase):
+
+    def setUp(self):
+        self.executor = TaskExecutor.TaskExecutor()
+        self.addCleanup(self.executor.shutdown)
+
+    def test_callbacks(self):
+        """ Test that the result or the error of a task reaches its callback only when polled"""
+        results = []
+        task = self.executor.submit(lambda x: x * 2, 21, on_done=results.append)
+        while not task.done():
+            time.sleep(0.01)
+        self.assertEqual(results, [])
+        wait_for(self.executor, results)
+        self.assertEqual(results, [42])
+
+        errors = []
+        self.executor.submit(lambda: 1 / 0, on_done=results.append, on_error=errors.append)
+        wait_for(self.executor, errors)
+        self.assertEqual(results, [42])
+        self.assertIsInstance(errors[0], ZeroDivisionError)
+
+    def test_progress_and_cancel(self):
+        """ Test that a task reports its progress in order and stops at its next check once cancelled"""
+        progress = []
+        cancelled = []
+        started = threading.Event()
+        release = threading.Event()
+
+        def steps(task):
+            task.report(0, 'first')
+            started.set()
+            release.wait(5)
+            task.check_cancelled()
+            task.report(1, 'second')
+
+        task = self.executor.submit(steps, with_task=True, on_progress=lambda *args: progress.append(args),
+                                    on_done=lambda result: cancelled.append(False),
+                                    on_cancel=lambda: cancelled.append(True))
+        started.wait(5)
+        task.cancel()
+        release.set()
+        wait_for(self.executor, cancelled)
+        self.assertEqual(progress, [(0, 'first')])
+        self.assertEqual(cancelled, [True])
+
+    def test_database_lock(self):
+        """ Test that tasks writing to the database never run at the same time"""
+        running = []
+        overlaps = []
+
+        def write():
+            running.append(1)
+            overlaps.append(len(running))
+            time.sleep(0.05)
+            running.pop()
+
+        finished = []
+        for _ in range(3):
+            self.executor.submit(write, writes_database=True, on_done=finished.append)
+        wait_for(self.executor, finished, count=3)
+        self.assertEqual(overlaps, [1, 1, 1])
+
+    def test_raising_callback(self):
+        """ Test that a callback that raises is reported and neither stops the callbacks after it nor the polling"""
+        root = StubRoot()
+        self.executor.start_polling(root)
+        results = []
+
+        def fail(result):
+            raise ValueError('the widget is gone')
+
+        self.executor.post(fail, 1)
+        self.executor.post(results.append, 2)
+        root.scheduled.pop()()
+        self.assertEqual(results, [2])
+        self.assertIsInstance(root.reported[0], ValueError)
+
+        # The polling goes on and later results still arrive
+        self.assertEqual(len(root.scheduled), 1)
+        self.executor.submit(lambda: 3, on_done=results.append)
+        while len(results) < 2:
+            time.sleep(0.01)
+            root.scheduled.pop()()
+        self.assertEqual(results, [2, 3])
+
+    def test_shutdown_cancels_waiting_tasks(self):
+        """ Test that shutdown stops the tasks that are still waiting for a thread"""
+        executor = TaskExecutor.TaskExecutor(max_threads=1)
+        release = threading.Event()
+        ended = []
+        executor.submit(release.wait, 5, on_done=lambda result: ended.append('first'))
+        executor.submit(lambda: 'second', on_done=ended.append, on_cancel=lambda: ended.append('cancelled'))
+        executor.shutdown()
+        release.set()
+        wait_for(executor, ended, count=2)
+        self.assertEqual(sorted(ended), ['cancelled', 'first'])